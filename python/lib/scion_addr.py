@@ -19,6 +19,24 @@
 # SCION
 from lib.errors import SCIONParseError
 
+# numpy, if it is installed. It takes longer to import than the topology
+# generator, and is only imported once the first ISDASArray is created.
+np = None
+_np_imported = False
+
+
+def _import_numpy():
+    global np, _np_imported
+    if _np_imported:
+        return
+    _np_imported = True
+    try:
+        import numpy
+    except ImportError:  # pragma: no cover
+        # ISDASArray falls back to plain lists.
+        return
+    np = numpy
+
 
 class ISD_AS:
     """
@@ -27,7 +45,11 @@ class ISD_AS:
     lower 48 bits.
     See formatting and allocations here:
     https://github.com/scionproto/scion/wiki/ISD-and-AS-numbering
+
+    Instances are treated as immutable once parsed: they hash and compare on the packed
+    integer, and their string forms are computed only once.
     """
+    __slots__ = ("_isd", "_as", "_str", "_file_str")
     ISD_BITS = 16
     MAX_ISD = (1 << ISD_BITS) - 1
     AS_BITS = 48
@@ -38,13 +60,31 @@ class ISD_AS:
     HEX_SEPARATOR = ":"
     HEX_FILE_SEPARATOR = "_"
     MAX_HEX_AS_PART = 0xffff
+    # Cache of intern(), keyed by (class, raw string).
+    _interned = {}
 
     def __init__(self, raw=None):
         self._isd = 0
         self._as = 0
+        self._str = None
+        self._file_str = None
         if raw:
             self._parse(raw)
 
+    @classmethod
+    def intern(cls, raw):
+        """
+        Like the constructor, but returns the same instance for the same string, so that
+        equal ISD-ASes share their memoized string forms.
+
+        :param str raw: a string of the format "isd-as".
+        """
+        key = (cls, raw)
+        isd_as = cls._interned.get(key)
+        if isd_as is None:
+            isd_as = cls._interned[key] = cls(raw)
+        return isd_as
+
     def _parse(self, raw):
         """
         :param str raw: a string of the format "isd-as".
@@ -97,12 +137,23 @@ class ISD_AS:
         if self._as > self.MAX_AS:
             raise SCIONParseError("AS too large (max: %d): %s" % (self.MAX_AS, raw))
 
+    @classmethod
+    def from_int(cls, raw):
+        """
+        :param int raw: a 64-bit unsigned integer
+        """
+        isd_as = cls()
+        isd_as._parse_int(raw)
+        return isd_as
+
     def _parse_int(self, raw):
         """
         :param int raw: a 64-bit unsigned integer
         """
         self._isd = raw >> self.AS_BITS
         self._as = raw & self.MAX_AS
+        self._str = None
+        self._file_str = None
 
     def int(self):
         isd_as = self._isd << self.AS_BITS
@@ -115,7 +166,9 @@ class ISD_AS:
     def is_zero(self):  # pragma: no cover
         return self._isd == 0 and self._as == 0
 
-    def __eq__(self, other):  # pragma: no cover
+    def __eq__(self, other):
+        if not isinstance(other, ISD_AS):
+            return NotImplemented
         return self._isd == other._isd and self._as == other._as
 
     def isd_str(self):
@@ -129,22 +182,25 @@ class ISD_AS:
         if self._as > self.MAX_AS:
             return "%s [Illegal AS: larger than %d]" % (dec_str, self.MAX_AS)
         if self._as <= self.MAX_BGP_AS:
-            return str(self._as)
-        s = []
+            return dec_str
         as_ = self._as
-        for i in range(self.HEX_AS_PARTS):
-            s.insert(0, "%x" % (as_ & self.MAX_HEX_AS_PART))
-            as_ >>= 16
-        return sep.join(s)
+        part = self.MAX_HEX_AS_PART
+        return "%x%s%x%s%x" % ((as_ >> 32) & part, sep, (as_ >> 16) & part, sep, as_ & part)
 
     def as_file_fmt(self):
         return self.as_str(self.HEX_FILE_SEPARATOR)
 
     def file_fmt(self):
-        return "%s-%s" % (self.isd_str(), self.as_file_fmt())
+        if self._file_str is None:
+            self._file_str = "%s-%s" % (self.isd_str(), self.as_file_fmt())
+        return self._file_str
 
     def __str__(self, as_sep=HEX_SEPARATOR):
-        return "%s-%s" % (self.isd_str(), self.as_str(as_sep))
+        if as_sep != self.HEX_SEPARATOR:
+            return "%s-%s" % (self.isd_str(), self.as_str(as_sep))
+        if self._str is None:
+            self._str = "%s-%s" % (self.isd_str(), self.as_str(as_sep))
+        return self._str
 
     def __repr__(self):  # pragma: no cover
         return "ISD_AS(isd=%s, as=%s)" % (self._isd, self._as)
@@ -152,5 +208,128 @@ class ISD_AS:
     def __len__(self):  # pragma: no cover
         return self.LEN
 
-    def __hash__(self):  # pragma: no cover
-        return hash(str(self))
+    def __hash__(self):
+        return hash((self._isd << self.AS_BITS) | self._as)
+
+
+class ISDASArray:
+    """
+    An ordered array of ISD-AS pairs, stored as their 64-bit integer form, for queries
+    over all ASes of a topology. The array is backed by a numpy uint64 array if numpy is
+    installed, and by a list otherwise. Masks are boolean numpy arrays or lists of bools,
+    respectively, and are only meant to be passed back to the array that created them.
+    """
+
+    def __init__(self, isd_ases):
+        """
+        :param isd_ases: an iterable of ISD_AS (or subclass) instances.
+        """
+        _import_numpy()
+        self._items = list(isd_ases)
+        ints = [isd_as.int() for isd_as in self._items]
+        self._ints = np.array(ints, dtype=np.uint64) if np is not None else ints
+
+    @classmethod
+    def from_strs(cls, raws, isd_as_cls=ISD_AS):
+        """
+        :param raws: an iterable of strings of the format "isd-as".
+        :param type isd_as_cls: the class of the elements, e.g. TopoID.
+        """
+        return cls(isd_as_cls.intern(raw) for raw in raws)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, idx):
+        return self._items[idx]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def strs(self):
+        return [str(isd_as) for isd_as in self._items]
+
+    def file_fmts(self):
+        return [isd_as.file_fmt() for isd_as in self._items]
+
+    def isds(self):
+        if np is not None:
+            return self._ints >> np.uint64(ISD_AS.AS_BITS)
+        return [i >> ISD_AS.AS_BITS for i in self._ints]
+
+    def ases(self):
+        if np is not None:
+            return self._ints & np.uint64(ISD_AS.MAX_AS)
+        return [i & ISD_AS.MAX_AS for i in self._ints]
+
+    def isd_mask(self, isd):
+        """
+        :param int isd: the ISD number.
+        :returns: the mask of the elements in the ISD.
+        """
+        if np is not None:
+            return self.isds() == np.uint64(isd)
+        return [i == isd for i in self.isds()]
+
+    def member_mask(self, isd_ases):
+        """
+        :param isd_ases: an iterable of ISD_AS instances, e.g. all core ASes.
+        :returns: the mask of the elements that are one of isd_ases.
+        """
+        ints = {isd_as.int() for isd_as in isd_ases}
+        if np is not None:
+            return np.isin(self._ints, np.array(sorted(ints), dtype=np.uint64))
+        return [i in ints for i in self._ints]
+
+    def ne_mask(self, isd_as):
+        """
+        :returns: the mask of the elements that are not equal to isd_as.
+        """
+        if np is not None:
+            return self._ints != np.uint64(isd_as.int())
+        raw = isd_as.int()
+        return [i != raw for i in self._ints]
+
+    @staticmethod
+    def mask_and(*masks):
+        if np is not None:
+            return np.logical_and.reduce(masks)
+        return [all(bits) for bits in zip(*masks)]
+
+    @staticmethod
+    def nonzero(mask):
+        """
+        :returns: the indices for which mask is set, in order.
+        :rtype: list
+        """
+        if np is not None:
+            return np.flatnonzero(mask).tolist()
+        return [i for i, bit in enumerate(mask) if bit]
+
+    def select(self, mask):
+        """
+        :returns: the elements for which mask is set, in order.
+        :rtype: list
+        """
+        return [self._items[i] for i in self.nonzero(mask)]
+
+    def duplicate_ases(self):
+        """
+        Returns the elements whose AS number already occurred at an earlier index,
+        regardless of their ISD.
+
+        :rtype: list
+        """
+        ases = self.ases()
+        if np is not None:
+            _, first = np.unique(ases, return_index=True)
+            dup = np.ones(len(self._items), dtype=bool)
+            dup[first] = False
+            return self.select(dup)
+        seen = set()
+        dups = []
+        for isd_as, as_ in zip(self._items, ases):
+            if as_ in seen:
+                dups.append(isd_as)
+            seen.add(as_)
+        return dups
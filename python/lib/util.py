@@ -18,11 +18,20 @@
 Various utilities for SCION functionality.
 """
 # Stdlib
+import errno
+import hashlib
 import os
+import queue
+import re
+import threading
 
 # External packages
 import json
 import yaml
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 # SCION
 from lib.errors import (
@@ -31,11 +40,203 @@ from lib.errors import (
 )
 
 
+#: The manifest consulted and updated by write_file, if any.
+_write_manifest = None
+#: The writer that write_file queues files to, if any.
+_batch_writer = None
+
+# The libyaml based dumper and loader produce the same documents as the
+# pure-Python ones, but are much faster.
+YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+YAML_SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+#: Whether dump_yaml, dump_json and load_yaml_file use the fast backends.
+_fast_serializers = True
+# A float in exponent notation (or a string that looks like it) in JSON.
+_EXP_FLOAT = re.compile(rb"[0-9][eE]")
+# The errors of O_TMPFILE and linkat through /proc if the file system, or the
+# sandbox, does not support them.
+_TMPFILE_UNSUPPORTED = (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL, errno.EXDEV,
+                        errno.ENOENT, errno.EPERM)
+
+
+class WriteManifest(object):
+    """
+    Content hashes of the files written below a root directory. While a
+    manifest is active (see set_write_manifest), write_file skips files whose
+    content did not change since the manifest was last saved.
+
+    Generators can also keep some state of their own across runs, by key, in
+    state. The state of the previous run is in old_state.
+    """
+    FILE_NAME = ".manifest.json"
+
+    def __init__(self, root, old=None, old_state=None):
+        """
+        :param str root: the directory the manifest covers.
+        :param dict old: relative path -> [sha256, size] of the previous run.
+        :param dict old_state: the state of the previous run.
+        """
+        self.root = root
+        self.old = old or {}
+        self.old_state = old_state or {}
+        self.files = {}
+        self.state = {}
+        self.changed = set()
+        # (relative path, [sha256, size], changed) for every file recorded, in
+        # order, so that records can be shipped from worker processes.
+        self.journal = []
+
+    @classmethod
+    def load(cls, root):
+        """
+        Load the manifest saved in root. A missing or unreadable manifest results
+        in an empty one, i.e. all files are written.
+        """
+        try:
+            with open(os.path.join(root, cls.FILE_NAME)) as f:
+                data = json.load(f)
+            old, old_state = data["files"], data.get("state", {})
+        except (OSError, ValueError, KeyError, TypeError):
+            old, old_state = {}, {}
+        return cls(root, old, old_state)
+
+    def _rel(self, file_path):
+        rel = os.path.relpath(file_path, self.root)
+        if rel.startswith(os.pardir):
+            return None
+        return rel
+
+    def needs_write(self, file_path, text):
+        """
+        Record the new content of file_path.
+
+        :returns: whether the file has to be (re)written.
+        :rtype: bool
+        """
+        rel = self._rel(file_path)
+        if rel is None:
+            return True
+        data = text.encode()
+        entry = [hashlib.sha256(data).hexdigest(), len(data)]
+        unchanged = self.old.get(rel) == entry and _file_size(file_path) == len(data)
+        self.record(rel, entry, not unchanged)
+        return not unchanged
+
+    def record_file(self, file_path, entry=None):
+        """
+        Record a file that was written, or kept, by other means than
+        write_file, e.g. copied. It counts as changed if its content differs
+        from the previous run.
+
+        :param str file_path: the path of the file.
+        :param list entry: the [sha256, size] of its content, if known, see
+            file_entry.
+        """
+        rel = self._rel(file_path)
+        if rel is None:
+            return
+        if entry is None:
+            entry = file_entry(file_path)
+        self.record(rel, entry, self.old.get(rel) != entry)
+
+    def record(self, rel, entry, changed):
+        self.files[rel] = entry
+        if changed:
+            self.changed.add(rel)
+        self.journal.append((rel, entry, changed))
+
+    def merge(self, journal):
+        """
+        Merge records produced by a copy of this manifest in another process.
+        """
+        for rel, entry, changed in journal:
+            self.record(rel, entry, changed)
+
+    def orphans(self):
+        return sorted(set(self.old) - set(self.files))
+
+    def remove_orphans(self):
+        """
+        Remove the files of the previous run that were not written in this run,
+        as well as directories left empty by that.
+
+        :returns: the removed files, relative to the root.
+        :rtype: list
+        """
+        removed = self.orphans()
+        for rel in removed:
+            path = os.path.join(self.root, rel)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                raise SCIONIOError("Error removing '%s': %s" % (path, e.strerror)) from None
+            dir_ = os.path.dirname(path)
+            while os.path.abspath(dir_) != os.path.abspath(self.root):
+                try:
+                    os.rmdir(dir_)
+                except OSError:
+                    break
+                dir_ = os.path.dirname(dir_)
+        return removed
+
+    def save(self):
+        path = os.path.join(self.root, self.FILE_NAME)
+        try:
+            with open(path, 'w') as f:
+                json.dump({"files": self.files, "state": self.state}, f, sort_keys=True)
+        except OSError as e:
+            raise SCIONIOError("Error writing manifest '%s': %s" % (path, e.strerror)) from None
+
+
+def set_write_manifest(manifest):
+    """
+    Make write_file consult and update manifest, or stop doing so if None.
+    """
+    global _write_manifest
+    _write_manifest = manifest
+
+
+def get_write_manifest():
+    return _write_manifest
+
+
+def file_entry(file_path):
+    """
+    :returns: the [sha256, size] of the content of a file, as recorded in a
+        WriteManifest.
+    :rtype: list
+    :raises:
+        lib.errors.SCIONIOError: the file cannot be read.
+    """
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+                size += len(chunk)
+    except OSError as e:
+        raise SCIONIOError("Error reading '%s': %s" % (file_path, e.strerror)) from None
+    return [h.hexdigest(), size]
+
+
+def _file_size(file_path):
+    try:
+        return os.stat(file_path).st_size
+    except OSError:
+        return None
+
+
 def write_file(file_path, text):
     """
     Write some text into a temporary file, creating its directory as needed, and
     then atomically move to target location.
 
+    If a WriteManifest is active and the file already has the given content,
+    nothing is written.
+
     :param str file_path: the path to the file.
     :param str text: the file content.
     :raises:
@@ -44,24 +245,239 @@ def write_file(file_path, text):
     # ":" is an illegal filename char on both windows and OSX, so disallow it globally to prevent
     # incompatibility.
     assert ":" not in file_path, file_path
-    dir_ = os.path.dirname(file_path)
+    if _write_manifest is not None and not _write_manifest.needs_write(file_path, text):
+        return
+    if _batch_writer is not None:
+        _batch_writer.submit(file_path, text)
+        return
+    _makedirs(os.path.dirname(file_path))
+    _write_atomic(file_path, text)
+
+
+def _makedirs(dir_):
     try:
         os.makedirs(dir_, exist_ok=True)
     except OSError as e:
         raise SCIONIOError("Error creating '%s' dir: %s" %
                            (dir_, e.strerror)) from None
+
+
+def _write_atomic(file_path, text, use_tmpfile=False):
+    """
+    Write text to file_path + ".new" and rename it to file_path. With
+    use_tmpfile, the content is written to an unnamed O_TMPFILE file that is
+    only linked as file_path + ".new" once it is complete.
+
+    :returns: whether O_TMPFILE was used.
+    """
     tmp_file = file_path + ".new"
-    try:
-        with open(tmp_file, 'w') as f:
-            f.write(text)
-    except OSError as e:
-        raise SCIONIOError("Error creating/writing to temp file '%s': %s" %
-                           (file_path, e.strerror)) from None
+    tmpfile_used = use_tmpfile and _write_tmpfile(tmp_file, text)
+    if not tmpfile_used:
+        try:
+            with open(tmp_file, 'w') as f:
+                f.write(text)
+        except OSError as e:
+            raise SCIONIOError("Error creating/writing to temp file '%s': %s" %
+                               (file_path, e.strerror)) from None
     try:
         os.rename(tmp_file, file_path)
     except OSError as e:
         raise SCIONIOError("Error moving '%s' to '%s': %s" %
                            (tmp_file, file_path, e.strerror)) from None
+    return tmpfile_used
+
+
+def _write_tmpfile(tmp_file, text):
+    """
+    :returns: False if the file system does not support O_TMPFILE.
+    """
+    try:
+        fd = os.open(os.path.dirname(tmp_file) or ".", os.O_TMPFILE | os.O_WRONLY, 0o666)
+        with open(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            # A left over temp file would make linkat fail.
+            if os.path.lexists(tmp_file):
+                os.unlink(tmp_file)
+            os.link("/proc/self/fd/%d" % fd, tmp_file, follow_symlinks=True)
+    except OSError as e:
+        if e.errno in _TMPFILE_UNSUPPORTED:
+            return False
+        raise SCIONIOError("Error creating/writing to temp file '%s': %s" %
+                           (tmp_file, e.strerror)) from None
+    return True
+
+
+class BatchWriter(object):
+    """
+    Writes files in background threads, so that rendering the files overlaps
+    with the file system I/O. While a BatchWriter is active (see
+    set_batch_writer), write_file only queues the file. flush() waits until
+    all queued files are written.
+
+    Files are still written to a temporary file and atomically renamed. All
+    writes of a path are done by the same thread, in order. Each thread
+    drains its queue in batches, and creates every directory only once.
+    """
+    #: The maximum number of files a thread takes from its queue at once.
+    BATCH_SIZE = 64
+    #: The maximum number of queued files per thread.
+    QUEUE_SIZE = 1024
+
+    def __init__(self, threads=4, use_tmpfile=False):
+        """
+        :param int threads: the number of writer threads.
+        :param bool use_tmpfile: whether to write through O_TMPFILE and linkat,
+            where the OS and file system support it.
+        """
+        assert threads > 0, threads
+        self._pid = os.getpid()
+        self._use_tmpfile = use_tmpfile and hasattr(os, "O_TMPFILE")
+        self._dirs = set()
+        self._dirs_lock = threading.Lock()
+        self._error = None
+        self._queues = [queue.Queue(self.QUEUE_SIZE) for _ in range(threads)]
+        self._threads = []
+        for q in self._queues:
+            t = threading.Thread(target=self._run, args=(q,), daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, file_path, text):
+        """
+        Queue a file to be written.
+        """
+        if os.getpid() != self._pid:
+            # The threads only run in the process that created the writer, a
+            # forked worker writes its files itself.
+            _makedirs(os.path.dirname(file_path))
+            _write_atomic(file_path, text)
+            return
+        self._queues[hash(file_path) % len(self._queues)].put((file_path, text))
+
+    def flush(self):
+        """
+        Wait until all queued files are written.
+
+        :raises:
+            lib.errors.SCIONIOError: writing a queued file failed.
+        """
+        for q in self._queues:
+            q.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Flush and stop the threads.
+        """
+        try:
+            self.flush()
+        finally:
+            for q in self._queues:
+                q.put(None)
+            for t in self._threads:
+                t.join()
+
+    def _run(self, q):
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch([item for item in batch if item is not None])
+            finally:
+                for _ in batch:
+                    q.task_done()
+            if None in batch:
+                return
+
+    def _write_batch(self, batch):
+        try:
+            for file_path, text in batch:
+                self._ensure_dir(os.path.dirname(file_path))
+                if not _write_atomic(file_path, text, self._use_tmpfile):
+                    self._use_tmpfile = False
+        except SCIONIOError as e:
+            # Reported by the next flush. The rest of the batch is dropped, as
+            # the generation fails anyway.
+            if self._error is None:
+                self._error = e
+
+    def _ensure_dir(self, dir_):
+        if dir_ in self._dirs:
+            return
+        _makedirs(dir_)
+        with self._dirs_lock:
+            self._dirs.add(dir_)
+
+
+def set_batch_writer(writer):
+    """
+    Make write_file queue files to writer, or write them directly if None.
+    """
+    global _batch_writer
+    _batch_writer = writer
+
+
+def get_batch_writer():
+    return _batch_writer
+
+
+def set_fast_serializers(enabled):
+    """
+    Enable or disable the C backends of dump_yaml, dump_json and load_yaml_file.
+    Without them, the pure-Python implementations are used.
+    """
+    global _fast_serializers
+    _fast_serializers = enabled
+
+
+def yaml_safe_loader():
+    """
+    The safe YAML loader class of the enabled backend.
+    """
+    return YAML_SAFE_LOADER if _fast_serializers else yaml.SafeLoader
+
+
+def add_yaml_representer(data_type, representer):
+    """
+    Like yaml.add_representer, but for the dumpers of both backends.
+    """
+    for dumper in {yaml.Dumper, YAML_DUMPER}:
+        yaml.add_representer(data_type, representer, Dumper=dumper)
+
+
+def dump_yaml(data, **kwargs):
+    """
+    Like yaml.dump, with the same output, using libyaml if available.
+    """
+    dumper = YAML_DUMPER if _fast_serializers else yaml.Dumper
+    return yaml.dump(data, Dumper=dumper, **kwargs)
+
+
+def dump_json(obj, indent=None, sort_keys=False, default=None):
+    """
+    Like json.dumps, with the same output. The common case of an indent of 2
+    and unsorted keys uses orjson if it is installed.
+
+    NaN and infinite floats are not supported.
+    """
+    if _fast_serializers and orjson is not None and indent == 2 and not sort_keys:
+        try:
+            out = orjson.dumps(obj, default=default,
+                               option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            out = None
+        # json escapes non-ASCII characters and formats floats in exponent
+        # notation differently (1e-05 vs. 1e-5), leave such output to it.
+        if out is not None and out.isascii() and not _EXP_FLOAT.search(out):
+            return out.decode()
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
 
 
 def load_yaml_file(file_path):
@@ -77,7 +493,7 @@ def load_yaml_file(file_path):
     """
     try:
         with open(file_path) as f:
-            return yaml.load(f, Loader=yaml.SafeLoader)
+            return yaml.load(f, Loader=yaml_safe_loader())
     except OSError as e:
         raise SCIONIOError("Error opening '%s': %s" %
                            (file_path, e.strerror)) from None
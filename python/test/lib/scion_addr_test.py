@@ -0,0 +1,125 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`lib_scion_addr_test` --- lib.scion_addr unit tests
+========================================================
+"""
+# Stdlib
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from lib import scion_addr
+from lib.errors import SCIONParseError
+from lib.scion_addr import ISD_AS, ISDASArray
+
+
+class TestISDASStr(object):
+    """
+    Unit tests for lib.scion_addr.ISD_AS string forms
+    """
+    def test(self):
+        for raw, file_fmt in (
+            ("1-ff00:0:110", "1-ff00_0_110"),
+            ("2-64496", "2-64496"),
+            ("65535-ffff:ffff:ffff", "65535-ffff_ffff_ffff"),
+            ("1-1:0:0", "1-1_0_0"),
+        ):
+            yield self._check, raw, file_fmt
+
+    def _check(self, raw, file_fmt):
+        isd_as = ISD_AS(raw)
+        ntools.eq_(str(isd_as), raw)
+        # Memoized forms must not change.
+        ntools.eq_(str(isd_as), raw)
+        ntools.eq_(isd_as.file_fmt(), file_fmt)
+        ntools.eq_(str(ISD_AS(file_fmt)), raw)
+
+    def test_invalid(self):
+        ntools.assert_raises(SCIONParseError, ISD_AS, "1-ff00:0")
+
+
+class TestISDASHash(object):
+    """
+    Unit tests for lib.scion_addr.ISD_AS.__hash__ and __eq__
+    """
+    def test_eq(self):
+        a = ISD_AS("1-ff00:0:110")
+        b = ISD_AS("1-ff00_0_110")
+        ntools.eq_(a, b)
+        ntools.eq_(hash(a), hash(b))
+        ntools.eq_({a: 1}[b], 1)
+        ntools.assert_not_equal(a, ISD_AS("2-ff00:0:110"))
+        ntools.assert_not_equal(a, "1-ff00:0:110")
+
+
+class TestISDASIntern(object):
+    """
+    Unit tests for lib.scion_addr.ISD_AS.intern
+    """
+    def test(self):
+        a = ISD_AS.intern("1-ff00:0:111")
+        ntools.assert_is(ISD_AS.intern("1-ff00:0:111"), a)
+        ntools.assert_is_not(ISD_AS(str(a)), a)
+        ntools.eq_(ISD_AS(str(a)), a)
+
+
+class TestISDASArray(object):
+    """
+    Unit tests for lib.scion_addr.ISDASArray, backed by numpy if it is
+    installed
+    """
+    RAWS = ["1-ff00:0:110", "1-ff00:0:111", "2-ff00:0:210", "2-ff00:0:111", "1-64496"]
+
+    def test_backend(self):
+        ases = ISDASArray.from_strs(self.RAWS)
+        ntools.eq_(isinstance(ases._ints, list), scion_addr.np is None)
+        ntools.eq_(isinstance(ases.isd_mask(1), list), scion_addr.np is None)
+
+    def test_masks(self):
+        ases = ISDASArray.from_strs(self.RAWS)
+        ntools.eq_(ases.strs(), self.RAWS)
+        ntools.eq_(ases.file_fmts()[0], "1-ff00_0_110")
+        core = ases.member_mask([ISD_AS("1-ff00:0:110"), ISD_AS("2-ff00:0:210")])
+        ntools.eq_(ases.nonzero(core), [0, 2])
+        mask = ases.mask_and(ases.isd_mask(1), ases.ne_mask(ISD_AS("1-ff00:0:110")))
+        ntools.eq_([str(ia) for ia in ases.select(mask)], ["1-ff00:0:111", "1-64496"])
+
+    def test_duplicate_ases(self):
+        ases = ISDASArray.from_strs(self.RAWS)
+        ntools.eq_([str(ia) for ia in ases.duplicate_ases()], ["2-ff00:0:111"])
+        ntools.eq_(ISDASArray.from_strs(self.RAWS[:3]).duplicate_ases(), [])
+
+
+class TestISDASArrayLists(TestISDASArray):
+    """
+    Unit tests for lib.scion_addr.ISDASArray, backed by lists as without numpy
+    """
+    def setup(self):
+        self.patcher = patch.multiple(scion_addr, np=None, _np_imported=True)
+        self.patcher.start()
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def test_backend(self):
+        super().test_backend()
+        ntools.ok_(isinstance(ISDASArray.from_strs(self.RAWS)._ints, list))
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -17,6 +17,9 @@
 """
 # Stdlib
 import builtins
+import json
+import os
+import tempfile
 from unittest.mock import patch, mock_open
 
 # External packages
@@ -30,8 +33,15 @@ from lib.errors import (
     SCIONYAMLError,
 )
 from lib.util import (
+    BatchWriter,
+    dump_json,
+    dump_yaml,
     load_yaml_file,
+    set_batch_writer,
+    set_fast_serializers,
+    set_write_manifest,
     write_file,
+    WriteManifest,
 )
 
 
@@ -76,6 +86,110 @@ class TestWriteFile(object):
         ntools.assert_raises(SCIONIOError, write_file, "File_Path", "Text")
 
 
+class TestWriteManifest(object):
+    """
+    Unit tests for lib.util.WriteManifest
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+
+    def teardown(self):
+        set_write_manifest(None)
+
+    def _run(self, files):
+        manifest = WriteManifest.load(self.root)
+        set_write_manifest(manifest)
+        for name, text in files.items():
+            write_file(os.path.join(self.root, name), text)
+        set_write_manifest(None)
+        removed = manifest.remove_orphans()
+        manifest.save()
+        return manifest, removed
+
+    def test_unchanged(self):
+        self._run({"a/x": "1", "b/y": "2"})
+        with patch("lib.util.os.rename", autospec=True) as rename:
+            manifest, removed = self._run({"a/x": "1", "b/y": "3"})
+        rename.assert_called_once_with(os.path.join(self.root, "b/y.new"),
+                                       os.path.join(self.root, "b/y"))
+        ntools.eq_(manifest.changed, {"b/y"})
+        ntools.eq_(removed, [])
+
+    def test_orphans(self):
+        self._run({"a/x": "1", "b/y": "2"})
+        manifest, removed = self._run({"a/x": "1"})
+        ntools.eq_(removed, ["b/y"])
+        ntools.assert_false(os.path.exists(os.path.join(self.root, "b")))
+
+    def test_missing_file(self):
+        self._run({"a/x": "1"})
+        os.remove(os.path.join(self.root, "a/x"))
+        manifest, _ = self._run({"a/x": "1"})
+        ntools.eq_(manifest.changed, {"a/x"})
+        ntools.ok_(os.path.exists(os.path.join(self.root, "a/x")))
+
+    def test_record_file(self):
+        path = os.path.join(self.root, "c/z")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("1")
+        manifest = WriteManifest.load(self.root)
+        manifest.record_file(path)
+        manifest.state["gen"] = {"key": "k"}
+        manifest.save()
+        manifest = WriteManifest.load(self.root)
+        ntools.eq_(manifest.old_state, {"gen": {"key": "k"}})
+        manifest.record_file(path)
+        ntools.eq_(manifest.changed, set())
+        manifest.record_file(path, ["other", 1])
+        ntools.eq_(manifest.changed, {"c/z"})
+        # Files that are not recorded again are orphans, as if written.
+        ntools.eq_(WriteManifest.load(self.root).remove_orphans(), ["c/z"])
+
+
+class TestBatchWriter(object):
+    """
+    Unit tests for lib.util.BatchWriter
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+
+    def teardown(self):
+        set_batch_writer(None)
+
+    def _check(self, use_tmpfile):
+        writer = BatchWriter(threads=2, use_tmpfile=use_tmpfile)
+        set_batch_writer(writer)
+        for i in range(100):
+            write_file(os.path.join(self.root, "d%d" % (i % 3), "f%d" % i), str(i))
+        # Later writes of a path win.
+        write_file(os.path.join(self.root, "d0", "f0"), "last")
+        writer.flush()
+        for i in range(1, 100):
+            with open(os.path.join(self.root, "d%d" % (i % 3), "f%d" % i)) as f:
+                ntools.eq_(f.read(), str(i))
+        with open(os.path.join(self.root, "d0", "f0")) as f:
+            ntools.eq_(f.read(), "last")
+        ntools.eq_(len(os.listdir(os.path.join(self.root, "d0"))), 34)
+        writer.close()
+
+    def test_write(self):
+        self._check(False)
+
+    def test_tmpfile(self):
+        self._check(True)
+
+    def test_error(self):
+        writer = BatchWriter(threads=1)
+        set_batch_writer(writer)
+        with open(os.path.join(self.root, "file"), "w"):
+            pass
+        write_file(os.path.join(self.root, "file", "x"), "1")
+        ntools.assert_raises(SCIONIOError, writer.flush)
+        # The error is only reported once.
+        writer.close()
+
+
 class Loader(object):
     """
     Helper class for load_yaml_file tests.
@@ -107,5 +221,55 @@ class TestLoadYAMLFile(Loader):
             )
 
 
+class TestSerializers(object):
+    """
+    Unit tests for lib.util.dump_yaml and lib.util.dump_json, checking that
+    the fast backends produce the same output as the pure-Python ones.
+    """
+    DATA = {
+        "isd_as": "1-ff00:0:110",
+        "attributes": ["core", "issuing"],
+        "mtu": 1472,
+        "frac": 0.4,
+        "small": 1e-05,
+        "big": 2 ** 70,
+        "empty": {},
+        "none": None,
+        "flag": True,
+        "nested": {1: {"addr": "[fd00::1]:30042"}, 2: {"text": "long " * 40}},
+        "unicode": "Z\u00fcrich",
+    }
+
+    def teardown(self):
+        set_fast_serializers(True)
+
+    def _both(self, func, *args, **kwargs):
+        set_fast_serializers(False)
+        slow = func(*args, **kwargs)
+        set_fast_serializers(True)
+        return func(*args, **kwargs), slow
+
+    def test_yaml(self):
+        for kwargs in ({}, {"default_flow_style": False}):
+            fast, slow = self._both(dump_yaml, self.DATA, **kwargs)
+            ntools.eq_(fast, slow)
+            ntools.eq_(slow, yaml.dump(self.DATA, **kwargs))
+
+    def test_json(self):
+        for data in (self.DATA, {"b": [1, 2], "a": {3: "c", 1: "d"}}):
+            for kwargs in ({"indent": 2}, {"indent": 4, "sort_keys": True}, {}):
+                fast, slow = self._both(dump_json, data, **kwargs)
+                ntools.eq_(fast, slow)
+                ntools.eq_(slow, json.dumps(data, **kwargs))
+
+    def test_json_default(self):
+        def default(o):
+            if isinstance(o, set):
+                return sorted(o)
+            raise TypeError
+        fast, slow = self._both(dump_json, {"s": {2, 1}}, indent=2, default=default)
+        ntools.eq_(fast, slow)
+
+
 if __name__ == "__main__":
     nose.run(defaultTest=__name__)
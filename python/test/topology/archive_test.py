@@ -0,0 +1,125 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_archive_test` --- topology.archive unit tests
+============================================================
+"""
+# Stdlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from lib.errors import SCIONIOError
+from topology.archive import ARCHIVE_SUFFIXES, extract, pack, read
+
+
+class TestArchive(object):
+    """
+    Unit tests for topology.archive.pack, read and extract
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        gen = os.path.join(self.root, "gen")
+        os.makedirs(os.path.join(gen, "ISD1", "AS1", "br1"))
+        os.makedirs(os.path.join(gen, "empty"))
+        with open(os.path.join(gen, "ISD1", "AS1", "br1", "br.toml"), "w") as f:
+            f.write("[general]\n")
+        with open(os.path.join(gen, "run.sh"), "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(os.path.join(gen, "run.sh"), 0o755)
+        os.symlink("../br.toml", os.path.join(gen, "ISD1", "AS1", "link"))
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def test(self):
+        for suffix in ARCHIVE_SUFFIXES:
+            yield self._check, suffix
+
+    def _check(self, suffix):
+        gen = os.path.join(self.root, "gen")
+        path = os.path.join(self.root, "gen" + suffix)
+        pack(gen, path)
+        ntools.eq_(read(path, "gen/ISD1/AS1/br1/br.toml"), b"[general]\n")
+        ntools.eq_(read(path, "gen/missing"), None)
+        # Archives are reproducible.
+        with open(path, "rb") as f:
+            first = f.read()
+        pack(gen, path)
+        with open(path, "rb") as f:
+            ntools.eq_(f.read(), first)
+        dest = os.path.join(self.root, "out" + suffix)
+        extract(path, dest)
+        out = os.path.join(dest, "gen")
+        with open(os.path.join(out, "ISD1", "AS1", "br1", "br.toml")) as f:
+            ntools.eq_(f.read(), "[general]\n")
+        ntools.eq_(os.stat(os.path.join(out, "run.sh")).st_mode & 0o777, 0o755)
+        ntools.eq_(os.readlink(os.path.join(out, "ISD1", "AS1", "link")), "../br.toml")
+        ntools.ok_(os.path.isdir(os.path.join(out, "empty")))
+
+    def test_unsafe_name(self):
+        path = os.path.join(self.root, "evil.tar")
+        with tarfile.open(path, "w") as tar:
+            tar.addfile(tarfile.TarInfo("gen/../../x"), io.BytesIO())
+        ntools.assert_raises(SCIONIOError, extract, path, os.path.join(self.root, "out"))
+        ntools.assert_false(os.path.exists(os.path.join(self.root, "x")))
+
+    def _evil_tar(self, link, *members):
+        path = os.path.join(self.root, "evil.tar")
+        with tarfile.open(path, "w") as tar:
+            info = tarfile.TarInfo("gen/x")
+            info.type = tarfile.SYMTYPE
+            info.linkname = link
+            tar.addfile(info)
+            for name in members:
+                tar.addfile(tarfile.TarInfo(name), io.BytesIO())
+        return path
+
+    def test_unsafe_link(self):
+        outside = os.path.join(self.root, "outside")
+        os.makedirs(outside)
+        dest = os.path.join(self.root, "out")
+        for link in (outside, "../../outside", "../.."):
+            path = self._evil_tar(link, "gen/x/pwned")
+            ntools.assert_raises(SCIONIOError, extract, path, dest)
+            ntools.eq_(os.listdir(outside), [])
+        # A link that stays in dest_dir is fine, also as a parent.
+        extract(self._evil_tar(".", "gen/x/inside"), dest)
+        ntools.ok_(os.path.isfile(os.path.join(dest, "gen", "inside")))
+
+    def test_unsafe_existing_link(self):
+        outside = os.path.join(self.root, "outside")
+        os.makedirs(outside)
+        dest = os.path.join(self.root, "out")
+        os.makedirs(os.path.join(dest, "gen"))
+        os.symlink(outside, os.path.join(dest, "gen", "y"))
+        path = os.path.join(self.root, "evil.tar")
+        with tarfile.open(path, "w") as tar:
+            tar.addfile(tarfile.TarInfo("gen/y/pwned"), io.BytesIO())
+        ntools.assert_raises(SCIONIOError, extract, path, dest)
+        ntools.eq_(os.listdir(outside), [])
+
+    def test_unknown_format(self):
+        ntools.assert_raises(SCIONIOError, pack, self.root, os.path.join(self.root, "gen.rar"))
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,117 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_cert_cache_test` --- topology.cert_cache unit tests
+==================================================================
+"""
+# Stdlib
+import copy
+import os
+import shutil
+import tempfile
+import time
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.cert_cache import CryptoCache, MAX_AGE
+
+TOPO = {
+    "ASes": {
+        "1-ff00:0:110": {"core": True, "voting": True, "issuing": True},
+        "1-ff00:0:111": {"cert_issuer": "1-ff00:0:110", "mtu": 1400},
+        "2-ff00:0:210": {"core": True, "voting": True, "issuing": True},
+    },
+    "links": [{"a": "1-ff00:0:110", "b": "1-ff00:0:111", "linkAtoB": "CHILD"}],
+}
+
+
+class TestCryptoCache(object):
+    """
+    Unit tests for topology.cert_cache.CryptoCache
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.pki = os.path.join(self.root, "scion-pki")
+        with open(self.pki, "w") as f:
+            f.write("v1")
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def _cache(self, topo, seed=1):
+        return CryptoCache(os.path.join(self.root, "cache"), topo, seed, self.pki)
+
+    def test_keys(self):
+        base = self._cache(TOPO)
+        # Attributes that scion-pki does not read leave the keys unchanged.
+        topo = copy.deepcopy(TOPO)
+        topo["ASes"]["1-ff00:0:111"]["mtu"] = 1472
+        topo["links"] = []
+        ntools.eq_(self._cache(topo).path("1"), base.path("1"))
+        # Crypto attributes only change the keys of their ISD.
+        topo["ASes"]["1-ff00:0:111"]["cert_issuer"] = "1-ff00:0:112"
+        ntools.assert_not_equal(self._cache(topo).path("1"), base.path("1"))
+        ntools.eq_(self._cache(topo).path("2"), base.path("2"))
+        # So do the seed and the scion-pki binary.
+        ntools.assert_not_equal(self._cache(TOPO, seed=2).path("2"), base.path("2"))
+        with open(self.pki, "w") as f:
+            f.write("v2")
+        ntools.assert_not_equal(self._cache(TOPO).path("2"), base.path("2"))
+
+    def _store(self, cache, isd):
+        src = os.path.join(self.root, "staging", "ISD%s" % isd)
+        os.makedirs(os.path.join(src, "trcs"))
+        with open(os.path.join(src, "trcs", "ISD%s-V1.trc" % isd), "w") as f:
+            f.write("trc")
+        cache.store(isd, src)
+
+    def _entries(self):
+        return sorted(os.listdir(os.path.join(self.root, "cache")))
+
+    def test_store_install(self):
+        cache = self._cache(TOPO)
+        os.makedirs(cache.root)
+        ntools.assert_false(cache.has("1"))
+        self._store(cache, "1")
+        ntools.ok_(cache.has("1"))
+        out = os.path.join(self.root, "gen")
+        cache.install("1", out)
+        with open(os.path.join(out, "ISD1", "trcs", "ISD1-V1.trc")) as f:
+            ntools.eq_(f.read(), "trc")
+
+    def test_prune(self):
+        old = self._cache(TOPO)
+        os.makedirs(old.root)
+        self._store(old, "1")
+        self._store(old, "2")
+        other = os.path.join(old.root, ".staging-x")
+        os.makedirs(other)
+        # A new seed supersedes the entries of the ISDs it is stored for.
+        new = self._cache(TOPO, seed=2)
+        self._store(new, "1")
+        ntools.eq_(self._entries(), sorted([
+            ".staging-x", os.path.basename(new.path("1")), os.path.basename(old.path("2"))]))
+        # Expired entries are removed whatever their ISD.
+        expired = time.time() - MAX_AGE - 1
+        os.utime(old.path("2"), (expired, expired))
+        self._store(self._cache(TOPO, seed=3), "1")
+        ntools.eq_(self._entries(), sorted([
+            ".staging-x", os.path.basename(self._cache(TOPO, seed=3).path("1"))]))
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,304 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_cert_test` --- topology.cert unit tests
+======================================================
+"""
+# Stdlib
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.cert import (
+    check_trust_files,
+    CertGenerator,
+    PKI_STEPS,
+    trust_files,
+    TRUST_STORE_MODES,
+)
+from lib.util import set_write_manifest, WriteManifest
+from topology.common import ArgsTopoConfig, TopoID
+from topology.plan import AS
+
+
+class TestCertGeneratorPipeline(object):
+    """
+    Unit tests for the scion-pki pipeline of topology.cert.CertGenerator
+    """
+    @patch("topology.cert.CertGenerator._copy_files", autospec=True)
+    @patch("topology.cert.CertGenerator._master_keys", autospec=True)
+    def test(self, master_keys, copy_files):
+        calls = []
+        lock = threading.Lock()
+
+        def pki(*args):
+            with lock:
+                calls.append(args)
+
+        ases = ("1-ff00:0:110", "1-ff00:0:111", "2-ff00:0:210", "10-ff00:0:1")
+        args = SimpleNamespace(topo_config="t.topo", output_dir="gen", pki_jobs=3,
+                               crypto_cache=None, incremental=False,
+                               config={"ASes": {ia: {} for ia in ases}})
+        gen = CertGenerator(args)
+        gen.pki = pki
+        topo_dicts = {TopoID(ia): AS(TopoID(ia), 1472, []) for ia in ases}
+        gen.generate(topo_dicts)
+        ntools.eq_(calls[0], ("tmpl", "topo", "t.topo", "-d", "gen"))
+        for isd in ("1", "2", "10"):
+            # The steps of an ISD run once each, in dependency order.
+            steps = [c[:2] for c in calls if c[2:] == (isd, "-d", "gen")]
+            ntools.eq_(steps, list(PKI_STEPS))
+        ntools.eq_(len(calls), 1 + 3 * len(PKI_STEPS))
+        master_keys.assert_called_once_with(gen, list(topo_dicts), "gen")
+        ntools.eq_(copy_files.call_count, 4)
+
+
+class TestTrustStore(object):
+    """
+    Unit tests for the trust store modes of topology.cert.CertGenerator
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.topo_id = TopoID("1-ff00:0:110")
+        as_dir = self.topo_id.base_dir(self.root)
+        for rel in ("certs/chain.crt", "keys/as-signing.key", "../trcs/ISD1-V1.trc"):
+            path = os.path.join(as_dir, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(rel)
+        self.trcs = [os.path.join(as_dir, "..", "trcs", "ISD1-V1.trc")]
+        self.elem_dir = os.path.join(as_dir, "cs1-ff00_0_110-1")
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def test(self):
+        for mode in TRUST_STORE_MODES:
+            yield self._check, mode
+
+    def _check(self, mode):
+        args = SimpleNamespace(output_dir=self.root, trust_store=mode, incremental=False)
+        as_topo = AS(self.topo_id, 1472, [])
+        CertGenerator(args)._copy_files(self.topo_id, as_topo, [self.elem_dir], self.trcs)
+        with open(os.path.join(self.elem_dir, "certs", "ISD1-V1.trc")) as f:
+            ntools.eq_(f.read(), "../trcs/ISD1-V1.trc")
+        files = trust_files(self.topo_id.base_dir(self.root), self.trcs)
+        ntools.eq_(sorted(files), ["certs/ISD1-V1.trc", "certs/chain.crt",
+                                   "keys/as-signing.key"])
+        ntools.eq_(check_trust_files(self.elem_dir, files), [])
+
+    def test_check(self):
+        args = SimpleNamespace(output_dir=self.root, trust_store="copy", incremental=False)
+        as_topo = AS(self.topo_id, 1472, [])
+        CertGenerator(args)._copy_files(self.topo_id, as_topo, [self.elem_dir], self.trcs)
+        files = trust_files(self.topo_id.base_dir(self.root), self.trcs)
+        with open(os.path.join(self.elem_dir, "certs", "chain.crt"), "w") as f:
+            f.write("other")
+        os.remove(os.path.join(self.elem_dir, "keys", "as-signing.key"))
+        with open(os.path.join(self.elem_dir, "keys", "extra.key"), "w") as f:
+            f.write("extra")
+        ntools.eq_(check_trust_files(self.elem_dir, files), [
+            "unexpected keys/extra.key",
+            "certs/chain.crt differs from %s" % files["certs/chain.crt"],
+            "missing keys/as-signing.key",
+        ])
+
+
+class TestIncremental(object):
+    """
+    Unit tests for topology.cert.CertGenerator on the output of a previous run
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.out = os.path.join(self.root, "gen")
+        for rel in ("ISD1/trcs/ISD1-V1.trc",
+                    "ISD1/ASff00_0_110/certs/chain.crt",
+                    "ISD1/ASff00_0_110/cs1-ff00_0_110-1/certs/chain.crt",
+                    "ISD1/ASff00_0_110/br1-ff00_0_110-9/certs/chain.crt",
+                    "ISD1/ASff00_0_110/br1-ff00_0_110-9/br.toml",
+                    "ISD1/ASff00_0_111/certs/chain.crt",
+                    "ISD3/trcs/ISD3-V1.trc",
+                    "ISD3/ASff00_0_310/certs/chain.crt"):
+            path = os.path.join(self.out, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(rel)
+        self.pki_bin = os.path.join(self.root, "scion-pki")
+        with open(self.pki_bin, "w") as f:
+            f.write("v1")
+        self.topo_id = TopoID("1-ff00:0:110")
+        self.config = {"ASes": {"1-ff00:0:110": {"core": True}, "2-ff00:0:210": {}}}
+        self.calls = []
+        self.serial = 0
+
+    def teardown(self):
+        set_write_manifest(None)
+        shutil.rmtree(self.root)
+
+    def _exists(self, rel):
+        return os.path.exists(os.path.join(self.out, rel))
+
+    def _read(self, rel):
+        with open(os.path.join(self.out, rel)) as f:
+            return f.read()
+
+    def _pki(self, *args):
+        self.calls.append(args)
+        self.serial += 1
+        out = args[args.index("-d") + 1]
+        for ia, as_conf in self.config["ASes"].items():
+            topo_id = TopoID(ia)
+            if args[:2] == ("keys", "private") and args[2] == topo_id.isd_str():
+                files = ["keys/as-signing.key"]
+                if as_conf.get("core"):
+                    files.append("keys/issuer.key")
+                for rel in files:
+                    path = os.path.join(topo_id.base_dir(out), rel)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "w") as f:
+                        f.write("%s %d" % (rel, self.serial))
+
+    def _gen(self):
+        args = SimpleNamespace(topo_config="t.topo", output_dir=self.out, pki_jobs=1,
+                               crypto_cache=None, incremental=True, trust_store="symlink",
+                               seed=None)
+        gen = CertGenerator(ArgsTopoConfig(args, self.config))
+        gen.pki = self._pki
+        return gen
+
+    def _run(self, elems=("cs1-ff00_0_110-1",)):
+        manifest = WriteManifest.load(self.out)
+        set_write_manifest(manifest)
+        topo_ids = [TopoID(ia) for ia in self.config["ASes"]]
+        gen = self._gen()
+        with patch("topology.cert.PKI_BIN", self.pki_bin):
+            gen.generate_crypto(topo_ids)
+        as_dir = self.topo_id.base_dir(self.out)
+        gen._copy_files(self.topo_id, AS(self.topo_id, 1472, []),
+                        [os.path.join(as_dir, elem) for elem in elems], gen._trcs())
+        set_write_manifest(None)
+        manifest.remove_orphans()
+        manifest.save()
+        return manifest
+
+    def test_stale(self):
+        self._run()
+        ntools.assert_false(self._exists("ISD3"))
+        ntools.assert_false(self._exists("ISD1/ASff00_0_111"))
+        ntools.ok_(self._exists("ISD1/ASff00_0_110/keys/as-signing.key"))
+        ntools.eq_(self._gen()._trcs(), [os.path.join(self.out, "ISD1/trcs/ISD1-V1.trc")])
+        # The generated files of the dropped element are left to the manifest.
+        ntools.assert_false(self._exists("ISD1/ASff00_0_110/br1-ff00_0_110-9/certs"))
+        ntools.ok_(self._exists("ISD1/ASff00_0_110/br1-ff00_0_110-9/br.toml"))
+
+    def test_trcs(self):
+        # The TRCs of other ISDs are not shared, even if they are still there.
+        ntools.eq_(self._gen()._trcs(), [os.path.join(self.out, "ISD1/trcs/ISD1-V1.trc")])
+
+    def test_unchanged(self):
+        self._run()
+        signing = self._read("ISD1/ASff00_0_110/keys/as-signing.key")
+        master = self._read("ISD1/ASff00_0_110/keys/master0.key")
+        elem_key = os.path.join(self.out, "ISD1/ASff00_0_110/cs1-ff00_0_110-1/keys/as-signing.key")
+        inode = os.lstat(elem_key).st_ino
+        self.calls = []
+        manifest = self._run()
+        ntools.eq_(self.calls, [])
+        ntools.eq_(manifest.changed, set())
+        ntools.eq_(self._read("ISD1/ASff00_0_110/keys/as-signing.key"), signing)
+        ntools.eq_(self._read("ISD1/ASff00_0_110/keys/master0.key"), master)
+        ntools.eq_(os.lstat(elem_key).st_ino, inode)
+        ntools.ok_("ISD1/ASff00_0_110/cs1-ff00_0_110-1/keys/as-signing.key" in manifest.files)
+
+    def test_changed_isd(self):
+        self._run()
+        master = self._read("ISD1/ASff00_0_110/keys/master0.key")
+        isd2 = self._read("ISD2/ASff00_0_210/keys/as-signing.key")
+        self.config["ASes"]["1-ff00:0:110"] = {}
+        self.calls = []
+        manifest = self._run()
+        ntools.eq_({c[2] for c in self.calls if c[0] != "tmpl"}, {"1"})
+        ntools.eq_(self._read("ISD2/ASff00_0_210/keys/as-signing.key"), isd2)
+        ntools.eq_(self._read("ISD1/ASff00_0_110/keys/master0.key"), master)
+        # The material that is not generated anymore is not shared either.
+        ntools.assert_false(self._exists("ISD1/ASff00_0_110/keys/issuer.key"))
+        ntools.assert_false(self._exists("ISD1/ASff00_0_110/cs1-ff00_0_110-1/keys/issuer.key"))
+        ntools.eq_(manifest.changed, {
+            "ISD1/ASff00_0_110/keys/as-signing.key",
+            "ISD1/ASff00_0_110/cs1-ff00_0_110-1/keys/as-signing.key",
+        })
+
+
+class TestCryptoCacheMasterKeys(object):
+    """
+    Unit tests for the master keys of topology.cert.CertGenerator with a
+    crypto cache
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.pki_bin = os.path.join(self.root, "scion-pki")
+        with open(self.pki_bin, "w") as f:
+            f.write("v1")
+        self.topo_id = TopoID("1-ff00:0:110")
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def _pki(self, *args):
+        out = args[args.index("-d") + 1]
+        keys = os.path.join(self.topo_id.base_dir(out), "keys")
+        os.makedirs(keys, exist_ok=True)
+        if args[:2] == ("keys", "private"):
+            with open(os.path.join(keys, "as-signing.key"), "w") as f:
+                f.write("signing")
+
+    def _run(self, seed):
+        out = os.path.join(self.root, "gen")
+        shutil.rmtree(out, ignore_errors=True)
+        args = SimpleNamespace(topo_config="t.topo", output_dir=out, pki_jobs=1,
+                               crypto_cache=os.path.join(self.root, "cache"),
+                               incremental=False, seed=seed)
+        gen = CertGenerator(ArgsTopoConfig(args, {"ASes": {"1-ff00:0:110": {}}}))
+        gen.pki = self._pki
+        with patch("topology.cert.PKI_BIN", self.pki_bin):
+            gen.generate_crypto([self.topo_id])
+        keys = os.path.join(self.topo_id.base_dir(out), "keys")
+        ntools.ok_(os.path.exists(os.path.join(keys, "as-signing.key")))
+        with open(os.path.join(keys, "master0.key")) as f:
+            return f.read()
+
+    def _cached_files(self):
+        return sorted(name for _, _, names in os.walk(os.path.join(self.root, "cache"))
+                      for name in names)
+
+    def test_random(self):
+        first = self._run(None)
+        ntools.assert_not_equal(self._run(None), first)
+        ntools.eq_(self._cached_files(), ["as-signing.key"])
+
+    def test_seed(self):
+        ntools.eq_(self._run(1), self._run(1))
+        ntools.eq_(self._cached_files(), ["as-signing.key"])
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,150 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_config_test` --- topology.config unit tests
+==========================================================
+"""
+# Stdlib
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.config import ConfigGenerator, ConfigGenArgs
+from topology.generator import add_arguments
+from topology.topo import TopoGenerator
+
+TINY_TOPO = os.path.join(os.path.dirname(__file__), "..", "..", "..", "topology", "tiny.topo")
+# Writes a file per scion-pki step and AS, in the layout of scion-pki.
+FAKE_PKI = """\
+#!%s
+import os, sys, yaml
+args = sys.argv[1:]
+out = args[args.index('-d') + 1]
+ases_file = os.path.join(out, '.fake-pki-ases')
+if args[:2] == ['tmpl', 'topo']:
+    with open(args[2]) as f:
+        ases = list(yaml.safe_load(f)['ASes'])
+    os.makedirs(out, exist_ok=True)
+    with open(ases_file, 'w') as f:
+        f.write('\\n'.join(ases))
+    sys.exit(0)
+with open(ases_file) as f:
+    ases = f.read().split('\\n')
+for ia in ases:
+    isd, as_ = ia.split('-')
+    if args[2] != isd:
+        continue
+    isd_dir = os.path.join(out, 'ISD' + isd)
+    as_dir = os.path.join(isd_dir, 'AS' + as_.replace(':', '_'))
+    path = {
+        'keys': os.path.join(as_dir, 'keys', 'as-signing.key'),
+        'trcs': os.path.join(isd_dir, 'trcs', 'ISD%%s-V1.trc' %% isd),
+        'certs': os.path.join(as_dir, 'certs', '%%s.crt' %% args[1]),
+    }[args[0]]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('%%s %%s' %% (' '.join(args[:2]), ia))
+""" % sys.executable
+
+
+class TestConfigGenerator(object):
+    """
+    Unit tests for the generation modes of topology.config.ConfigGenerator,
+    which must all produce the same files
+    """
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.out = os.path.join(self.root, "gen")
+        self.pki_bin = os.path.join(self.root, "scion-pki")
+        with open(self.pki_bin, "w") as f:
+            f.write(FAKE_PKI)
+        os.chmod(self.pki_bin, 0o755)
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def _generate(self, *argv):
+        """
+        Generate tiny.topo, always into the same directory, as its path ends
+        up in the files.
+
+        :returns: the generator and the content of the generated files, by
+            relative path.
+        """
+        shutil.rmtree(self.out, ignore_errors=True)
+        parser = argparse.ArgumentParser()
+        add_arguments(parser)
+        args = ConfigGenArgs(parser.parse_args(
+            ["-c", TINY_TOPO, "-o", self.out, "--no-topo-cache", "--seed", "1",
+             "--docker0-ip", "10.0.0.1", "--ephemeral-ports", "none", "--uid", "1000",
+             "--gid", "1000", "--output-base", "/out", "--user-spec", "u"] + list(argv)))
+        confgen = ConfigGenerator(args)
+        with patch("topology.cert.PKI_BIN", self.pki_bin):
+            confgen.generate_all()
+        return confgen, self._tree()
+
+    def _tree(self):
+        tree = {}
+        for root, _, names in os.walk(self.out):
+            for name in names:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    content = "-> " + os.readlink(path)
+                else:
+                    with open(path, "rb") as f:
+                        content = f.read()
+                tree[os.path.relpath(path, self.out)] = content
+        return tree
+
+    def _check_same(self, base_argv, argv):
+        _, expected = self._generate(*base_argv)
+        ntools.ok_("ISD1/ASff00_0_110/cs1-ff00_0_110-1/certs/ISD1-V1.trc" in expected)
+        _, tree = self._generate(*argv)
+        ntools.eq_(sorted(tree), sorted(expected))
+        for rel in sorted(expected):
+            ntools.eq_(tree[rel], expected[rel], rel)
+
+    def test_stream(self):
+        for argv in ((), ("-d",)):
+            yield self._check_same, argv, argv + ("--stream",)
+
+    def test_jobs(self):
+        for argv in ((), ("-d",)):
+            yield self._check_same, argv, argv + ("-j", "2")
+
+    def test_stream_release(self):
+        remaining = []
+        write_as_topo = TopoGenerator.write_as_topo
+
+        def spy(topo_gen, topo_id):
+            # The plan of the ASes is ConfigGenerator.topo_dicts.
+            remaining.append(len(topo_gen.plan.ases))
+            write_as_topo(topo_gen, topo_id)
+        with patch.object(TopoGenerator, "write_as_topo", spy):
+            confgen, _ = self._generate("--stream")
+        # Each AS is released once it is written, before the next is rendered.
+        ntools.eq_(remaining, [3, 2, 1])
+        ntools.eq_(confgen.topo_dicts, {})
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
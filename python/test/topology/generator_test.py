@@ -0,0 +1,95 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_generator_test` --- topology.generator unit tests
+================================================================
+"""
+# Stdlib
+import os
+import subprocess
+import sys
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+import topology
+
+#: Modules that only some runs need, and which the generator imports on demand.
+LAZY_MODULES = (
+    "multiprocessing",
+    "numpy",
+    "plumbum",
+    "sqlite3",
+    "topology.archive",
+    "topology.docker",
+    "topology.sig",
+)
+#: The module whose import time the budget is relative to. It is imported by
+#: the generator, so both are measured in the same interpreter.
+REFERENCE_MODULE = "yaml"
+#: Budget for the cumulative import time of the generator, as a multiple of
+#: the one of REFERENCE_MODULE. It is about 1.3 times the ratio on a developer
+#: machine, and does not depend on the speed of the machine.
+IMPORT_BUDGET = 10
+
+
+def _import_times(module):
+    """
+    Import module in a fresh interpreter with -X importtime.
+
+    :returns: the cumulative import time of every imported module, in
+        microseconds, by module name.
+    :rtype: dict
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(topology.__file__))] +
+        [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env,
+                          check=True)
+    times = {}
+    for line in proc.stderr.decode().splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        times[parts[2].strip()] = int(parts[1])
+    return times
+
+
+class TestImportTime(object):
+    """
+    Startup cost of topology.generator, which scion.sh and the acceptance
+    tests start many times.
+    """
+    def test_lazy(self):
+        imported = _import_times("topology.generator")
+        for module in LAZY_MODULES:
+            ntools.ok_(module not in imported, "%s is imported eagerly" % module)
+
+    def test_budget(self):
+        # The best of a few runs, to not fail on a busy machine.
+        ratios = []
+        for _ in range(3):
+            times = _import_times("topology.generator")
+            ratios.append(times["topology.generator"] / times[REFERENCE_MODULE])
+        ntools.ok_(min(ratios) <= IMPORT_BUDGET, "importing the generator took %.1f times "
+                   "as long as importing %s, the budget is %d" % (
+                       min(ratios), REFERENCE_MODULE, IMPORT_BUDGET))
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,227 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_net_test` --- topology.net unit tests
+====================================================
+"""
+# Stdlib
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+from ipaddress import ip_network
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.config import ConfigGenerator, ConfigGenArgs, NETWORKS_FILE
+from topology.generator import add_arguments
+from topology.net import PortGenerator, SubnetGenerator
+from topology.topo import TopoGenerator
+
+EPHEMERAL = (32768, 60999)
+TINY_TOPO = os.path.join(os.path.dirname(__file__), "..", "..", "..", "topology", "tiny.topo")
+# The networks.conf of tiny.topo, as generated before the buddy allocator.
+TINY_NETWORKS = """\
+[127.0.0.4/31]
+br1-ff00_0_110-1 = 127.0.0.4
+br1-ff00_0_111-1 = 127.0.0.5
+
+[127.0.0.8/29]
+br1-ff00_0_110-1_ctrl = 127.0.0.9
+br1-ff00_0_110-2_ctrl = 127.0.0.10
+cs1-ff00_0_110-1 = 127.0.0.11
+sd1-ff00_0_110 = 127.0.0.12
+tester_1-ff00_0_110 = 127.0.0.13
+
+[127.0.0.16/29]
+br1-ff00_0_111-1_ctrl = 127.0.0.17
+cs1-ff00_0_111-1 = 127.0.0.18
+sd1-ff00_0_111 = 127.0.0.19
+tester_1-ff00_0_111 = 127.0.0.20
+
+[fd00:f00d:cafe::7f00:4/127]
+br1-ff00_0_110-2 = fd00:f00d:cafe::7f00:4
+br1-ff00_0_112-1 = fd00:f00d:cafe::7f00:5
+
+[fd00:f00d:cafe::7f00:8/125]
+br1-ff00_0_112-1_ctrl = fd00:f00d:cafe::7f00:9
+cs1-ff00_0_112-1 = fd00:f00d:cafe::7f00:a
+sd1-ff00_0_112 = fd00:f00d:cafe::7f00:b
+tester_1-ff00_0_112 = fd00:f00d:cafe::7f00:c
+
+"""
+TINY_DOCKER_NETWORKS = """\
+[172.20.0.0/29]
+br1-ff00_0_110-1 = 172.20.0.2
+br1-ff00_0_111-1 = 172.20.0.3
+
+[172.20.0.16/28]
+br1-ff00_0_110-1_ctrl = 172.20.0.18
+br1-ff00_0_110-1_internal = 172.20.0.19
+br1-ff00_0_110-2_ctrl = 172.20.0.20
+br1-ff00_0_110-2_internal = 172.20.0.21
+cs1-ff00_0_110-1 = 172.20.0.22
+sd1-ff00_0_110 = 172.20.0.23
+tester_1-ff00_0_110 = 172.20.0.24
+
+[172.20.0.8/29]
+br1-ff00_0_111-1_ctrl = 172.20.0.10
+br1-ff00_0_111-1_internal = 172.20.0.11
+cs1-ff00_0_111-1 = 172.20.0.12
+sd1-ff00_0_111 = 172.20.0.13
+tester_1-ff00_0_111 = 172.20.0.14
+
+[fd00:f00d:cafe::7f00:8/125]
+br1-ff00_0_110-2 = fd00:f00d:cafe::7f00:a
+br1-ff00_0_112-1 = fd00:f00d:cafe::7f00:b
+
+[fd00:f00d:cafe::7f00:10/125]
+br1-ff00_0_112-1_ctrl = fd00:f00d:cafe::7f00:12
+br1-ff00_0_112-1_internal = fd00:f00d:cafe::7f00:13
+cs1-ff00_0_112-1 = fd00:f00d:cafe::7f00:14
+sd1-ff00_0_112 = fd00:f00d:cafe::7f00:15
+tester_1-ff00_0_112 = fd00:f00d:cafe::7f00:16
+
+"""
+
+
+class TestSubnetGenerator(object):
+    """
+    Unit tests for topology.net.SubnetGenerator
+    """
+    def _register(self, gen, sizes):
+        """
+        Register a location per size, named by its index, with as many
+        elements.
+        """
+        for loc, size in enumerate(sizes):
+            subnet = gen.register("loc%d" % loc)
+            for elem in range(size):
+                subnet.register("elem%d" % elem)
+
+    def _alloc(self, gen):
+        networks = gen.alloc_subnets()
+        return {gen.locations[net]: str(net) for net in networks}
+
+    def _networks_conf(self, *argv):
+        """
+        Plan tiny.topo, and return the networks.conf it results in.
+        """
+        out = tempfile.mkdtemp()
+        try:
+            parser = argparse.ArgumentParser()
+            add_arguments(parser)
+            args = ConfigGenArgs(parser.parse_args(
+                ["-c", TINY_TOPO, "-o", out, "--no-topo-cache", "--docker0-ip", "10.0.0.1",
+                 "--ephemeral-ports", "none"] + list(argv)))
+            confgen = ConfigGenerator(args)
+            networks = TopoGenerator(confgen._topo_args()).plan_topology()
+            confgen._write_networks_conf(networks, NETWORKS_FILE)
+            with open(os.path.join(out, NETWORKS_FILE)) as f:
+                return f.read()
+        finally:
+            shutil.rmtree(out)
+
+    def test_historical_order(self):
+        ntools.eq_(self._networks_conf(), TINY_NETWORKS)
+        ntools.eq_(self._networks_conf("-d"), TINY_DOCKER_NETWORKS)
+
+    def test_key_order(self):
+        # A /30, /29 and /30 fill a /28 in the order of their keys.
+        gen = SubnetGenerator("10.0.0.0/28", False, False)
+        self._register(gen, [1, 3, 1])
+        ntools.eq_(self._alloc(gen), {
+            "loc0": "10.0.0.0/30", "loc1": "10.0.0.8/29", "loc2": "10.0.0.4/30"})
+
+    def test_fits(self):
+        # Whatever the order, the subnets fit exactly if they add up to at most
+        # the free space: 127.0.0.0/27 without 127.0.0.0/30.
+        free = 32 - 4
+        for sizes in itertools.product([1, 2, 3, 6], repeat=4):
+            gen = SubnetGenerator("127.0.0.0/27", False, False)
+            self._register(gen, sizes)
+            needed = sum(2 if size == 2 else 1 << (size + 2 - 1).bit_length()
+                         for size in sizes)
+            with patch("logging.critical"), patch("sys.exit", side_effect=SystemExit):
+                try:
+                    nets = [ip_network(net) for net in self._alloc(gen).values()]
+                except SystemExit:
+                    nets = None
+            ntools.eq_(nets is not None, needed <= free, sizes)
+            if nets is not None:
+                ntools.ok_(not any(a.overlaps(b) for a, b in itertools.combinations(nets, 2)))
+
+    def test_exclude_loopback(self):
+        gen = SubnetGenerator("127.0.0.0/29", False, False)
+        self._register(gen, [1])
+        ntools.eq_(self._alloc(gen), {"loc0": "127.0.0.4/30"})
+
+    def test_exceeds_network(self):
+        # 127.0.0.0/30 is excluded, so only one /30 is left.
+        gen = SubnetGenerator("127.0.0.0/29", False, False)
+        self._register(gen, [1, 1])
+        with patch("logging.critical") as critical, \
+                patch("sys.exit", side_effect=SystemExit) as exit_:
+            ntools.assert_raises(SystemExit, gen.alloc_subnets)
+        exit_.assert_called_once_with(1)
+        ntools.ok_(critical.called)
+
+
+class TestPortGenerator(object):
+    """
+    Unit tests for topology.net.PortGenerator
+    """
+    def test_default_capacity(self):
+        # The ephemeral ports are still allocated, as before they were known.
+        gen = PortGenerator(ephemeral=EPHEMERAL)
+        with patch("logging.warning") as warning:
+            ports = [gen.register("elem%d" % i) for i in range(2000)]
+        ntools.eq_(ports, list(range(31000, 35000, 2)))
+        ntools.eq_(warning.call_count, 1)
+        ntools.ok_("32768" in warning.call_args[0][0] % warning.call_args[0][1:])
+        with patch("sys.exit", side_effect=SystemExit) as exit_:
+            ntools.assert_raises(SystemExit, gen.register, "elem2000")
+        exit_.assert_called_once_with(1)
+
+    def test_no_warning(self):
+        gen = PortGenerator(ephemeral=EPHEMERAL)
+        with patch("logging.warning") as warning:
+            for i in range(100):
+                gen.register("elem%d" % i)
+        ntools.assert_false(warning.called)
+
+    def test_skip_ephemeral(self):
+        gen = PortGenerator([(32760, 32770), (61000, 61003)], ephemeral=EPHEMERAL,
+                            skip_ephemeral=True)
+        with patch("logging.warning") as warning:
+            ports = [gen.register("elem%d" % i) for i in range(4)]
+        ntools.eq_(ports, [32760, 32762, 32764, 32766])
+        ntools.eq_(gen.register("elem4"), 61000)
+        ntools.assert_false(warning.called)
+
+    def test_per_ip(self):
+        gen = PortGenerator([(31000, 31003)], per_ip=True)
+        ntools.eq_(gen.register("a", "127.0.0.1"), 31000)
+        ntools.eq_(gen.register("b", "127.0.0.2"), 31000)
+        ntools.eq_(gen.register("c", "127.0.0.1"), 31002)
+        ntools.eq_(gen.register("a", "127.0.0.1"), 31000)
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
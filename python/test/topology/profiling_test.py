@@ -0,0 +1,159 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_profiling_test` --- topology.profiling unit tests
+================================================================
+"""
+# Stdlib
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology import profiling
+from topology.profiling import PROFILE_REPORT, StageProfiler
+
+MIB = 1 << 20
+
+
+def _alloc(size):
+    buf = bytearray(size)
+    del buf
+
+
+class TestStageProfiler(object):
+    """
+    Unit tests for topology.profiling.StageProfiler
+    """
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        tracemalloc.stop()
+        shutil.rmtree(self.dir)
+
+    def _entries(self, profiler):
+        return {s["stage"]: s for s in profiler.stages}
+
+    def test_disabled(self):
+        profiler = StageProfiler(False, self.dir, cprofile=True)
+        with profiler.stage("topology"):
+            pass
+        out = io.StringIO()
+        profiler.finish(out)
+        ntools.eq_(profiler.stages, [])
+        ntools.eq_(out.getvalue(), "")
+        ntools.eq_(os.listdir(self.dir), [])
+        ntools.assert_false(tracemalloc.is_tracing())
+
+    def test_peaks(self):
+        if not profiling._RESET_PEAK:
+            raise nose.SkipTest("tracemalloc.reset_peak needs Python 3.9")
+        profiler = StageProfiler(True, self.dir)
+        with profiler.stage("topology"):
+            with profiler.stage("small"):
+                _alloc(MIB)
+            with profiler.stage("large"):
+                _alloc(8 * MIB)
+        with profiler.stage("go"):
+            pass
+        entries = self._entries(profiler)
+        ntools.eq_(list(entries), ["topology", "topology/small", "topology/large", "go"])
+        small = entries["topology/small"]["peak_mem_bytes"]
+        large = entries["topology/large"]["peak_mem_bytes"]
+        ntools.ok_(MIB <= small < 8 * MIB, small)
+        ntools.ok_(large >= 8 * MIB, large)
+        # A stage covers the peaks of its nested stages, later stages do not.
+        ntools.eq_(entries["topology"]["peak_mem_bytes"], large)
+        ntools.ok_(entries["go"]["peak_mem_bytes"] < MIB)
+
+    def test_concurrent_peaks(self):
+        if not profiling._RESET_PEAK:
+            raise nose.SkipTest("tracemalloc.reset_peak needs Python 3.9")
+        profiler = StageProfiler(True, self.dir)
+        allocated = threading.Event()
+        done = threading.Event()
+
+        def other():
+            allocated.wait()
+            with profiler.stage("crypto"):
+                pass
+            done.set()
+        thread = threading.Thread(target=other)
+        thread.start()
+        with profiler.stage("topology"):
+            _alloc(8 * MIB)
+            allocated.set()
+            done.wait()
+        thread.join()
+        # The stage of the other thread did not reset the peak of topology.
+        entries = self._entries(profiler)
+        ntools.ok_(entries["topology"]["peak_mem_bytes"] >= 8 * MIB)
+
+    def test_no_reset_peak(self):
+        profiler = StageProfiler(True, self.dir)
+        with patch.object(profiling, "_RESET_PEAK", False):
+            with profiler.stage("topology"):
+                with profiler.stage("go"):
+                    _alloc(MIB)
+            out = io.StringIO()
+            profiler.finish(out)
+        ntools.eq_([s["peak_mem_bytes"] for s in profiler.stages], [None, None])
+        ntools.eq_(out.getvalue().splitlines()[1].split()[-1], "-")
+
+    def test_finish(self):
+        profiler = StageProfiler(True, self.dir)
+        with profiler.stage("topology"):
+            with profiler.stage("go"):
+                pass
+        profiler.critical_path = [{"stage": "topology", "start_s": 0.0, "wall_s": 0.5}]
+        out = io.StringIO()
+        profiler.finish(out)
+        lines = out.getvalue().splitlines()
+        ntools.eq_(lines[0].split(), ["stage", "wall[s]", "cpu[s]", "wall%", "peak[KiB]"])
+        ntools.eq_([line.split()[0] for line in lines[1:4]], ["topology", "topology/go", "total"])
+        ntools.eq_(lines[4], "critical path: topology (0.5000s)")
+        with open(os.path.join(self.dir, PROFILE_REPORT)) as f:
+            report = json.load(f)
+        ntools.eq_(report, profiler.report())
+        ntools.eq_([s["stage"] for s in report["stages"]], ["topology", "topology/go"])
+        ntools.eq_(report["total_wall_s"], profiler.stages[0]["wall_s"])
+        ntools.assert_false(tracemalloc.is_tracing())
+
+    def test_cprofile(self):
+        profiler = StageProfiler(True, self.dir, cprofile=True)
+        with profiler.stage("topology"):
+            with profiler.stage("go"):
+                _alloc(1)
+        entries = self._entries(profiler)
+        dump = entries["topology"]["cprofile"]
+        ntools.eq_(dump, os.path.join(self.dir, "topology.prof"))
+        funcs = [func for _, _, func in pstats.Stats(dump).stats]
+        ntools.ok_("_alloc" in funcs, funcs)
+        # Nested stages are covered by the dump of the outer stage.
+        ntools.assert_not_in("cprofile", entries["topology/go"])
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
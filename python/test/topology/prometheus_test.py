@@ -0,0 +1,72 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_prometheus_test` --- topology.prometheus unit tests
+==================================================================
+"""
+# Stdlib
+import ipaddress
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.common import TopoID
+from topology.net import NetworkIndex
+from topology.plan import AS, BorderRouter, Service
+from topology.prometheus import PrometheusGenerator
+
+
+class TestPrometheusGenerator(object):
+    """
+    Unit tests for topology.prometheus.PrometheusGenerator
+    """
+    def _args(self):
+        topo_dicts = {}
+        for i, ia in enumerate(["1-ff00:0:110", "1-ff00:0:111", "2-ff00:0:210"]):
+            topo_id = TopoID(ia)
+            as_ = AS(topo_id, 1472, [])
+            addr = SimpleNamespace(ip=ipaddress.ip_address("127.0.0.%d" % (i + 1)))
+            as_.control_service["cs%s-1" % topo_id.file_fmt()] = Service("cs", addr, 1)
+            if i:
+                name = "br%s-1" % topo_id.file_fmt()
+                as_.border_routers[name] = BorderRouter(name, addr, addr, 2, 3)
+            topo_dicts[topo_id] = as_
+        return SimpleNamespace(topo_dicts=topo_dicts, net_index=NetworkIndex({}, {}),
+                               output_dir="gen", docker=False, in_docker=False, jobs=1,
+                               host=SimpleNamespace(output_base="/base"))
+
+    def _files(self, run):
+        files = {}
+        with patch("topology.prometheus.write_file",
+                   side_effect=lambda path, text: files.__setitem__(path, text)):
+            run(PrometheusGenerator(self._args()))
+        return files
+
+    def test_stream(self):
+        def stream(gen):
+            for topo_id in list(gen.args.topo_dicts):
+                gen.generate_as(topo_id)
+                del gen.args.topo_dicts[topo_id]
+            gen.finish()
+        files = self._files(lambda gen: gen.generate())
+        ntools.ok_("gen/prometheus.yml" in files)
+        ntools.eq_(self._files(stream), files)
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,106 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_stages_test` --- topology.stages unit tests
+==========================================================
+"""
+# Stdlib
+import threading
+import time
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.stages import StageGraph
+
+
+class TestStageGraph(object):
+    """
+    Unit tests for topology.stages.StageGraph
+    """
+    def setup(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.exclusive = 0
+
+    def _stage(self, name, secs=0.0, exclusive=True):
+        def run():
+            with self.lock:
+                self.events.append(("start", name))
+                if exclusive:
+                    self.exclusive += 1
+                    ntools.eq_(self.exclusive, 1)
+            time.sleep(secs)
+            with self.lock:
+                self.events.append(("end", name))
+                if exclusive:
+                    self.exclusive -= 1
+        return run
+
+    def _graph(self):
+        graph = StageGraph()
+        graph.add("topo", self._stage("topo", 0.01))
+        graph.add("go", self._stage("go", 0.01), ["topo"])
+        graph.add("prom", self._stage("prom", 0.01), ["topo"])
+        graph.add("crypto", self._stage("crypto", 0.1, exclusive=False), exclusive=False)
+        graph.add("certs", self._stage("certs", 0.01, exclusive=False), ["topo", "crypto"],
+                  exclusive=False)
+        return graph
+
+    def _index(self, event):
+        return self.events.index(event)
+
+    def test_concurrent(self):
+        graph = self._graph()
+        graph.run(lambda name, func: func())
+        # The crypto stage overlaps with the renderers.
+        ntools.ok_(self._index(("start", "crypto")) < self._index(("end", "topo")))
+        ntools.ok_(self._index(("end", "topo")) < self._index(("start", "go")))
+        ntools.ok_(self._index(("end", "crypto")) < self._index(("start", "certs")))
+        path = [s["stage"] for s in graph.critical_path()]
+        ntools.eq_(path, ["crypto", "certs"])
+
+    def test_serial(self):
+        graph = self._graph()
+        graph.run(lambda name, func: func(), concurrent=False)
+        ntools.eq_([name for kind, name in self.events if kind == "start"],
+                   ["topo", "go", "prom", "crypto", "certs"])
+        # Every stage waited for the one before it.
+        path = [s["stage"] for s in graph.critical_path()]
+        ntools.eq_(path, ["topo", "go", "prom", "crypto", "certs"])
+
+    def test_critical_path_timing(self):
+        graph = self._graph()
+        graph.run(lambda name, func: func())
+        timing = {"topo": (0.0, 0.5), "go": (0.5, 1.0), "prom": (1.5, 0.25),
+                  "crypto": (0.0, 0.75), "certs": (0.75, 0.125)}
+        ntools.eq_(graph.critical_path(timing), [
+            {"stage": "topo", "start_s": 0.0, "wall_s": 0.5},
+            {"stage": "go", "start_s": 0.5, "wall_s": 1.0},
+            {"stage": "prom", "start_s": 1.5, "wall_s": 0.25},
+        ])
+
+    def test_error(self):
+        graph = StageGraph()
+        graph.add("a", self._stage("a"))
+        graph.add("b", lambda: 1 / 0, ["a"])
+        graph.add("c", self._stage("c"), ["b"])
+        ntools.assert_raises(ZeroDivisionError, graph.run, lambda name, func: func())
+        ntools.assert_not_in(("start", "c"), self.events)
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,75 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_templates_test` --- topology.templates unit tests
+================================================================
+"""
+# Stdlib
+from types import SimpleNamespace
+
+# External packages
+import nose
+import nose.tools as ntools
+import toml
+
+# SCION
+from topology.go import GoGenerator
+from topology.templates import TomlTemplate
+
+
+def _go_gen(docker, trace):
+    args = SimpleNamespace(docker=docker, trace=trace, svcfrac=0.4,
+                           host=SimpleNamespace(docker_ip="172.17.0.1"))
+    return GoGenerator(args)
+
+
+class TestTomlTemplate(object):
+    """
+    Unit tests for topology.templates.TomlTemplate
+    """
+    FIELDS = [
+        {"name": "br1-ff00_0_110-1", "config_dir": "gen/ISD1/ASff00_0_110/br1-ff00_0_110-1",
+         "address": "[fd00:f00d:cafe::7f00:4]:30252", "prometheus": "127.0.0.1:30442",
+         "quic_address": "127.0.0.4:31001"},
+        {"name": "sd1-ff00_0_111", "config_dir": "/share/conf",
+         "address": "172.20.0.20:30255", "prometheus": "172.20.0.20:30455",
+         "quic_address": "172.20.0.20:30353"},
+        # Fields that toml.dumps escapes, or omits.
+        {"name": 'quote"d', "config_dir": "back\\slash", "address": "täb\t",
+         "prometheus": None, "quic_address": "'"},
+    ]
+
+    def _check(self, build):
+        tmpl = TomlTemplate(build, list(self.FIELDS[0]))
+        for fields in self.FIELDS:
+            ntools.eq_(tmpl.render(fields), toml.dumps(build(fields)))
+
+    def test_go_configs(self):
+        for docker in (False, True):
+            for trace in (False, True):
+                gen = _go_gen(docker, trace)
+                for build in (gen._build_br_conf, gen._build_control_service_conf,
+                              gen._build_co_conf, gen._build_sciond_conf,
+                              gen._build_disp_conf):
+                    yield self._check, build
+
+    def test_literal_text(self):
+        def build(fields):
+            return {"a": {"path": "it's/%s.log" % fields["name"], "n": 1},
+                    "b": "%s\\x" % fields["name"]}
+        self._check(build)
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,148 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_topo_cache_test` --- topology.topo_cache unit tests
+==================================================================
+"""
+# Stdlib
+import glob
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# External packages
+import nose
+import nose.tools as ntools
+import yaml
+
+# SCION
+from lib.errors import SCIONParseError, SCIONYAMLError
+from topology import topo_cache
+from topology.topo_cache import cache_path, load_topo_file
+
+TOPO = """\
+--- # Test topology
+defaults:
+  zookeepers:
+    1:
+      addr: 127.0.0.1
+ASes:
+  "1-ff00:0:110": {core: true, voting: true, authoritative: true, issuing: true}
+  "1-ff00:0:111": {cert_issuer: "1-ff00:0:110", mtu: 1400, test_dispatcher: 'yes'}
+  "1-ff00:0:112":
+links:
+  - {a: "1-ff00:0:110#1", b: "1-ff00:0:111#41", linkAtoB: CHILD, bw: 1.5e3}
+  - {a: "1-ff00:0:110", b: "1-ff00:0:112", linkAtoB: CHILD, mtu: ~}
+"""
+
+ANCHORS = """\
+ASes:
+  "1-ff00:0:110": &core {core: true}
+  "1-ff00:0:111":
+    <<: *core
+    mtu: 1400
+links:
+  - {a: "1-ff00:0:110", b: "1-ff00:0:111", linkAtoB: CHILD}
+"""
+
+
+class TestLoadTopoFile(object):
+    """
+    Unit tests for topology.topo_cache.load_topo_file
+    """
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.topo = os.path.join(self.dir, "test.topo")
+        self._write(TOPO)
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, data, mtime=None):
+        with open(self.topo, "w") as f:
+            f.write(data)
+        # Not racy with the cache written right after.
+        mtime = mtime or 1000000000
+        os.utime(self.topo, (mtime, mtime))
+
+    def test_cold_warm(self):
+        expected = yaml.safe_load(TOPO)
+        ntools.eq_(load_topo_file(self.topo, use_cache=False), expected)
+        ntools.assert_false(os.path.exists(cache_path(self.topo)))
+        ntools.eq_(load_topo_file(self.topo), expected)
+        ntools.ok_(os.path.exists(cache_path(self.topo)))
+        with patch.object(topo_cache, "_parse") as parse, \
+                patch.object(topo_cache, "_file_hash") as file_hash:
+            ntools.eq_(load_topo_file(self.topo), expected)
+        ntools.assert_false(parse.called)
+        ntools.assert_false(file_hash.called)
+        # Only the cache file is left next to the .topo file.
+        ntools.eq_(sorted(os.listdir(self.dir)), [".test.topo.cache", "test.topo"])
+
+    def test_changed(self):
+        load_topo_file(self.topo)
+        self._write(TOPO.replace("mtu: 1400", "mtu: 1472"), mtime=1000000001)
+        ntools.eq_(load_topo_file(self.topo)["ASes"]["1-ff00:0:111"]["mtu"], 1472)
+
+    def test_touched(self):
+        load_topo_file(self.topo)
+        self._write(TOPO, mtime=1500000000)
+        with patch.object(topo_cache, "_parse") as parse:
+            ntools.eq_(load_topo_file(self.topo), yaml.safe_load(TOPO))
+        ntools.assert_false(parse.called)
+        # The new mtime is recorded.
+        with patch.object(topo_cache, "_file_hash") as file_hash:
+            load_topo_file(self.topo)
+        ntools.assert_false(file_hash.called)
+
+    def test_not_shared(self):
+        load_topo_file(self.topo)["ASes"].clear()
+        ntools.eq_(len(load_topo_file(self.topo)["ASes"]), 3)
+
+    def test_corrupt_cache(self):
+        for data in (b"", b"SCNTOPO\n\x00", b"SCNTOPO\n" + b"\xff" * 64):
+            with open(cache_path(self.topo), "wb") as f:
+                f.write(data)
+            ntools.eq_(load_topo_file(self.topo), yaml.safe_load(TOPO))
+
+    def test_read_only_dir(self):
+        with patch("tempfile.mkstemp", side_effect=PermissionError(13, "denied")):
+            ntools.eq_(load_topo_file(self.topo), yaml.safe_load(TOPO))
+        ntools.assert_false(os.path.exists(cache_path(self.topo)))
+
+    def test_anchors(self):
+        self._write(ANCHORS)
+        ntools.eq_(load_topo_file(self.topo), yaml.safe_load(ANCHORS))
+
+    def test_repo_topos(self):
+        topos = glob.glob(os.path.join(os.path.dirname(__file__), "..", "..", "..",
+                                       "topology", "*.topo"))
+        ntools.ok_(topos)
+        for topo in topos:
+            with open(topo) as f:
+                expected = yaml.safe_load(f)
+            ntools.eq_(load_topo_file(topo, use_cache=False), expected)
+
+    def test_invalid(self):
+        for data in ("[]", "links: []", "ASes: {1-ff00:0:110: 1}",
+                     "ASes: {}\nlinks: {}", "ASes: {}\nlinks: [{a: x, b: y}]"):
+            self._write(data)
+            ntools.assert_raises(SCIONParseError, load_topo_file, self.topo)
+        self._write("ASes: {")
+        ntools.assert_raises(SCIONYAMLError, load_topo_file, self.topo)
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
@@ -0,0 +1,79 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topology_topo_test` --- topology.topo unit tests
+======================================================
+"""
+# Stdlib
+import random
+
+# External packages
+import nose
+import nose.tools as ntools
+
+# SCION
+from topology.topo import IFIDGenerator
+
+
+def _dense_draws(rand, claimed, count):
+    """
+    The IFIDs drawn from a full list of the free IFIDs, as IFIDGenerator did
+    before it only stored the changed entries.
+    """
+    free = list(range(1, IFIDGenerator.MAX_IFID + 1))
+    for ifid in claimed:
+        idx = free.index(ifid)
+        free[idx] = free[-1]
+        free.pop()
+    draws = []
+    for _ in range(count):
+        idx = rand.randrange(len(free))
+        draws.append(free[idx])
+        free[idx] = free[-1]
+        free.pop()
+    return draws
+
+
+class TestIFIDGenerator(object):
+    """
+    Unit tests for topology.topo.IFIDGenerator
+    """
+    def test_all_unique(self):
+        gen = IFIDGenerator(random.Random(1))
+        ifids = [gen.new() for _ in range(IFIDGenerator.MAX_IFID)]
+        ntools.eq_(sorted(ifids), list(range(1, IFIDGenerator.MAX_IFID + 1)))
+        ntools.assert_raises(SystemExit, gen.new)
+
+    def test_add(self):
+        gen = IFIDGenerator(random.Random(1))
+        gen.add(1)
+        gen.add(IFIDGenerator.MAX_IFID)
+        ntools.assert_raises(SystemExit, gen.add, 1)
+        ntools.assert_raises(SystemExit, gen.add, 0)
+        ntools.assert_raises(SystemExit, gen.add, IFIDGenerator.MAX_IFID + 1)
+        ifids = {gen.new() for _ in range(IFIDGenerator.MAX_IFID - 2)}
+        ntools.eq_(ifids, set(range(2, IFIDGenerator.MAX_IFID)))
+
+    def test_same_draws(self):
+        for seed in range(5):
+            claimed = [3, 4095, 17]
+            gen = IFIDGenerator(random.Random(seed))
+            for ifid in claimed:
+                gen.add(ifid)
+            draws = [gen.new() for _ in range(200)]
+            ntools.eq_(draws, _dense_draws(random.Random(seed), claimed, 200))
+
+
+if __name__ == "__main__":
+    nose.run(defaultTest=__name__)
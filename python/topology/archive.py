@@ -0,0 +1,407 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`archive` --- Single file archives of the generated topology
+=================================================================
+
+Packs the output directory of the generator into one tar, zip or SQLite file,
+and reads or extracts such archives again. The format is chosen by the file
+suffix, see ARCHIVE_SUFFIXES. Archives are reproducible: the entries are
+sorted and carry no timestamps or owners, so the same tree always gives the
+same archive.
+
+Entries are named relative to the parent of the packed directory, e.g.
+gen/ISD1/ASff00_0_110/br1-ff00_0_110-1/topology.json, so extracting an
+archive into the root of the repository recreates gen/:
+
+    PYTHONPATH=python/:. python/topology/archive.py extract gen.tar.gz .
+"""
+# Stdlib
+import argparse
+import gzip
+import io
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tarfile
+import zipfile
+
+# SCION
+from lib.errors import SCIONIOError
+
+FILE = "file"
+DIR = "dir"
+LINK = "link"
+
+# The zip format cannot represent earlier dates.
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class Entry(object):
+    __slots__ = ("name", "kind", "mode", "data")
+
+    def __init__(self, name, kind, mode, data=b""):
+        """
+        :param str name: the path of the entry, with "/" as separator.
+        :param str kind: FILE, DIR or LINK.
+        :param int mode: the permission bits.
+        :param bytes data: the content of a file, or the target of a link.
+        """
+        self.name = name
+        self.kind = kind
+        self.mode = mode
+        self.data = data
+
+
+def walk(src_dir):
+    """
+    Yield the entries of a directory tree, sorted by name. Symbolic links are
+    not followed.
+
+    :param str src_dir: the directory to pack.
+    """
+    src_dir = os.path.normpath(src_dir)
+    prefix = os.path.basename(os.path.abspath(src_dir))
+    yield Entry(prefix, DIR, stat.S_IMODE(os.stat(src_dir).st_mode))
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        rel = os.path.relpath(dirpath, src_dir)
+        base = prefix if rel == "." else "%s/%s" % (prefix, rel.replace(os.sep, "/"))
+        names = []
+        for name in dirnames + filenames:
+            names.append((name, os.lstat(os.path.join(dirpath, name))))
+        # os.walk only descends into the directories left in dirnames.
+        dirnames[:] = sorted(n for n, st in names if stat.S_ISDIR(st.st_mode))
+        for name, st in sorted(names, key=lambda n: n[0]):
+            path = os.path.join(dirpath, name)
+            arcname = "%s/%s" % (base, name)
+            mode = stat.S_IMODE(st.st_mode)
+            if stat.S_ISLNK(st.st_mode):
+                yield Entry(arcname, LINK, mode, os.fsencode(os.readlink(path)))
+            elif stat.S_ISDIR(st.st_mode):
+                yield Entry(arcname, DIR, mode)
+            elif stat.S_ISREG(st.st_mode):
+                with open(path, "rb") as f:
+                    yield Entry(arcname, FILE, mode, f.read())
+
+
+class TarArchive(object):
+    def __init__(self, path, compression=""):
+        """
+        :param str path: the archive file.
+        :param str compression: "", "gz" or "xz".
+        """
+        self.path = path
+        self.compression = compression
+
+    def write(self, entries):
+        with open(self.path, "wb") as raw:
+            if self.compression == "gz":
+                # tarfile would put the current time into the gzip header.
+                with gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as gz:
+                    self._write_tar(tarfile.open(fileobj=gz, mode="w"), entries)
+            else:
+                self._write_tar(tarfile.open(fileobj=raw, mode="w:" + self.compression),
+                                entries)
+
+    def _write_tar(self, tar, entries):
+        with tar:
+            for entry in entries:
+                info = tarfile.TarInfo(entry.name)
+                info.mode = entry.mode
+                data = None
+                if entry.kind == DIR:
+                    info.type = tarfile.DIRTYPE
+                elif entry.kind == LINK:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = os.fsdecode(entry.data)
+                else:
+                    info.size = len(entry.data)
+                    data = io.BytesIO(entry.data)
+                tar.addfile(info, data)
+
+    def entries(self):
+        with tarfile.open(self.path, "r:*") as tar:
+            for info in tar:
+                if info.isdir():
+                    yield Entry(info.name, DIR, info.mode)
+                elif info.issym():
+                    yield Entry(info.name, LINK, info.mode, os.fsencode(info.linkname))
+                elif info.isfile():
+                    yield Entry(info.name, FILE, info.mode, tar.extractfile(info).read())
+
+
+class ZipArchive(object):
+    def __init__(self, path):
+        """
+        :param str path: the archive file.
+        """
+        self.path = path
+
+    def write(self, entries):
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for entry in entries:
+                name = entry.name
+                fmt = stat.S_IFREG
+                if entry.kind == DIR:
+                    name += "/"
+                    fmt = stat.S_IFDIR
+                elif entry.kind == LINK:
+                    fmt = stat.S_IFLNK
+                info = zipfile.ZipInfo(name, _ZIP_EPOCH)
+                info.external_attr = (fmt | entry.mode) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                zf.writestr(info, entry.data)
+
+    def entries(self):
+        with zipfile.ZipFile(self.path) as zf:
+            for info in zf.infolist():
+                st_mode = info.external_attr >> 16
+                mode = stat.S_IMODE(st_mode)
+                if info.is_dir():
+                    yield Entry(info.filename.rstrip("/"), DIR, mode)
+                elif stat.S_ISLNK(st_mode):
+                    yield Entry(info.filename, LINK, mode, zf.read(info))
+                else:
+                    yield Entry(info.filename, FILE, mode, zf.read(info))
+
+    def read(self, name):
+        with zipfile.ZipFile(self.path) as zf:
+            try:
+                return zf.read(name)
+            except KeyError:
+                return None
+
+
+class SQLiteArchive(object):
+    """
+    An SQLite database with one row per entry. Single files can be loaded
+    without reading the rest of the archive.
+    """
+    SCHEMA = ("CREATE TABLE entries (name TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+              "mode INTEGER NOT NULL, data BLOB NOT NULL)")
+
+    def __init__(self, path):
+        """
+        :param str path: the archive file.
+        """
+        self.path = path
+
+    def write(self, entries):
+        db = sqlite3.connect(self.path)
+        try:
+            # The archive is written to a temporary file and renamed, so it
+            # needs no journal.
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute(self.SCHEMA)
+            db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)",
+                           ((e.name, e.kind, e.mode, e.data) for e in entries))
+            db.commit()
+        finally:
+            db.close()
+
+    def entries(self):
+        db = self._connect()
+        try:
+            for name, kind, mode, data in db.execute(
+                    "SELECT name, kind, mode, data FROM entries ORDER BY name"):
+                yield Entry(name, kind, mode, data)
+        finally:
+            db.close()
+
+    def read(self, name):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT data FROM entries WHERE name = ? AND kind = ?",
+                             (name, FILE)).fetchone()
+        finally:
+            db.close()
+        return None if row is None else row[0]
+
+    def _connect(self):
+        # Opening read-only keeps sqlite3 from creating a missing archive.
+        return sqlite3.connect("file:%s?mode=ro" % self.path, uri=True)
+
+
+#: The archive formats, by file suffix.
+ARCHIVE_SUFFIXES = {
+    ".tar": lambda path: TarArchive(path),
+    ".tar.gz": lambda path: TarArchive(path, "gz"),
+    ".tgz": lambda path: TarArchive(path, "gz"),
+    ".tar.xz": lambda path: TarArchive(path, "xz"),
+    ".zip": ZipArchive,
+    ".sqlite": SQLiteArchive,
+    ".db": SQLiteArchive,
+}
+
+
+def archive_factory(path):
+    """
+    :param str path: the archive file.
+    :returns: the archive class for the suffix of path, or None if it is unknown.
+    """
+    for suffix, factory in ARCHIVE_SUFFIXES.items():
+        if path.endswith(suffix):
+            return factory
+    return None
+
+
+def _factory(path):
+    factory = archive_factory(path)
+    if factory is None:
+        raise SCIONIOError("Unknown archive format '%s', use one of: %s" %
+                           (path, ", ".join(ARCHIVE_SUFFIXES)))
+    return factory
+
+
+def _archive(path):
+    return _factory(path)(path)
+
+
+def pack(src_dir, path):
+    """
+    Pack a directory tree into an archive. The archive is written to a
+    temporary file and atomically moved to path.
+
+    :param str src_dir: the directory to pack.
+    :param str path: the archive file, its suffix selects the format.
+    :raises:
+        lib.errors.SCIONIOError: IO error occurred
+    """
+    factory = _factory(path)
+    tmp_file = path + ".new"
+    try:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        factory(tmp_file).write(walk(src_dir))
+        os.rename(tmp_file, path)
+    except OSError as e:
+        raise SCIONIOError("Error packing '%s' into '%s': %s" %
+                           (src_dir, path, e.strerror)) from None
+
+
+def read(path, name):
+    """
+    Read a single file from an archive.
+
+    :param str path: the archive file.
+    :param str name: the name of the file in the archive.
+    :returns: the content, or None if there is no such file.
+    :rtype: bytes
+    """
+    archive = _archive(path)
+    if hasattr(archive, "read"):
+        return archive.read(name)
+    for entry in archive.entries():
+        if entry.name == name and entry.kind == FILE:
+            return entry.data
+    return None
+
+
+def extract(path, dest_dir):
+    """
+    Extract an archive. Existing files are replaced.
+
+    :param str path: the archive file.
+    :param str dest_dir: the directory to extract into.
+    :raises:
+        lib.errors.SCIONIOError: IO error occurred, or an entry would be
+            extracted outside of dest_dir.
+    """
+    archive = _archive(path)
+    dirs = []
+    try:
+        os.makedirs(dest_dir, exist_ok=True)
+        root = os.path.realpath(dest_dir)
+        for entry in archive.entries():
+            name = _safe_name(entry.name)
+            target = os.path.join(dest_dir, name)
+            # Links in the archive, or already in dest_dir, must not redirect
+            # the entry out of dest_dir.
+            if entry.kind == DIR:
+                _check_inside(root, os.path.realpath(target), entry.name)
+                os.makedirs(target, exist_ok=True)
+                dirs.append((target, entry.mode))
+                continue
+            _check_inside(root, os.path.realpath(os.path.dirname(target)), entry.name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target):
+                if os.path.isdir(target) and not os.path.islink(target):
+                    shutil.rmtree(target)
+                else:
+                    os.remove(target)
+            if entry.kind == LINK:
+                link = os.fsdecode(entry.data)
+                if os.path.isabs(link):
+                    raise SCIONIOError("Unsafe archive link '%s' -> '%s'" % (entry.name, link))
+                _check_inside(root, os.path.normpath(
+                    os.path.join(root, os.path.dirname(name), link)), entry.name)
+                os.symlink(link, target)
+                continue
+            with open(target, "wb") as f:
+                f.write(entry.data)
+            os.chmod(target, entry.mode)
+        # Set the directory modes last, they might not allow writing.
+        for target, mode in reversed(dirs):
+            os.chmod(target, mode)
+    except OSError as e:
+        raise SCIONIOError("Error extracting '%s': %s" % (path, e.strerror)) from None
+
+
+def _safe_name(name):
+    parts = name.split("/")
+    if name.startswith("/") or ".." in parts:
+        raise SCIONIOError("Unsafe archive entry '%s'" % name)
+    return os.path.join(*parts)
+
+
+def _check_inside(root, path, name):
+    """
+    Raise if path, resolved, is not root or below it.
+    """
+    if path != root and not path.startswith(root + os.sep):
+        raise SCIONIOError("Unsafe archive entry '%s': resolves to '%s', outside of '%s'" %
+                           (name, path, root))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read archives of the generated topology")
+    sub = parser.add_subparsers(dest="cmd")
+    sub.required = True
+    p = sub.add_parser("extract", help="Extract the archive")
+    p.add_argument("archive")
+    p.add_argument("dest", nargs="?", default=".")
+    p = sub.add_parser("list", help="List the entries of the archive")
+    p.add_argument("archive")
+    p = sub.add_parser("cat", help="Print a file of the archive")
+    p.add_argument("archive")
+    p.add_argument("name")
+    args = parser.parse_args()
+    if args.cmd == "extract":
+        extract(args.archive, args.dest)
+    elif args.cmd == "list":
+        for entry in _archive(args.archive).entries():
+            print(entry.name + ("/" if entry.kind == DIR else ""))
+    else:
+        data = read(args.archive, args.name)
+        if data is None:
+            print("No file '%s' in '%s'" % (args.name, args.archive), file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.buffer.write(data)
+
+
+if __name__ == "__main__":
+    main()
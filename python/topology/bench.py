@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`bench` --- SCION topology generator benchmarks
+====================================================
+
+Runs the individual stages of the topology generator on the checked-in
+topologies and on synthetic topologies of increasing size, and records wall
+time, peak RSS and the number of files written per stage as JSON. The peak
+RSS of a stage is only known on Linux, elsewhere only the peak of the whole
+run is recorded.
+
+Run from the root of the repository, like the generator itself:
+
+    PYTHONPATH=python/:. python/topology/bench.py -O bench.json
+"""
+# Stdlib
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+# External packages
+import yaml
+
+# SCION
+from topology.config import ConfigGenerator, ConfigGenArgs
+from topology.docker import DockerGenerator
+from topology.generator import add_arguments
+from topology.go import GoGenerator
+from topology.prometheus import PrometheusGenerator
+from topology.supervisor import SupervisorGenerator
+from topology.topo_cache import load_topo_file
+
+DEFAULT_TOPOS = ["topology/default.topo", "topology/wide.topo"]
+DEFAULT_SIZES = [100, 1000, 10000]
+BACKENDS = ["supervisor", "docker"]
+#: Network the docker backend allocates subnets in, large enough for the
+#: synthetic topologies.
+BENCH_DOCKER_NETWORK = "10.0.0.0/8"
+#: Number of core ASes per ISD in synthetic topologies.
+SYNTH_CORES = 3
+#: Number of ASes per ISD in synthetic topologies.
+SYNTH_ISD_SIZE = 250
+
+
+def synthetic_topo(num_ases, seed=0):
+    """
+    Build a synthetic topology config with `num_ases` ASes.
+
+    ASes are split into ISDs of SYNTH_ISD_SIZE ASes. The core ASes of an ISD
+    form a full mesh, the first core AS of each ISD has a core link to the next
+    ISD, and every non-core AS is the child of a randomly chosen AS that was
+    created before it in the same ISD.
+
+    :param int num_ases: the number of ASes.
+    :param int seed: the seed used to pick the parent ASes.
+    :returns: the topology config, in the format of a parsed .topo file.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    ases = {}
+    links = []
+    isd_cores = []
+    isd_count = max(1, -(-num_ases // SYNTH_ISD_SIZE))
+    for isd_idx in range(isd_count):
+        isd = isd_idx + 1
+        size = min(SYNTH_ISD_SIZE, num_ases - isd_idx * SYNTH_ISD_SIZE)
+        first = isd_idx * SYNTH_ISD_SIZE
+        # AS numbers must be unique across ISDs.
+        members = ["%d-ff00:0:%x" % (isd, 0x100 + first + i) for i in range(size)]
+        cores = members[:min(SYNTH_CORES, size)]
+        for ia in cores:
+            ases[ia] = {"core": True, "voting": True, "authoritative": True,
+                        "issuing": True}
+        for i, a in enumerate(cores):
+            for b in cores[i + 1:]:
+                links.append({"a": a, "b": b, "linkAtoB": "CORE"})
+        for i in range(len(cores), size):
+            ia = members[i]
+            parent = members[rnd.randrange(0, i)]
+            ases[ia] = {"cert_issuer": cores[0]}
+            links.append({"a": parent, "b": ia, "linkAtoB": "CHILD"})
+        isd_cores.append(cores[0])
+    if len(isd_cores) > 1:
+        for a, b in zip(isd_cores, isd_cores[1:]):
+            links.append({"a": a, "b": b, "linkAtoB": "CORE"})
+    return {"ASes": ases, "links": links}
+
+
+def _count_files(path):
+    count = 0
+    for _, _, files in os.walk(path):
+        count += len(files)
+    return count
+
+
+def _max_rss_kb():
+    """
+    The peak RSS of the whole process so far.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak RSS of the process, so that the next _peak_rss_kb only
+    covers what follows. Only Linux supports this.
+
+    :returns: whether the peak was reset.
+    :rtype: bool
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _peak_rss_kb():
+    """
+    The peak RSS since the last _reset_peak_rss.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    raise ValueError("No VmHWM in /proc/self/status")
+
+
+class _Stage(object):
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+
+class GeneratorBench(object):
+    """
+    Runs the generator stages for a single topology file and backend.
+    """
+
+    def __init__(self, topo_file, docker, output_dir):
+        """
+        :param str topo_file: the path to the .topo file.
+        :param bool docker: whether to generate the docker backend.
+        :param str output_dir: where to write the generated files.
+        """
+        parser = argparse.ArgumentParser()
+        add_arguments(parser)
+        # Measure the parsing of the topology file on every run.
+        argv = ["-c", topo_file, "-o", output_dir, "--no-topo-cache"]
+        if docker:
+            # The default docker network only fits a few hundred ASes.
+            argv += ["-d", "-n", BENCH_DOCKER_NETWORK]
+        else:
+            # The default port range only fits a few hundred ASes on one IP.
+            argv.append("--port-reuse")
+        self.args = ConfigGenArgs(parser.parse_args(argv))
+        self.output_dir = output_dir
+        self.docker = docker
+        self.topo_dicts = None
+        self.confgen = None
+
+    def stages(self):
+        stages = [
+            _Stage("load", self._load),
+            _Stage("topo", self._topo),
+        ]
+        for name in ("br", "sciond", "control_service", "co", "disp"):
+            stages.append(_Stage("go_%s" % name, self._go_stage(name)))
+        if self.docker:
+            stages.append(_Stage("docker", self._docker))
+        else:
+            stages.append(_Stage("supervisor", self._supervisor))
+        stages.append(_Stage("prometheus", self._prometheus))
+        return stages
+
+    def run(self):
+        """
+        Run all stages, stopping at the first one that fails. The timings of a
+        failed run are not comparable, only the error is reported then.
+
+        :returns: the per-stage measurements, and the error that occurred, if any.
+        :rtype: (list, str)
+        """
+        results = []
+        for stage in self.stages():
+            files_before = _count_files(self.output_dir)
+            per_stage_rss = _reset_peak_rss()
+            start = time.perf_counter()
+            try:
+                stage.func()
+            except BaseException as e:
+                return [], "%s: %s" % (stage.name, _format_error(e))
+            results.append({
+                "stage": stage.name,
+                "wall_s": round(time.perf_counter() - start, 6),
+                # Without a reset, the peak would be the one of the largest
+                # stage so far.
+                "peak_rss_kb": _peak_rss_kb() if per_stage_rss else None,
+                "files": _count_files(self.output_dir) - files_before,
+            })
+        return results, None
+
+    def _load(self):
+        self.confgen = ConfigGenerator(self.args)
+        self.confgen._ensure_uniq_ases()
+
+    def _topo(self):
+        self.topo_dicts = self.confgen._generate_topology()
+
+    def _go_stage(self, name):
+        def f():
+            go_gen = GoGenerator(self.confgen._go_args(self.topo_dicts))
+            getattr(go_gen, "generate_%s" % name)()
+        return f
+
+    def _docker(self):
+        DockerGenerator(self.confgen._docker_args(self.topo_dicts)).generate()
+
+    def _supervisor(self):
+        SupervisorGenerator(self.confgen._supervisor_args(self.topo_dicts)).generate()
+
+    def _prometheus(self):
+        PrometheusGenerator(self.confgen._prometheus_args(self.topo_dicts)).generate()
+
+
+def _format_error(e):
+    if isinstance(e, SystemExit):
+        return "exited with status %s" % e.code
+    return "%s: %s" % (type(e).__name__, e)
+
+
+def _run_one(conn, topo_file, docker):
+    """
+    Entry point of the child process measuring a single topology/backend.
+    """
+    out_dir = tempfile.mkdtemp(prefix="scion-bench-")
+    try:
+        stages, error = GeneratorBench(topo_file, docker, out_dir).run()
+        # Resetting the peak RSS of a stage also resets the peak of the process.
+        max_rss_kb = max([_max_rss_kb()] + [st["peak_rss_kb"] or 0 for st in stages])
+        conn.send((stages, error, max_rss_kb))
+    except BaseException:
+        conn.send(([], traceback.format_exc(), None))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        conn.close()
+
+
+def run_topology(name, topo_file, backend, num_ases, num_links):
+    """
+    Measure a single topology/backend combination in a fresh process, so that
+    peak RSS is not polluted by earlier runs.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_one, args=(child, topo_file, backend == "docker"))
+    start = time.perf_counter()
+    proc.start()
+    child.close()
+    try:
+        stages, error, max_rss_kb = parent.recv()
+    except EOFError:
+        stages, error, max_rss_kb = [], "benchmark process died", None
+    proc.join()
+    return {
+        "topology": name,
+        "backend": backend,
+        "ases": num_ases,
+        "links": num_links,
+        "total_wall_s": round(time.perf_counter() - start, 6),
+        "max_rss_kb": max_rss_kb,
+        "stages": stages,
+        "error": error,
+    }
+
+
+def _topo_size(topo_file):
+    conf = load_topo_file(topo_file, use_cache=False)
+    return len(conf["ASes"]), len(conf.get("links") or [])
+
+
+def compare(old, new):
+    """
+    Print the per-stage wall time of `new` relative to `old`.
+
+    :param dict old: a previously stored benchmark report.
+    :param dict new: the current benchmark report.
+    """
+    def index(report):
+        res = {}
+        for run in report["runs"]:
+            for st in run["stages"]:
+                res[(run["topology"], run["backend"], st["stage"])] = st
+        return res
+    old_idx = index(old)
+    for key, st in sorted(index(new).items()):
+        prev = old_idx.get(key)
+        if prev is None:
+            continue
+        ratio = st["wall_s"] / prev["wall_s"] if prev["wall_s"] else float("inf")
+        print("%-14s %-10s %-20s %10.4fs -> %10.4fs (x%.2f)" % (
+            key + (prev["wall_s"], st["wall_s"], ratio)))
+
+
+def print_report(report):
+    for run in report["runs"]:
+        print("== %s (%s): %d ASes, %d links, %.3fs, peak RSS %s KiB" % (
+            run["topology"], run["backend"], run["ases"], run["links"], run["total_wall_s"],
+            run["max_rss_kb"]))
+        for st in run["stages"]:
+            print("  %-20s %10.4fs %10s KiB %7d files" % (
+                st["stage"], st["wall_s"], st["peak_rss_kb"], st["files"]))
+        if run["error"]:
+            print("  FAILED: %s" % run["error"].strip(), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SCION topology generator")
+    parser.add_argument('-t', '--topo', action='append',
+                        help='Topology file to benchmark (may be repeated, default: %s)' %
+                        ", ".join(DEFAULT_TOPOS))
+    parser.add_argument('-s', '--sizes', default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help='Comma separated number of ASes of synthetic topologies '
+                        '(empty to disable)')
+    parser.add_argument('-b', '--backend', action='append', choices=BACKENDS,
+                        help='Backend to benchmark (may be repeated, default: all)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the synthetic topologies')
+    parser.add_argument('-O', '--out', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Compare against a previous JSON report')
+    args = parser.parse_args()
+
+    topos = [(t, t) for t in (args.topo or DEFAULT_TOPOS)]
+    tmp_dir = tempfile.mkdtemp(prefix="scion-bench-topos-")
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s]:
+            path = os.path.join(tmp_dir, "synthetic-%d.topo" % size)
+            with open(path, "w") as f:
+                yaml.dump(synthetic_topo(size, args.seed), f, default_flow_style=False)
+            topos.append(("synthetic-%d" % size, path))
+        runs = []
+        for name, path in topos:
+            num_ases, num_links = _topo_size(path)
+            for backend in args.backend or BACKENDS:
+                runs.append(run_topology(name, path, backend, num_ases, num_links))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+        },
+        "runs": runs,
+    }
+    print_report(report)
+    failed = [run for run in runs if run["error"]]
+    if failed:
+        # A partial report must not become the baseline of a --compare.
+        logging.critical("%d of %d benchmark runs failed", len(failed), len(runs))
+        sys.exit(1)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
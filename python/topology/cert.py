@@ -17,12 +17,33 @@
 =============================================
 """
 import base64
+import filecmp
+import glob
 import os
+import shutil
+import tempfile
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from plumbum import local
+from lib.errors import SCIONIOError
+from lib.util import file_entry, get_write_manifest, write_file
+from topology.cert_cache import CryptoCache, isd_keys
+from topology.common import ArgsTopoConfig, seeded_random, srv_iter, TopoID
 
-from topology.common import ArgsTopoConfig, srv_iter
+PKI_BIN = './bin/scion-pki'
+
+# The scion-pki steps, in dependency order. The material of an ISD only
+# depends on the earlier steps of the same ISD, so ISDs are independent.
+PKI_STEPS = (
+    ('keys', 'private'),
+    ('trcs', 'gen'),
+    ('certs', 'issuer'),
+    ('certs', 'chain'),
+)
+#: The key of the crypto material in the state of the write manifest.
+CRYPTO_STATE = 'crypto'
 
 
 class CertGenArgs(ArgsTopoConfig):
@@ -36,42 +57,405 @@ class CertGenerator(object):
         arguments and the parsed topo config.
         """
         self.args = args
-        self.pki = local['./bin/scion-pki']
+        self.pki = self._run_pki
         self.core_count = defaultdict(int)
+        self._trc_files = None
+        self._entries = {}
+        self._entries_lock = threading.Lock()
 
     def generate(self, topo_dicts):
-        self.pki('tmpl', 'topo', self.args.topo_config, '-d', self.args.output_dir)
-        self.pki('keys', 'private', '*', '-d', self.args.output_dir)
-        self.pki('keys', 'master', '*', '-d', self.args.output_dir)
-        self.pki('trcs', 'gen', '*', '-d', self.args.output_dir)
-        self.pki('certs', 'issuer', '*', '-d', self.args.output_dir)
-        self.pki('certs', 'chain', '*', '-d', self.args.output_dir)
-        self._master_keys(topo_dicts)
-        self._copy_files(topo_dicts)
-
-    def _master_keys(self, topo_dicts):
-        for topo_id, as_topo in topo_dicts.items():
-            base = topo_id.base_dir(self.args.output_dir)
-            with open(os.path.join(base, 'keys', 'master0.key'), 'w') as f:
-                f.write(base64.b64encode(os.urandom(16)).decode())
-            with open(os.path.join(base, 'keys', 'master1.key'), 'w') as f:
-                f.write(base64.b64encode(os.urandom(16)).decode())
-
-    def _copy_files(self, topo_dicts):
-        cp = local['cp']
-        # Copy the certs and key dir for all elements.
-        for topo_id, as_topo, base in srv_iter(
-                topo_dicts, self.args.output_dir, common=True):
-            elem_dir = local.path(base)
-            as_dir = elem_dir.dirname
-            cp('-r', as_dir / 'certs', elem_dir / 'certs')
-            cp('-r', as_dir / 'keys', elem_dir / 'keys')
-            cp(as_dir.dirname.dirname // '*/trcs/*.trc', elem_dir / 'certs')
-        # Copy the customers dir for all certificate servers.
-        for topo_id, as_topo in topo_dicts.items():
-            as_dir = local.path(topo_id.base_dir(self.args.output_dir))
-            custom_dir = as_dir / 'customers'
-            if not custom_dir.exists():
+        self.generate_crypto(list(topo_dicts))
+        self.share_files(topo_dicts)
+
+    def generate_crypto(self, topo_ids):
+        """
+        Generate the keys, TRCs and certificates of all ASes, in the AS
+        directories. This only depends on the topo config.
+
+        :param list topo_ids: all ASes.
+        """
+        isds = sorted({topo_id.isd_str() for topo_id in topo_ids}, key=int)
+        if self.args.incremental:
+            self._remove_stale(topo_ids)
+        with ThreadPoolExecutor(self._jobs(len(isds))) as pool:
+            if self.args.incremental:
+                self._generate_incremental(pool, isds)
+            elif self.args.crypto_cache:
+                self._generate_cached(pool, isds)
+            else:
+                self._generate_crypto(pool, self.args.output_dir, isds)
+        # Not cached: without a seed, every run gets its own random keys.
+        self._master_keys(topo_ids, self.args.output_dir)
+
+    def share_files(self, topo_dicts):
+        """
+        Give all elements the trust material of their AS.
+        """
+        by_as = defaultdict(list)
+        for topo_id, as_topo, base in srv_iter(topo_dicts, self.args.output_dir, common=True):
+            by_as[topo_id].append(base)
+        trcs = self._trcs()
+        with ThreadPoolExecutor(self._jobs(len(topo_dicts))) as pool:
+            self._wait(pool, {
+                pool.submit(self._copy_files, topo_id, as_topo, by_as[topo_id], trcs): None
+                for topo_id, as_topo in topo_dicts.items()
+            }, None)
+
+    def share_as_files(self, topo_id, as_topo):
+        """
+        Give the elements of one AS the trust material of the AS, for the
+        streaming mode. The crypto material of all ASes must be generated.
+        """
+        elem_dirs = [base for _, _, base in
+                     srv_iter({topo_id: as_topo}, self.args.output_dir, common=True)]
+        self._copy_files(topo_id, as_topo, elem_dirs, self._trcs())
+
+    def _trcs(self):
+        if self._trc_files is None:
+            # Only the ISDs of the topology, the output directory may hold
+            # others from a previous run.
+            isds = {TopoID.intern(ia).ISD() for ia in self.args.config["ASes"]}
+            trcs = []
+            for isd in isds:
+                trcs += glob.glob(os.path.join(self.args.output_dir, isd, 'trcs', '*.trc'))
+            self._trc_files = sorted(trcs)
+        return self._trc_files
+
+    def _remove_stale(self, topo_ids):
+        """
+        Remove the ISD and AS directories of a previous run that are not in
+        the topology anymore. Their generated files are removed with the
+        manifest, but the crypto material is not tracked there.
+        """
+        as_dirs = {topo_id.base_dir(self.args.output_dir) for topo_id in topo_ids}
+        isd_dirs = {os.path.dirname(as_dir) for as_dir in as_dirs}
+        for isd_dir in glob.glob(os.path.join(self.args.output_dir, 'ISD*')):
+            if isd_dir not in isd_dirs:
+                shutil.rmtree(isd_dir)
                 continue
-            for elem in as_topo["ControlService"]:
-                cp('-r', as_dir / 'customers', as_dir / elem / 'customers')
+            for as_dir in glob.glob(os.path.join(isd_dir, 'AS*')):
+                if as_dir not in as_dirs:
+                    shutil.rmtree(as_dir)
+
+    def _generate_crypto(self, pool, out_dir, isds):
+        """
+        Generate the crypto material of the given ISDs into out_dir, except
+        for the master keys.
+        """
+        self.pki('tmpl', 'topo', self.args.topo_config, '-d', out_dir)
+        self._wait(pool, {pool.submit(self._gen_isd, isd, out_dir): "ISD%s" % isd
+                          for isd in isds}, "Generated crypto material")
+
+    def _generate_cached(self, pool, isds):
+        """
+        Install the crypto material from the cache, generating it for the ISDs
+        that are not cached yet.
+        """
+        os.makedirs(self.args.crypto_cache, exist_ok=True)
+        cache = CryptoCache(self.args.crypto_cache, self.args.config, self.args.seed, PKI_BIN)
+        missing = [isd for isd in isds if not cache.has(isd)]
+        if missing:
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=self.args.crypto_cache)
+            try:
+                self._generate_crypto(pool, staging, missing)
+                for isd in missing:
+                    cache.store(isd, os.path.join(staging, 'ISD%s' % isd))
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        print("Reused cached crypto material for %d/%d ISDs" % (
+            len(isds) - len(missing), len(isds)))
+        return {isd: cache.install(isd, self.args.output_dir) for isd in isds}
+
+    def _generate_incremental(self, pool, isds):
+        """
+        Keep the crypto material of the previous run for the ISDs whose inputs
+        (see cert_cache.isd_keys) did not change, and only (re)generate the
+        others. The inputs and the files of each ISD are kept in the state of
+        the write manifest, and the files are recorded in it.
+        """
+        manifest = get_write_manifest()
+        old = manifest.old_state.get(CRYPTO_STATE, {}) if manifest is not None else {}
+        keys = isd_keys(self.args.config, self.args.seed, PKI_BIN)
+        files = {}
+        for isd in isds:
+            prev = old.get(isd)
+            if prev and prev["key"] == keys[isd] and all(
+                    os.path.isfile(os.path.join(self.args.output_dir, rel))
+                    for rel in prev["files"]):
+                files[isd] = [os.path.join(self.args.output_dir, rel) for rel in prev["files"]]
+        missing = [isd for isd in isds if isd not in files]
+        print("Kept the crypto material of %d/%d ISDs" % (len(files), len(isds)))
+        if missing and self.args.crypto_cache:
+            files.update(self._generate_cached(pool, missing))
+        elif missing:
+            os.makedirs(self.args.output_dir, exist_ok=True)
+            staging = tempfile.mkdtemp(prefix='.staging-', dir=self.args.output_dir)
+            try:
+                self._generate_crypto(pool, staging, missing)
+                for isd in missing:
+                    files[isd] = _move_files(os.path.join(staging, 'ISD%s' % isd),
+                                             os.path.join(self.args.output_dir, 'ISD%s' % isd))
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        for isd in missing:
+            # Remove the material of the previous run that is not generated
+            # anymore, before it is shared with the elements.
+            stale = set(old.get(isd, {}).get("files", [])) - set(
+                os.path.relpath(path, self.args.output_dir) for path in files[isd])
+            for rel in stale:
+                try:
+                    os.remove(os.path.join(self.args.output_dir, rel))
+                except FileNotFoundError:
+                    pass
+        if manifest is None:
+            return
+        state = {}
+        for isd in isds:
+            for path in files[isd]:
+                manifest.record_file(path)
+            state[isd] = {
+                "key": keys[isd],
+                "files": sorted(os.path.relpath(path, self.args.output_dir)
+                                for path in files[isd]),
+            }
+        manifest.state[CRYPTO_STATE] = state
+
+    def _run_pki(self, *args):
+        # plumbum takes longer to import than the rest of the generator, and
+        # is not needed at all when the crypto material is cached.
+        from plumbum import local
+        local[PKI_BIN](*args)
+
+    def _jobs(self, shards):
+        jobs = self.args.pki_jobs or os.cpu_count() or 1
+        return max(1, min(jobs, shards))
+
+    def _wait(self, pool, futures, what):
+        """
+        Wait for the shards to finish, re-raising the first error. If what is
+        given, report each finished shard.
+        """
+        start = time.time()
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if what:
+                print("%s for %s (%d/%d, %.1fs)" % (
+                    what, futures[future], done, len(futures), time.time() - start))
+
+    def _gen_isd(self, isd, out_dir):
+        for step in PKI_STEPS:
+            self.pki(*step, isd, '-d', out_dir)
+
+    def _master_keys(self, topo_ids, out_dir):
+        for topo_id in topo_ids:
+            base = topo_id.base_dir(out_dir)
+            for idx in (0, 1):
+                path = os.path.join(base, 'keys', 'master%d.key' % idx)
+                if self.args.incremental and self.args.seed is None and os.path.isfile(path):
+                    # Keep the random keys of the previous run.
+                    with open(path) as f:
+                        key = f.read()
+                else:
+                    key = base64.b64encode(self._master_key(topo_id, idx)).decode()
+                write_file(path, key)
+
+    def _master_key(self, topo_id, idx):
+        if self.args.seed is None:
+            return os.urandom(16)
+        # Reproducible, and therefore not secret, keys for test topologies.
+        rand = seeded_random(self.args.seed, "master%d-%s" % (idx, topo_id))
+        return rand.getrandbits(128).to_bytes(16, 'big')
+
+    def _copy_files(self, topo_id, as_topo, elem_dirs, trcs):
+        as_dir = topo_id.base_dir(self.args.output_dir)
+        share = _SHARE_FUNCS[self.args.trust_store]
+        files = trust_files(as_dir, trcs)
+        if self.args.incremental:
+            _remove_stale_trust(as_dir, elem_dirs)
+            # Share the certs and key dir, the TRCs and the customers dir, but
+            # only replace what changed since the previous run.
+            custom_files = _dir_files(os.path.join(as_dir, 'customers'), 'customers')
+            for elem_dir in elem_dirs:
+                self._sync_files(elem_dir, ('certs', 'keys'), files)
+            for elem in as_topo.control_service:
+                self._sync_files(os.path.join(as_dir, elem), ('customers',), custom_files)
+        else:
+            # Share the certs and key dir, and the TRCs, with all elements.
+            for elem_dir in elem_dirs:
+                shutil.rmtree(os.path.join(elem_dir, 'certs'), ignore_errors=True)
+                shutil.rmtree(os.path.join(elem_dir, 'keys'), ignore_errors=True)
+                for rel, src in files.items():
+                    dst = os.path.join(elem_dir, rel)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    share(src, dst)
+            # Share the customers dir with all certificate servers.
+            custom_dir = os.path.join(as_dir, 'customers')
+            if os.path.exists(custom_dir):
+                for elem in as_topo.control_service:
+                    shutil.rmtree(os.path.join(as_dir, elem, 'customers'), ignore_errors=True)
+                    shutil.copytree(custom_dir, os.path.join(as_dir, elem, 'customers'),
+                                    copy_function=share)
+        if self.args.trust_store != 'copy':
+            for elem_dir in elem_dirs:
+                errors = check_trust_files(elem_dir, files)
+                if errors:
+                    raise SCIONIOError("Trust store of '%s' does not match: %s" %
+                                       (elem_dir, "; ".join(errors)))
+
+    def _sync_files(self, dst_dir, subs, files):
+        """
+        Make the given sub dirs of dst_dir share exactly the given files. Only
+        the files that are missing or differ are replaced, and all of them are
+        recorded in the write manifest, if any.
+
+        :param str dst_dir: the directory of the element.
+        :param tuple subs: the sub dirs that only hold shared files.
+        :param dict files: the source file by relative path, see trust_files.
+        """
+        mode = self.args.trust_store
+        manifest = get_write_manifest()
+        for rel in _dir_files(dst_dir, *subs):
+            if rel not in files:
+                os.remove(os.path.join(dst_dir, rel))
+        for rel, src in sorted(files.items()):
+            dst = os.path.join(dst_dir, rel)
+            if not _is_shared(src, dst, mode):
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                _SHARE_FUNCS[mode](src, dst)
+            if manifest is not None:
+                manifest.record_file(dst, self._entry(src))
+
+    def _entry(self, src):
+        """
+        The manifest entry of a shared source file. Each file is shared with
+        many elements, and is only read once.
+        """
+        with self._entries_lock:
+            entry = self._entries.get(src)
+        if entry is None:
+            entry = file_entry(src)
+            with self._entries_lock:
+                self._entries[src] = entry
+        return entry
+
+
+def trust_files(as_dir, trcs):
+    """
+    The trust material of the elements of an AS: the certs and keys of the
+    AS, and the TRCs of all ISDs in the certs dir.
+
+    :param str as_dir: the directory of the AS.
+    :param list trcs: the paths of the TRCs.
+    :returns: the source file by path relative to the element directory.
+    :rtype: dict
+    """
+    files = {}
+    for sub in ('certs', 'keys'):
+        src_dir = os.path.join(as_dir, sub)
+        for root, _, names in os.walk(src_dir):
+            for name in names:
+                src = os.path.join(root, name)
+                files[os.path.join(sub, os.path.relpath(src, src_dir))] = src
+    for trc in trcs:
+        files[os.path.join('certs', os.path.basename(trc))] = trc
+    return files
+
+
+def check_trust_files(elem_dir, files):
+    """
+    Check that the trust material of an element resolves to exactly the given
+    files, i.e. that the services see the same files as with copies.
+
+    :param str elem_dir: the directory of the element.
+    :param dict files: the source file by relative path, see trust_files.
+    :returns: the mismatches found.
+    :rtype: list
+    """
+    errors = []
+    found = set(_dir_files(elem_dir, 'certs', 'keys'))
+    for rel in sorted(found - set(files)):
+        errors.append("unexpected %s" % rel)
+    for rel, src in sorted(files.items()):
+        dst = os.path.join(elem_dir, rel)
+        if rel not in found or not os.path.exists(dst):
+            errors.append("missing %s" % rel)
+        elif not os.path.samefile(dst, src) and not filecmp.cmp(dst, src, shallow=False):
+            errors.append("%s differs from %s" % (rel, src))
+    return errors
+
+
+def _dir_files(base, *subs):
+    """
+    :returns: the files in the given sub dirs of base, by path relative to
+        base, mapped to their path.
+    :rtype: dict
+    """
+    files = {}
+    for sub in subs:
+        for root, _, names in os.walk(os.path.join(base, sub)):
+            for name in names:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, base)] = path
+    return files
+
+
+def _is_shared(src, dst, mode):
+    """
+    Whether dst already shares src the way the trust store mode does.
+    """
+    if mode == 'symlink':
+        return os.path.islink(dst) and os.readlink(dst) == _relpath(src, dst)
+    if os.path.islink(dst) or not os.path.isfile(dst):
+        return False
+    if mode == 'hardlink':
+        return os.path.samefile(src, dst)
+    return filecmp.cmp(src, dst, shallow=False)
+
+
+def _move_files(src_dir, dst_dir):
+    """
+    Move the files below src_dir to the same place below dst_dir, replacing
+    existing files. Both must be on the same file system.
+
+    :returns: the paths of the moved files below dst_dir.
+    :rtype: list
+    """
+    moved = []
+    for rel, src in sorted(_dir_files(src_dir, '.').items()):
+        dst = os.path.normpath(os.path.join(dst_dir, rel))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+        moved.append(dst)
+    return moved
+
+
+def _remove_stale_trust(as_dir, elem_dirs):
+    """
+    Remove the trust material of the elements of a previous run that are not
+    in the AS anymore. Their generated files are removed with the manifest.
+    """
+    current = set(elem_dirs)
+    for entry in os.scandir(as_dir):
+        if entry.is_dir(follow_symlinks=False) and entry.path not in current:
+            for sub in ('certs', 'keys'):
+                shutil.rmtree(os.path.join(entry.path, sub), ignore_errors=True)
+
+
+def _relpath(src, dst):
+    # Relative, so that the output directory can be moved.
+    return os.path.relpath(src, os.path.dirname(dst))
+
+
+def _symlink(src, dst):
+    os.symlink(_relpath(src, dst), dst)
+
+
+#: How elements get the shared trust material, by --trust-store mode.
+_SHARE_FUNCS = {
+    'copy': shutil.copy,
+    'hardlink': os.link,
+    'symlink': _symlink,
+}
+TRUST_STORE_MODES = tuple(_SHARE_FUNCS)
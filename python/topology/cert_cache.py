@@ -0,0 +1,165 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`cert_cache` --- Persistent cache of the generated crypto material
+=======================================================================
+
+The crypto material of an ISD (its TRCs, and the keys and certificates of its
+ASes) only depends on the crypto attributes of the ASes of the ISD, the seed
+and the scion-pki binary. The cache stores the material per ISD under a hash
+of exactly these inputs, so that e.g. a link edit reuses all of it, and an AS
+edit only regenerates its ISD. The master keys are not cached, without a seed
+they are random for every run.
+
+Storing an entry removes the entries it supersedes, i.e. the other entries of
+its ISD, and all expired entries, so that the cache does not grow and does not
+keep old private keys.
+"""
+# Stdlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+#: Bump when the layout of the cache entries changes.
+CACHE_VERSION = 2
+#: The .topo AS attributes that scion-pki tmpl topo reads.
+CRYPTO_ATTRS = ('authoritative', 'core', 'issuing', 'voting', 'cert_issuer')
+#: Entries older than this are regenerated, so that the TRCs and certificates
+#: in use are never close to the end of their validity.
+MAX_AGE = 30 * 24 * 3600
+# The name of an entry, ISD<isd>-<key>.
+_ENTRY_RE = re.compile(r"ISD(\d+)-[0-9a-f]+")
+
+
+class CryptoCache(object):
+    def __init__(self, root, topo_config, seed, pki_bin):
+        """
+        :param str root: the cache directory.
+        :param dict topo_config: the parsed topo config.
+        :param int seed: the --seed argument, or None.
+        :param str pki_bin: the path of the scion-pki binary.
+        """
+        self.root = root
+        self._keys = isd_keys(topo_config, seed, pki_bin)
+
+    def path(self, isd):
+        """
+        :param str isd: the ISD, e.g. "1".
+        :returns: the directory of the cache entry of the ISD.
+        """
+        return os.path.join(self.root, "ISD%s-%s" % (isd, self._keys[isd]))
+
+    def has(self, isd):
+        path = self.path(isd)
+        try:
+            return time.time() - os.stat(path).st_mtime < MAX_AGE
+        except OSError:
+            return False
+
+    def store(self, isd, src_dir):
+        """
+        Move the generated ISD<isd> directory into the cache.
+
+        :param str isd: the ISD.
+        :param str src_dir: the ISD directory, on the same file system.
+        """
+        path = self.path(isd)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(src_dir, path)
+        except OSError:
+            # A concurrent run stored the entry first.
+            if not os.path.isdir(path):
+                raise
+        # The age of an entry counts from when it was generated.
+        os.utime(path)
+        self._prune(isd)
+
+    def _prune(self, isd):
+        """
+        Remove the expired entries, and the other entries of isd.
+        """
+        current = os.path.basename(self.path(isd))
+        now = time.time()
+        for entry in os.scandir(self.root):
+            match = _ENTRY_RE.fullmatch(entry.name)
+            if not match or entry.name == current:
+                continue
+            try:
+                expired = now - entry.stat(follow_symlinks=False).st_mtime >= MAX_AGE
+            except OSError:
+                # Removed by a concurrent run.
+                continue
+            if match.group(1) == isd or expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def install(self, isd, output_dir):
+        """
+        Copy the cached material of an ISD into the output directory.
+
+        :returns: the paths of the installed files.
+        :rtype: list
+        """
+        src_dir = self.path(isd)
+        dst_dir = os.path.join(output_dir, "ISD%s" % isd)
+        installed = []
+        for root, _, names in os.walk(src_dir):
+            dst = os.path.normpath(os.path.join(dst_dir, os.path.relpath(root, src_dir)))
+            os.makedirs(dst, exist_ok=True)
+            for name in names:
+                shutil.copy(os.path.join(root, name), os.path.join(dst, name))
+                installed.append(os.path.join(dst, name))
+        return installed
+
+
+def isd_keys(topo_config, seed, pki_bin):
+    """
+    The hash of the inputs of the crypto material of each ISD.
+
+    :param dict topo_config: the parsed topo config.
+    :param int seed: the --seed argument, or None.
+    :param str pki_bin: the path of the scion-pki binary.
+    :returns: the key by ISD, e.g. "1".
+    :rtype: dict
+    """
+    return _isd_keys(topo_config, seed, _file_hash(pki_bin))
+
+
+def _isd_keys(topo_config, seed, pki_hash):
+    ases = {}
+    for ia, as_conf in topo_config["ASes"].items():
+        as_conf = as_conf or {}
+        attrs = {attr: str(as_conf[attr]) for attr in CRYPTO_ATTRS if attr in as_conf}
+        ases.setdefault(str(ia).split("-")[0], {})[str(ia)] = attrs
+    keys = {}
+    for isd, isd_ases in ases.items():
+        raw = json.dumps({
+            "version": CACHE_VERSION,
+            "ases": isd_ases,
+            "seed": seed,
+            "scion-pki": pki_hash,
+        }, sort_keys=True)
+        keys[isd] = hashlib.sha256(raw.encode()).hexdigest()[:32]
+    return keys
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -15,12 +15,13 @@
 # Stdlib
 import ipaddress
 import os
+import random
 import subprocess
-import sys
 from urllib.parse import urlsplit
 
 # SCION
 from lib.scion_addr import ISD_AS
+from lib.util import get_write_manifest
 from topology.net import AddressProxy
 
 COMMON_DIR = 'endhost'
@@ -65,13 +66,20 @@ class ArgsTopoDicts(ArgsBase):
     def __init__(self, args, topo_dicts):
         """
         :param object args: Contains the passed command line arguments as named attributes.
-        :param dict topo_dicts: The generated topo dicts from TopoGenerator.
+        :param dict topo_dicts: The AS plans generated by TopoGenerator, by TopoID.
         """
         super().__init__(args)
         self.topo_dicts = topo_dicts
 
 
 class TopoID(ISD_AS):
+    __slots__ = ("_base_dir",)
+
+    def __init__(self, raw=None):
+        # The last (out_dir, base_dir) pair.
+        self._base_dir = (None, None)
+        super().__init__(raw)
+
     def ISD(self):
         return "ISD%s" % self.isd_str()
 
@@ -81,11 +89,10 @@ class TopoID(ISD_AS):
     def AS_file(self):
         return "AS%s" % self.as_file_fmt()
 
-    def file_fmt(self):
-        return "%s-%s" % (self.isd_str(), self.as_file_fmt())
-
     def base_dir(self, out_dir):
-        return os.path.join(out_dir, self.ISD(), self.AS_file())
+        if self._base_dir[0] != out_dir:
+            self._base_dir = (out_dir, os.path.join(out_dir, self.ISD(), self.AS_file()))
+        return self._base_dir[1]
 
     def __lt__(self, other):
         return str(self) < str(other)
@@ -94,9 +101,69 @@ class TopoID(ISD_AS):
         return "<TopoID: %s>" % self
 
 
-def prom_addr(addr: str, port: int) -> str:
-    ip, _ = split_host_port(addr)
-    return join_host_port(ip, port)
+# The per-AS function of the running for_each_as call. Worker processes are
+# forked and inherit it, so neither the function nor the generator state it is
+# bound to need to be pickled.
+_per_as_func = None
+
+
+def _call_per_as(topo_id):
+    manifest = get_write_manifest()
+    if manifest is None:
+        _per_as_func(topo_id)
+        return None
+    start = len(manifest.journal)
+    _per_as_func(topo_id)
+    return manifest.journal[start:]
+
+
+def for_each_as(jobs, func, topo_ids):
+    """
+    Call func for every topo_id. With more than one job, the calls are spread
+    across a pool of forked worker processes; func must therefore only have
+    side effects on the filesystem, and its return value is discarded. Files
+    written by the workers are merged into the active write manifest, if any.
+
+    :param int jobs: the number of worker processes, 0 for one per CPU.
+    :param func: the function to call with each topo_id.
+    :param topo_ids: the keys of a topo dict generated by TopoGenerator.
+    """
+    global _per_as_func
+    topo_ids = list(topo_ids)
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(topo_ids))
+    if jobs <= 1:
+        for topo_id in topo_ids:
+            func(topo_id)
+        return
+    # Only imported here, most runs use a single job.
+    import multiprocessing
+    _per_as_func = func
+    try:
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            journals = pool.map(_call_per_as, topo_ids,
+                                chunksize=max(1, len(topo_ids) // (4 * jobs)))
+    finally:
+        _per_as_func = None
+    manifest = get_write_manifest()
+    if manifest is not None:
+        for journal in journals:
+            manifest.merge(journal)
+
+
+def seeded_random(seed, purpose):
+    """
+    Returns a random.Random for one purpose (e.g. "ifids"). With a seed, its
+    output only depends on the seed and the purpose, so that other users of
+    randomness do not influence it. Without a seed, it is seeded by the OS.
+
+    :param int seed: the --seed argument, or None.
+    :param str purpose: the name of the consumer.
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random("%s/%s" % (seed, purpose))
 
 
 def split_host_port(addr: str) -> (str, int):
@@ -115,15 +182,11 @@ def join_host_port(host: str, port: int) -> str:
     return '[{}]:{}'.format(host, port)
 
 
-def sciond_ip(docker, topo_id, networks):
-    for i, net in enumerate(networks):
-        for prog, ip_net in networks[net].items():
-            if prog == 'sd%s' % topo_id.file_fmt():
-                return ip_net.ip
-    return None
+def sciond_ip(docker, topo_id, net_index):
+    return net_index.ip('sd%s' % topo_id.file_fmt())
 
 
-def prom_addr_dispatcher(docker, topo_id, networks, port, name):
+def prom_addr_dispatcher(docker, topo_id, net_index, port, name):
     if not docker:
         return "[127.0.0.1]:%s" % port
     target_name = ''
@@ -133,17 +196,17 @@ def prom_addr_dispatcher(docker, topo_id, networks, port, name):
         target_name = 'sig%s' % topo_id.file_fmt()
     else:
         target_name = 'disp%s' % topo_id.file_fmt()
-    for _, net in enumerate(networks):
-        if target_name in networks[net]:
-            return '[%s]:%s' % (networks[net][target_name].ip, port)
-    return None
+    ip = net_index.ip(target_name)
+    if ip is None:
+        return None
+    return '[%s]:%s' % (ip, port)
 
 
 def srv_iter(topo_dicts, out_dir, common=False):
     for topo_id, as_topo in topo_dicts.items():
         base = topo_id.base_dir(out_dir)
         for service in SCION_SERVICE_NAMES:
-            for elem in as_topo[service]:
+            for elem in getattr(as_topo, service):
                 yield topo_id, as_topo, os.path.join(base, elem)
         if common:
             yield topo_id, as_topo, os.path.join(base, COMMON_DIR)
@@ -159,35 +222,24 @@ def docker_image(args, image):
     return image
 
 
-def docker_host(in_docker, docker, addr=None):
-    if in_docker:
-        # If in-docker we need to know the DOCKER0 IP
-        addr = os.getenv('DOCKER0', None)
-        if not addr:
-            print('DOCKER0 env variable required! Exiting!')
-            sys.exit(1)
-    elif docker or not addr:
-        # Using docker topology or there is no default addr,
-        # we directly get the DOCKER0 IP
-        addr = docker_ip()
-    return addr
-
-
 def docker_ip():
     return subprocess.check_output(['tools/docker-ip']).decode("utf-8").strip()
 
 
-def remote_nets(networks, topo_id):
+def remote_nets(net_index, topo_id):
     """
     Returns the subnets of all remote ASes the SIG in topo_id is connected to.
-    :param networks dict: Scion elem to subnet/IP map.
+    :param net_index NetworkIndex: The index of the allocated networks.
     :param topo_id: A key of a topo dict generated by TopoGenerator.
     :return: String of comma separated subnets.
     """
     rem_nets = []
-    for key in networks:
-        if 'sig' in key and topo_id.file_fmt() not in key:
-            rem_nets.append(str(networks[key][0]['net']))
+    for t_id in net_index.ases():
+        if t_id == topo_id:
+            continue
+        entry = net_index.lookup('sig%s' % t_id.file_fmt())
+        if entry is not None:
+            rem_nets.append(str(entry[0]))
     return ','.join(rem_nets)
 
 
@@ -18,10 +18,11 @@
 """
 # Stdlib
 import configparser
-import json
 import logging
 import os
+import shutil
 import sys
+from contextlib import contextmanager
 from io import StringIO
 
 # SCION
@@ -30,25 +31,35 @@ from lib.defines import (
     DEFAULT6_NETWORK,
     NETWORKS_FILE,
 )
-from lib.scion_addr import ISD_AS
+from lib.scion_addr import ISDASArray
 from lib.util import (
-    load_yaml_file,
+    BatchWriter,
+    dump_json,
+    get_batch_writer,
+    set_batch_writer,
+    set_write_manifest,
     write_file,
+    WriteManifest,
 )
 from topology.cert import CertGenArgs, CertGenerator
-from topology.common import ArgsBase
-from topology.docker import DockerGenArgs, DockerGenerator
+from topology.common import ArgsBase, TopoID
 from topology.go import GoGenArgs, GoGenerator
+from topology.host import resolve_host_facts
 from topology.jaeger import JaegerGenArgs, JaegerGenerator
 from topology.net import (
+    NetworkIndex,
     SubnetGenerator,
     DEFAULT_NETWORK,
 )
+from topology.profiling import StageProfiler
 from topology.prometheus import PrometheusGenArgs, PrometheusGenerator
-from topology.supervisor import SupervisorGenArgs, SupervisorGenerator
+from topology.stages import StageGraph
 from topology.topo import TopoGenArgs, TopoGenerator
+from topology.topo_cache import load_topo_file
 
 DEFAULT_TOPOLOGY_FILE = "topology/default.topo"
+# The writer threads only overlap with rendering if there is a spare CPU.
+DEFAULT_WRITE_THREADS = min(4, (os.cpu_count() or 1) - 1)
 
 SCIOND_ADDRESSES_FILE = "sciond_addresses.json"
 
@@ -69,19 +80,48 @@ class ConfigGenerator(object):
         :param ConfigGenArgs args: Contains the passed command line arguments.
         """
         self.args = args
-        self.topo_config = load_yaml_file(self.args.topo_config)
+        self.args.host = resolve_host_facts(self.args)
+        self.profiler = StageProfiler(self.args.profile, self.args.profile_dir,
+                                      self.args.cprofile)
+        with self.profiler.stage("load_topo"):
+            self.topo_config = load_topo_file(self.args.topo_config,
+                                              not self.args.no_topo_cache)
         if self.args.sig and not self.args.docker:
             logging.critical("Cannot use sig without docker!")
             sys.exit(1)
+        if self.args.trust_store == 'symlink' and self.args.docker:
+            # Only the element directory is mounted into the containers.
+            logging.critical("Cannot use a symlink trust store with docker, use hardlink!")
+            sys.exit(1)
+        if self.args.archive:
+            self._check_archive()
+        if self.args.stream and self.args.jobs != 1:
+            # The ASes are released as they are written, in this process.
+            logging.critical("Cannot use --stream with --jobs!")
+            sys.exit(1)
+        if self.args.profile and self.args.cprofile:
+            # cProfile only records the thread that enables it, see StageProfiler.
+            self.args.serial_stages = True
+            self.args.jobs = 1
         self.default_mtu = None
         self._read_defaults(self.args.network)
 
+    def _check_archive(self):
+        # The backends that only some runs need are imported on demand, the
+        # generator is started many times by scion.sh and the tests.
+        from topology.archive import ARCHIVE_SUFFIXES, archive_factory
+        if archive_factory(self.args.archive) is None:
+            logging.critical("Unknown archive format '%s', use one of: %s",
+                             self.args.archive, ", ".join(ARCHIVE_SUFFIXES))
+            sys.exit(1)
+
     def _read_defaults(self, network):
         """
         Configure default network.
         """
         defaults = self.topo_config.get("defaults", {})
-        self.subnet_gen4 = SubnetGenerator(DEFAULT_NETWORK, self.args.docker, self.args.in_docker)
+        self.subnet_gen4 = SubnetGenerator(network or DEFAULT_NETWORK, self.args.docker,
+                                           self.args.in_docker)
         self.subnet_gen6 = SubnetGenerator(DEFAULT6_NETWORK, self.args.docker, self.args.in_docker)
         self.default_mtu = defaults.get("mtu", DEFAULT_MTU)
 
@@ -89,34 +129,171 @@ class ConfigGenerator(object):
         """
         Generate all needed files.
         """
-        self._ensure_uniq_ases()
-        topo_dicts, self.networks = self._generate_topology()
-        self._generate_with_topo(topo_dicts)
+        manifest = None
+        if self.args.incremental:
+            manifest = WriteManifest.load(self.args.output_dir)
+            set_write_manifest(manifest)
+        writer = None
+        if self.args.write_threads > 0:
+            writer = BatchWriter(self.args.write_threads, self.args.write_tmpfile)
+            set_batch_writer(writer)
+        try:
+            self._generate_all()
+        finally:
+            if writer is not None:
+                set_batch_writer(None)
+                writer.close()
+        if manifest is not None:
+            set_write_manifest(None)
+            self._finish_incremental(manifest)
+        if self.args.archive:
+            with self._stage("archive"):
+                self._pack_archive()
+        self.profiler.finish()
+
+    def _pack_archive(self):
+        """
+        Pack the output directory into the archive. scion-pki and the cert
+        copies need the files on disk, so the tree is always written first.
+        """
+        from topology.archive import pack
+        pack(self.args.output_dir, self.args.archive)
+        if self.args.archive_only:
+            shutil.rmtree(self.args.output_dir)
+
+    def _generate_all(self):
+        certgen = CertGenerator(self._cert_args())
+        if self.args.stream:
+            graph = self._stream_graph(certgen)
+        else:
+            graph = self._graph(certgen)
+        try:
+            graph.run(self._run_stage, concurrent=not self.args.serial_stages)
+        finally:
+            # The same times as in the stage table.
+            timing = self.profiler.timing() if self.profiler.enabled else None
+            self.profiler.critical_path = graph.critical_path(timing)
+
+    def _graph(self, certgen):
+        graph = StageGraph()
+        graph.add("ensure_uniq_ases", self._ensure_uniq_ases)
+        graph.add("topology", self._topology_stage, ["ensure_uniq_ases"])
+        graph.add("go", lambda: self._generate_go(self.topo_dicts), ["topology"])
+        if self.args.docker:
+            graph.add("docker", lambda: self._generate_docker(self.topo_dicts), ["topology"])
+        else:
+            graph.add("supervisor", lambda: self._generate_supervisor(self.topo_dicts),
+                      ["topology"])
+        graph.add("jaeger", lambda: self._generate_jaeger(self.topo_dicts), ["topology"])
+        graph.add("prometheus", lambda: self._generate_prom_conf(self.topo_dicts), ["topology"])
+        # scion-pki only needs the topo config, and mostly waits on subprocesses.
+        graph.add("crypto", lambda: certgen.generate_crypto(self._topo_ids()),
+                  ["ensure_uniq_ases"], exclusive=self._pki_exclusive())
+        graph.add("certs", lambda: certgen.share_files(self.topo_dicts),
+                  ["topology", "crypto"], exclusive=self._pki_exclusive())
+        graph.add("networks_conf",
+                  lambda: self._write_networks_conf(self.networks, NETWORKS_FILE), ["topology"])
+        graph.add("sciond_conf",
+                  lambda: self._write_sciond_conf(self.networks, SCIOND_ADDRESSES_FILE),
+                  ["topology"])
+        return graph
+
+    def _stream_graph(self, certgen):
+        """
+        The stages of the streaming mode. The plan stage only does the work
+        that needs all ASes: it reads the links, allocates the subnets and
+        ports, and writes the files that cover all ASes. The ases stage then
+        renders and writes one AS after the other, and releases its plan, so
+        that only the global artifacts grow with the topology.
+        """
+        graph = StageGraph()
+        graph.add("ensure_uniq_ases", self._ensure_uniq_ases)
+        graph.add("plan", self._plan_stage, ["ensure_uniq_ases"])
+        graph.add("jaeger", lambda: self._generate_jaeger(self.topo_dicts), ["plan"])
+        graph.add("crypto", lambda: certgen.generate_crypto(self._topo_ids()),
+                  ["ensure_uniq_ases"], exclusive=self._pki_exclusive())
+        graph.add("ases", lambda: self._generate_ases(certgen), ["plan", "crypto"])
+        return graph
+
+    def _pki_exclusive(self):
+        """
+        Whether the crypto and certs stages must not overlap the renderers.
+        With more than one job, the renderers fork worker processes, and a
+        fork while the scion-pki thread holds a lock (e.g. in subprocess or
+        logging) can deadlock the worker.
+        """
+        return self.args.jobs != 1
+
+    def _topology_stage(self):
+        self.topo_dicts = self._generate_topology()
+
+    def _plan_stage(self):
+        self.topo_gen = TopoGenerator(self._topo_args())
+        self.networks = self.topo_gen.plan_topology()
+        self.topo_dicts = self.topo_gen.plan.ases
+        self._index_networks()
+        self.topo_gen.write_global_files()
         self._write_networks_conf(self.networks, NETWORKS_FILE)
         self._write_sciond_conf(self.networks, SCIOND_ADDRESSES_FILE)
 
-    def _ensure_uniq_ases(self):
-        seen = set()
-        for asStr in self.topo_config["ASes"]:
-            ia = ISD_AS(asStr)
-            if ia.as_str() in seen:
-                logging.critical("Non-unique AS Id '%s'", ia.as_str())
-                sys.exit(1)
-            seen.add(ia.as_str())
-
-    def _generate_with_topo(self, topo_dicts):
-        self._generate_go(topo_dicts)
+    def _generate_ases(self, certgen):
+        """
+        Render, write and release one AS after the other.
+        """
+        gens = [GoGenerator(self._go_args(self.topo_dicts))]
         if self.args.docker:
-            self._generate_docker(topo_dicts)
+            from topology.docker import DockerGenerator
+            gens.append(DockerGenerator(self._docker_args(self.topo_dicts)))
         else:
-            self._generate_supervisor(topo_dicts)
-        self._generate_jaeger(topo_dicts)
-        self._generate_prom_conf(topo_dicts)
-        self._generate_certs_trcs(topo_dicts)
+            from topology.supervisor import SupervisorGenerator
+            gens.append(SupervisorGenerator(self._supervisor_args(self.topo_dicts)))
+        gens.append(PrometheusGenerator(self._prometheus_args(self.topo_dicts)))
+        for topo_id in list(self.topo_dicts):
+            self.topo_gen.write_as_topo(topo_id)
+            for gen in gens:
+                gen.generate_as(topo_id)
+            certgen.share_as_files(topo_id, self.topo_dicts[topo_id])
+            del self.topo_dicts[topo_id]
+        for gen in gens:
+            gen.finish()
 
-    def _generate_certs_trcs(self, topo_dicts):
-        certgen = CertGenerator(self._cert_args())
-        certgen.generate(topo_dicts)
+    def _topo_ids(self):
+        return [TopoID.intern(ia) for ia in self.topo_config["ASes"]]
+
+    def _run_stage(self, name, func):
+        with self._stage(name):
+            func()
+
+    @contextmanager
+    def _stage(self, name):
+        """
+        A profiled generator stage. All files of the stage are written when it
+        ends, so later stages can rely on them.
+        """
+        with self.profiler.stage(name):
+            yield
+            writer = get_batch_writer()
+            if writer is not None:
+                writer.flush()
+
+    def _finish_incremental(self, manifest):
+        """
+        Remove files that are no longer generated, save the manifest and report
+        the services whose files changed.
+        """
+        removed = manifest.remove_orphans()
+        manifest.save()
+        services = sorted({_service_of(rel) for rel in manifest.changed.union(removed)})
+        print("Changed: %d files, removed: %d files, unchanged: %d files" % (
+            len(manifest.changed), len(removed), len(manifest.files) - len(manifest.changed)))
+        for service in services:
+            print("Changed service: %s" % service)
+
+    def _ensure_uniq_ases(self):
+        dups = ISDASArray.from_strs(self.topo_config["ASes"], TopoID).duplicate_ases()
+        if dups:
+            logging.critical("Non-unique AS Id '%s'", dups[0].as_str())
+            sys.exit(1)
 
     def _cert_args(self):
         return CertGenArgs(self.args, self.topo_config)
@@ -131,7 +308,7 @@ class ConfigGenerator(object):
         go_gen.generate_disp()
 
     def _go_args(self, topo_dicts):
-        return GoGenArgs(self.args, topo_dicts, self.networks)
+        return GoGenArgs(self.args, topo_dicts, self.net_index)
 
     def _generate_jaeger(self, topo_dicts):
         args = JaegerGenArgs(self.args, topo_dicts)
@@ -140,27 +317,38 @@ class ConfigGenerator(object):
 
     def _generate_topology(self):
         topo_gen = TopoGenerator(self._topo_args())
-        return topo_gen.generate()
+        topo_dicts, self.networks = topo_gen.generate()
+        self._index_networks()
+        return topo_dicts
+
+    def _index_networks(self):
+        locations = dict(self.subnet_gen4.locations)
+        locations.update(self.subnet_gen6.locations)
+        self.net_index = NetworkIndex(self.networks, locations)
 
     def _topo_args(self):
         return TopoGenArgs(self.args, self.topo_config, self.subnet_gen4,
                            self.subnet_gen6, self.default_mtu)
 
     def _generate_supervisor(self, topo_dicts):
+        from topology.supervisor import SupervisorGenerator
         args = self._supervisor_args(topo_dicts)
         super_gen = SupervisorGenerator(args)
         super_gen.generate()
 
     def _supervisor_args(self, topo_dicts):
+        from topology.supervisor import SupervisorGenArgs
         return SupervisorGenArgs(self.args, topo_dicts)
 
     def _generate_docker(self, topo_dicts):
+        from topology.docker import DockerGenerator
         args = self._docker_args(topo_dicts)
         docker_gen = DockerGenerator(args)
         docker_gen.generate()
 
     def _docker_args(self, topo_dicts):
-        return DockerGenArgs(self.args, topo_dicts, self.networks)
+        from topology.docker import DockerGenArgs
+        return DockerGenArgs(self.args, topo_dicts, self.networks, self.net_index)
 
     def _generate_prom_conf(self, topo_dicts):
         args = self._prometheus_args(topo_dicts)
@@ -168,7 +356,7 @@ class ConfigGenerator(object):
         prom_gen.generate()
 
     def _prometheus_args(self, topo_dicts):
-        return PrometheusGenArgs(self.args, topo_dicts, self.networks)
+        return PrometheusGenArgs(self.args, topo_dicts, self.net_index)
 
     def _write_ca_files(self, topo_dicts, ca_files):
         isds = set()
@@ -188,6 +376,10 @@ class ConfigGenerator(object):
             config[net] = sub_conf
         text = StringIO()
         config.write(text)
+        # The section proxies reference the parser, which would keep all
+        # networks alive until the next full garbage collection.
+        for section in config.sections():
+            config.remove_section(section)
         write_file(os.path.join(self.args.output_dir, out_file), text.getvalue())
 
     def _write_sciond_conf(self, networks, out_file):
@@ -197,5 +389,17 @@ class ConfigGenerator(object):
                 if prog.startswith("sd"):
                     ia = prog[2:].replace("_", ":")
                     d[ia] = str(ip_net.ip)
-        with open(os.path.join(self.args.output_dir, out_file), mode="w") as f:
-            json.dump(d, f, sort_keys=True, indent=4)
+        write_file(os.path.join(self.args.output_dir, out_file),
+                   dump_json(d, sort_keys=True, indent=4))
+
+
+def _service_of(rel_path):
+    """
+    Returns the element directory (e.g. ISD1/ASff00_0_110/br1-ff00_0_110-1) or
+    the AS directory a generated file belongs to, or the top-level entry for
+    files outside of AS directories.
+    """
+    parts = rel_path.split(os.sep)
+    if parts[0].startswith("ISD") and len(parts) > 2 and parts[1].startswith("AS"):
+        return os.path.join(*parts[:3]) if len(parts) > 3 else os.path.join(*parts[:2])
+    return parts[0]
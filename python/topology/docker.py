@@ -15,11 +15,10 @@
 # Stdlib
 import copy
 import os
-# External packages
-import yaml
 # SCION
 from lib.defines import DOCKER_COMPOSE_CONFIG_VERSION
 from lib.util import (
+    dump_yaml,
     write_file,
 )
 from topology.common import (
@@ -35,14 +34,16 @@ DOCKER_CONF = 'scion-dc.yml'
 
 
 class DockerGenArgs(ArgsTopoDicts):
-    def __init__(self, args, topo_dicts, networks):
+    def __init__(self, args, topo_dicts, networks, net_index):
         """
         :param object args: Contains the passed command line arguments as named attributes.
-        :param dict topo_dicts: The generated topo dicts from TopoGenerator.
+        :param dict topo_dicts: The AS plans generated by TopoGenerator, by TopoID.
         :param dict networks: The generated networks from SubnetGenerator.
+        :param NetworkIndex net_index: The index of the generated networks.
         """
         super().__init__(args, topo_dicts)
         self.networks = networks
+        self.net_index = net_index
 
 
 class DockerGenerator(object):
@@ -53,30 +54,58 @@ class DockerGenerator(object):
         self.args = args
         self.dc_conf = {'version': DOCKER_COMPOSE_CONFIG_VERSION,
                         'services': {}, 'networks': {}, 'volumes': {}}
+        # The SIG services are merged into the compose config at the end, so
+        # that the volumes keep their order when the ASes are streamed.
+        self.sig_conf = {'services': {}, 'volumes': {}}
         self.elem_networks = {}
         self.bridges = {}
-        self.output_base = os.environ.get('SCION_OUTPUT_BASE', os.getcwd())
-        self.user_spec = os.environ.get('SCION_USERSPEC', '$LOGNAME')
+        self.output_base = args.host.output_base
+        self.user_spec = args.host.user_spec
         self.prefix = 'scion_docker_' if self.args.in_docker else 'scion_'
+        self._create_networks()
+        self.docker_utils_gen = DockerUtilsGenerator(self._docker_utils_args())
+        self.sig_gen = None
+        if self.args.sig:
+            self.sig_gen = SIGGenerator(self._sig_args())
 
     def generate(self):
-        self._create_networks()
-        for topo_id, topo in self.args.topo_dicts.items():
-            base = os.path.join(self.output_base, topo_id.base_dir(self.args.output_dir))
-            self._gen_topo(topo_id, topo, base)
+        for topo_id in self.args.topo_dicts:
+            self._gen_as_topo(topo_id)
         if self.args.sig:
-            self._gen_sig()
-        docker_utils_gen = DockerUtilsGenerator(self._docker_utils_args())
-        self.dc_conf = docker_utils_gen.generate()
+            for topo_id in self.args.topo_dicts:
+                self.sig_gen.generate_as(topo_id)
+        for topo_id in self.args.topo_dicts:
+            self.docker_utils_gen.generate_as(topo_id)
+        self.finish()
 
+    def generate_as(self, topo_id):
+        """
+        Generate the services of one AS, for the streaming mode.
+        """
+        self._gen_as_topo(topo_id)
+        if self.args.sig:
+            self.sig_gen.generate_as(topo_id)
+        self.docker_utils_gen.generate_as(topo_id)
+
+    def finish(self):
+        """
+        Write the compose config, once all ASes are generated.
+        """
+        self.dc_conf['services'].update(self.sig_conf['services'])
+        self.dc_conf['volumes'].update(self.sig_conf['volumes'])
+        self.docker_utils_gen.finish()
         write_file(os.path.join(self.args.output_dir, DOCKER_CONF),
-                   yaml.dump(self.dc_conf, default_flow_style=False))
+                   dump_yaml(self.dc_conf, default_flow_style=False))
 
     def _docker_utils_args(self):
         return DockerUtilsGenArgs(self.args, self.dc_conf, self.bridges, self.elem_networks)
 
     def _sig_args(self):
-        return SIGGenArgs(self.args,  self.dc_conf, self.bridges, self.elem_networks)
+        return SIGGenArgs(self.args, self.sig_conf, self.bridges, self.elem_networks)
+
+    def _gen_as_topo(self, topo_id):
+        base = os.path.join(self.output_base, topo_id.base_dir(self.args.output_dir))
+        self._gen_topo(topo_id, self.args.topo_dicts[topo_id], base)
 
     def _gen_topo(self, topo_id, topo, base):
         self._dispatcher_conf(topo_id, topo, base)
@@ -84,10 +113,6 @@ class DockerGenerator(object):
         self._control_service_conf(topo_id, topo, base)
         self._sciond_conf(topo_id, base)
 
-    def _gen_sig(self):
-        sig_gen = SIGGenerator(self._sig_args())
-        self.dc_conf = sig_gen.generate()
-
     def _create_networks(self):
         for network in self.args.networks:
             for elem in self.args.networks[network]:
@@ -117,7 +142,7 @@ class DockerGenerator(object):
                 self.dc_conf['networks'][net_name]['enable_ipv6'] = True
 
     def _br_conf(self, topo_id, topo, base):
-        for k, _ in topo.get("border_routers", {}).items():
+        for k in topo.border_routers:
             disp_id = k
             entry = {
                 'image': docker_image(self.args, 'border'),
@@ -156,7 +181,7 @@ class DockerGenerator(object):
             self.dc_conf['services']['scion_%s' % k] = entry
 
     def _control_service_conf(self, topo_id, topo, base):
-        for k, v in topo.get("control_service", {}).items():
+        for k in topo.control_service:
             entry = {
                 'image': docker_image(self.args, 'cs'),
                 'container_name': self.prefix + k,
@@ -190,7 +215,7 @@ class DockerGenerator(object):
                 self._logs_vol()
             ]
         }
-        keys = list(topo.get("border_routers", {})) + list(topo.get("control_service", {}))
+        keys = list(topo.border_routers) + list(topo.control_service)
         for disp_id in keys:
             entry = copy.deepcopy(base_entry)
             net_key = disp_id
@@ -41,17 +41,30 @@ class DockerUtilsGenerator(object):
     def __init__(self, args):
         self.args = args
         self.dc_conf = args.dc_conf
-        self.user_spec = os.environ.get('SCION_USERSPEC', '$LOGNAME')
-        self.output_base = os.environ.get('SCION_OUTPUT_BASE', os.getcwd())
+        self.user_spec = args.host.user_spec
+        self.output_base = args.host.output_base
+        self._sig_testing = []
 
     def generate(self):
-        self._utils_conf()
         for topo_id in self.args.topo_dicts:
-            self._test_conf(topo_id)
-        if self.args.sig:
-            self._sig_testing_conf()
+            self.generate_as(topo_id)
+        self.finish()
         return self.dc_conf
 
+    def generate_as(self, topo_id):
+        self._test_conf(topo_id)
+        if self.args.sig:
+            self._sig_testing.append(self._sig_testing_line(topo_id))
+
+    def finish(self):
+        """
+        Add the utility services, once the volumes of all ASes are known.
+        """
+        self._utils_conf()
+        if self.args.sig:
+            conf_path = os.path.join(self.args.output_dir, 'sig-testing.conf')
+            write_file(conf_path, ''.join(self._sig_testing))
+
     def _utils_conf(self):
         entry_chown = {
             'image': 'busybox',
@@ -102,17 +115,13 @@ class DockerUtilsGenerator(object):
             # net information for the connected SIG
             sig_net = self.args.networks['sig%s' % topo_id.file_fmt()][0]
             entry['environment']['SIG_IP'] = str(sig_net[ipv])
-            entry['environment']['REMOTE_NETS'] = remote_nets(self.args.networks, topo_id)
+            entry['environment']['REMOTE_NETS'] = remote_nets(self.args.net_index, topo_id)
         self.dc_conf['services'][name] = entry
 
-    def _sig_testing_conf(self):
-        text = ''
-        for topo_id in self.args.topo_dicts:
-            net = self.args.networks['tester_%s' % topo_id.file_fmt()][0]
-            ipv = 'ipv4'
-            if ipv not in net:
-                ipv = 'ipv6'
-            ip = net[ipv]
-            text += str(topo_id) + ' ' + str(ip) + '\n'
-            conf_path = os.path.join(self.args.output_dir, 'sig-testing.conf')
-            write_file(conf_path, text)
+    def _sig_testing_line(self, topo_id):
+        net = self.args.networks['tester_%s' % topo_id.file_fmt()][0]
+        ipv = 'ipv4'
+        if ipv not in net:
+            ipv = 'ipv6'
+        ip = net[ipv]
+        return str(topo_id) + ' ' + str(ip) + '\n'
@@ -24,11 +24,19 @@ import argparse
 from lib.defines import (
     GEN_PATH,
 )
+from topology.cert import TRUST_STORE_MODES
 from topology.config import (
     ConfigGenerator,
     ConfigGenArgs,
     DEFAULT_TOPOLOGY_FILE,
+    DEFAULT_WRITE_THREADS,
 )
+from topology.net import (
+    DEFAULT_PORT_RANGES,
+    EPHEMERAL_PORT_RANGE_FILE,
+    format_port_ranges,
+)
+from topology.profiling import DEFAULT_PROFILE_DIR
 
 
 def add_arguments(parser):
@@ -47,8 +55,27 @@ def add_arguments(parser):
                         available timeout')
     parser.add_argument('--random-ifids', action='store_true',
                         help='Generate random IFIDs')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for all randomness of the generator (random IFIDs, master '
+                        'keys), for reproducible output. Master keys are not secret then.')
     parser.add_argument('--in-docker', action='store_true',
                         help='Set if running in a docker container')
+    parser.add_argument('--docker0-ip',
+                        help='IP of the docker0 bridge (default: $DOCKER0 with --in-docker, '
+                        'the output of tools/docker-ip otherwise)')
+    parser.add_argument('--uid', type=int,
+                        help='User id the jaeger container runs as (default: current user)')
+    parser.add_argument('--gid', type=int,
+                        help='Group id the jaeger container runs as (default: current group)')
+    parser.add_argument('--output-base',
+                        help='Directory docker volumes are mounted from '
+                        '(default: $SCION_OUTPUT_BASE or the working directory)')
+    parser.add_argument('--user-spec',
+                        help='User the docker services run as '
+                        '(default: $SCION_USERSPEC or $LOGNAME)')
+    parser.add_argument('--ephemeral-ports',
+                        help='Ephemeral port range of the host, e.g. 32768-60999, or "none" '
+                        '(default: read from %s)' % EPHEMERAL_PORT_RANGE_FILE)
     parser.add_argument('--docker-registry', help='Specify docker registry to pull images from')
     parser.add_argument('--image-tag', help='Docker image tag')
     parser.add_argument('--sig', action='store_true',
@@ -56,6 +83,58 @@ def add_arguments(parser):
                         to be built manually e.g. when running acceptance tests)')
     parser.add_argument('-qos', '--colibri', action='store_true',
                         help='Generate COLIBRI service')
+    parser.add_argument('--port-ranges', default=format_port_ranges(DEFAULT_PORT_RANGES),
+                        help='Comma separated port ranges for services without docker '
+                        '(default: %(default)s)')
+    parser.add_argument('--skip-ephemeral-ports', action='store_true',
+                        help='Do not allocate ports in the ephemeral range of the host, instead '
+                        'of only warning about them')
+    parser.add_argument('--port-reuse', action='store_true',
+                        help='Allocate ports per IP instead of globally without docker')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes used to render per-AS files (0: one per CPU)')
+    parser.add_argument('--pki-jobs', type=int, default=0,
+                        help='Number of ISDs whose crypto material is generated concurrently '
+                        '(0: one per CPU)')
+    parser.add_argument('--crypto-cache',
+                        help='Directory in which the generated keys, TRCs and certificates are '
+                        'cached per ISD, and reused while the crypto attributes of its ASes, '
+                        'the seed and scion-pki do not change')
+    parser.add_argument('--trust-store', choices=TRUST_STORE_MODES, default='copy',
+                        help='How elements get the certs, keys and TRCs of their AS: as copies, '
+                        'or as hard or symbolic links to one shared copy (default: %(default)s)')
+    parser.add_argument('--write-threads', type=int, default=DEFAULT_WRITE_THREADS,
+                        help='Number of threads that write the generated files in the background '
+                        '(0: write them directly, default: %(default)s)')
+    parser.add_argument('--write-tmpfile', action='store_true',
+                        help='With --write-threads, write files through O_TMPFILE where the '
+                        'file system supports it')
+    parser.add_argument('--archive',
+                        help='Also pack the output directory into this file. The suffix selects '
+                        'the format: .tar, .tar.gz, .tgz, .tar.xz, .zip, .sqlite or .db')
+    parser.add_argument('--archive-only', action='store_true',
+                        help='With --archive, remove the output directory once it is packed')
+    parser.add_argument('--serial-stages', action='store_true',
+                        help='Run the generator stages one after another, instead of overlapping '
+                        'the crypto generation with the renderers')
+    parser.add_argument('--stream', action='store_true',
+                        help='Render and write one AS after the other, releasing it once it is '
+                        'written, so that the memory use does not grow with the topology')
+    parser.add_argument('--no-topo-cache', action='store_true',
+                        help='Always parse the topology file, instead of reusing the parsed '
+                        'config cached next to it in .<name>.cache')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only rewrite changed files and remove stale ones, based on the '
+                        'manifest of the previous run in the output directory')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print a per-stage time and memory breakdown of the generator. The '
+                        'memory peaks of overlapping stages include each other, use '
+                        '--serial-stages to separate them')
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIR,
+                        help='Directory for the profile report (default: %(default)s)')
+    parser.add_argument('--cprofile', action='store_true',
+                        help='With --profile, also dump a cProfile profile per stage. The stages '
+                        'then run one after another, in a single process')
     return parser
 
 
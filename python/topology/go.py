@@ -18,24 +18,21 @@
 """
 # Stdlib
 import os
-import toml
-import yaml
 
 # SCION
-from lib.util import write_file
+from lib.scion_addr import ISDASArray
+from lib.util import dump_yaml, write_file
 from topology.common import (
     ArgsTopoDicts,
     BR_CONFIG_NAME,
     COMMON_DIR,
     CS_CONFIG_NAME,
     DISP_CONFIG_NAME,
-    docker_host,
+    for_each_as,
     join_host_port,
-    prom_addr,
     prom_addr_dispatcher,
     sciond_ip,
     sciond_name,
-    split_host_port,
     SD_API_PORT,
     SD_CONFIG_NAME,
     CO_CONFIG_NAME,
@@ -50,6 +47,7 @@ from topology.prometheus import (
     DISP_PROM_PORT,
     CO_PROM_PORT,
 )
+from topology.templates import TemplateCache
 from topology.topo import DEFAULT_LINK_BW
 
 CS_QUIC_PORT = 30352
@@ -57,9 +55,9 @@ CO_QUIC_PORT = 30357
 
 
 class GoGenArgs(ArgsTopoDicts):
-    def __init__(self, args, topo_dicts, networks):
+    def __init__(self, args, topo_dicts, net_index):
         super().__init__(args, topo_dicts)
-        self.networks = networks
+        self.net_index = net_index
 
 
 class GoGenerator(object):
@@ -72,46 +70,89 @@ class GoGenerator(object):
         self.db_dir = '/share/cache' if args.docker else 'gen-cache'
         self.certs_dir = '/share/crypto' if args.docker else 'gen-certs'
         self.log_level = 'trace' if args.trace else 'debug'
+        # The configs of a kind only differ in a few fields, they are rendered
+        # from compiled templates of the _build_*_conf dicts.
+        self.templates = TemplateCache()
+        self._co_ases_mask = None
+
+    def generate_as(self, topo_id):
+        """
+        Generate the configs of the elements of one AS, for the streaming mode.
+        """
+        self._gen_as_br(topo_id)
+        self._gen_as_sciond(topo_id)
+        self._gen_as_control_service(topo_id)
+        if self.args.colibri:
+            self._gen_as_co(topo_id)
+        if self.args.docker:
+            self._gen_as_disp_docker(topo_id)
+
+    def finish(self):
+        """
+        Generate the configs that are not per AS, for the streaming mode.
+        """
+        if not self.args.docker:
+            self._gen_disp_host()
 
     def generate_br(self):
-        for topo_id, topo in self.args.topo_dicts.items():
-            for k, v in topo.get("border_routers", {}).items():
-                base = topo_id.base_dir(self.args.output_dir)
-                br_conf = self._build_br_conf(topo_id, topo["isd_as"], base, k, v)
-                write_file(os.path.join(base, k, BR_CONFIG_NAME), toml.dumps(br_conf))
+        for_each_as(self.args.jobs, self._gen_as_br, self.args.topo_dicts)
+
+    def _gen_as_br(self, topo_id):
+        topo = self.args.topo_dicts[topo_id]
+        for k, v in topo.border_routers.items():
+            base = topo_id.base_dir(self.args.output_dir)
+            fields = self._br_fields(base, k, v)
+            write_file(os.path.join(base, k, BR_CONFIG_NAME),
+                       self.templates.render("br", self._build_br_conf, fields))
 
-    def _build_br_conf(self, topo_id, ia, base, name, v):
-        config_dir = '/share/conf' if self.args.docker else os.path.join(base, name)
+    def _br_fields(self, base, name, v):
+        return {
+            'name': name,
+            'config_dir': '/share/conf' if self.args.docker else os.path.join(base, name),
+            'prometheus': join_host_port(v.internal.ip, DEFAULT_BR_PROM_PORT),
+        }
+
+    def _build_br_conf(self, fields):
+        name = fields['name']
         raw_entry = {
             'general': {
                 'id': name,
-                'config_dir': config_dir,
+                'config_dir': fields['config_dir'],
             },
             'log': self._log_entry(name),
             'metrics': {
-                'prometheus': prom_addr(v['internal_addr'], DEFAULT_BR_PROM_PORT),
+                'prometheus': fields['prometheus'],
             },
         }
         return raw_entry
 
     def generate_control_service(self):
-        for topo_id, topo in self.args.topo_dicts.items():
-            for elem_id, elem in topo.get("control_service", {}).items():
-                # only a single Go-BS per AS is currently supported
-                if elem_id.endswith("-1"):
-                    base = topo_id.base_dir(self.args.output_dir)
-                    bs_conf = self._build_control_service_conf(
-                        topo_id, topo["isd_as"], base, elem_id, elem)
-                    write_file(os.path.join(base, elem_id,
-                                            CS_CONFIG_NAME), toml.dumps(bs_conf))
-
-    def _build_control_service_conf(self, topo_id, ia, base, name, infra_elem):
-        config_dir = '/share/conf' if self.args.docker else os.path.join(
-            base, name)
+        for_each_as(self.args.jobs, self._gen_as_control_service, self.args.topo_dicts)
+
+    def _gen_as_control_service(self, topo_id):
+        topo = self.args.topo_dicts[topo_id]
+        for elem_id, elem in topo.control_service.items():
+            # only a single Go-BS per AS is currently supported
+            if elem_id.endswith("-1"):
+                base = topo_id.base_dir(self.args.output_dir)
+                fields = self._infra_fields(base, elem_id, elem, CS_PROM_PORT, CS_QUIC_PORT)
+                write_file(os.path.join(base, elem_id, CS_CONFIG_NAME), self.templates.render(
+                    "cs", self._build_control_service_conf, fields))
+
+    def _infra_fields(self, base, name, infra_elem, prom_port, quic_port):
+        return {
+            'name': name,
+            'config_dir': '/share/conf' if self.args.docker else os.path.join(base, name),
+            'prometheus': join_host_port(infra_elem.addr.ip, prom_port),
+            'quic_address': self._quic_address(quic_port, infra_elem),
+        }
+
+    def _build_control_service_conf(self, fields):
+        name = fields['name']
         raw_entry = {
             'general': {
                 'id': name,
-                'config_dir': config_dir,
+                'config_dir': fields['config_dir'],
                 'reconnect_to_dispatcher': True,
             },
             'log': self._log_entry(name),
@@ -128,34 +169,51 @@ class GoGenerator(object):
                 'connection': os.path.join(self.db_dir, '%s.path.db' % name),
             },
             'tracing': self._tracing_entry(),
-            'metrics': self._metrics_entry(infra_elem, CS_PROM_PORT),
-            'quic': self._quic_conf_entry(CS_QUIC_PORT, self.args.svcfrac, infra_elem),
+            'metrics': self._metrics_entry(fields['prometheus']),
+            'quic': self._quic_conf_entry(fields['quic_address'], self.args.svcfrac),
         }
         return raw_entry
 
     def generate_co(self):
         if not self.args.colibri:
             return
-        for topo_id, topo in self.args.topo_dicts.items():
-            for elem_id, elem in topo.get("colibri_service", {}).items():
-                # only a single Go-CO per AS is currently supported
-                if elem_id.endswith("-1"):
-                    base = topo_id.base_dir(self.args.output_dir)
-                    co_conf = self._build_co_conf(topo_id, topo["isd_as"], base, elem_id, elem)
-                    write_file(os.path.join(base, elem_id, CO_CONFIG_NAME), toml.dumps(co_conf))
-                    traffic_matrix = self._build_co_traffic_matrix(topo_id)
-                    write_file(os.path.join(base, elem_id, 'matrix.yml'),
-                               yaml.dump(traffic_matrix, default_flow_style=False))
-                    rsvps = self._build_co_reservations(topo_id)
-                    write_file(os.path.join(base, elem_id, 'reservations.yml'),
-                               yaml.dump(rsvps, default_flow_style=False))
-
-    def _build_co_conf(self, topo_id, ia, base, name, infra_elem):
-        config_dir = '/share/conf' if self.args.docker else os.path.join(base, name)
+        for topo_id in self.args.topo_dicts:
+            self._gen_as_co(topo_id)
+
+    def _gen_as_co(self, topo_id):
+        topo = self.args.topo_dicts[topo_id]
+        for elem_id, elem in topo.colibri_service.items():
+            # only a single Go-CO per AS is currently supported
+            if elem_id.endswith("-1"):
+                base = topo_id.base_dir(self.args.output_dir)
+                fields = self._infra_fields(base, elem_id, elem, CO_PROM_PORT, CO_QUIC_PORT)
+                write_file(os.path.join(base, elem_id, CO_CONFIG_NAME),
+                           self.templates.render("co", self._build_co_conf, fields))
+                traffic_matrix = self._build_co_traffic_matrix(topo_id)
+                write_file(os.path.join(base, elem_id, 'matrix.yml'),
+                           dump_yaml(traffic_matrix, default_flow_style=False))
+                ases, core = self._co_ases()
+                rsvps = self._build_co_reservations(topo_id, ases, core)
+                write_file(os.path.join(base, elem_id, 'reservations.yml'),
+                           dump_yaml(rsvps, default_flow_style=False))
+
+    def _co_ases(self):
+        """
+        All ASes of the topology, and the mask of the core ASes. They are
+        collected on first use, while the topo dicts still hold all ASes.
+        """
+        if self._co_ases_mask is None:
+            ases = ISDASArray(self.args.topo_dicts)
+            core = ases.member_mask(t for t, topo in self.args.topo_dicts.items() if topo.core)
+            self._co_ases_mask = ases, core
+        return self._co_ases_mask
+
+    def _build_co_conf(self, fields):
+        name = fields['name']
         raw_entry = {
             'general': {
                 'ID': name,
-                'ConfigDir': config_dir,
+                'ConfigDir': fields['config_dir'],
                 'ReconnectToDispatcher': True,
             },
             'log': self._log_entry(name),
@@ -164,8 +222,8 @@ class GoGenerator(object):
                 'connection': os.path.join(self.db_dir, '%s.trust.db' % name),
             },
             'tracing': self._tracing_entry(),
-            'metrics': self._metrics_entry(infra_elem, CO_PROM_PORT),
-            'quic': self._quic_conf_entry(CO_QUIC_PORT, self.args.svcfrac, infra_elem),
+            'metrics': self._metrics_entry(fields['prometheus']),
+            'quic': self._quic_conf_entry(fields['quic_address'], self.args.svcfrac),
         }
         return raw_entry
 
@@ -174,7 +232,7 @@ class GoGenerator(object):
         Creates a NxN traffic matrix for colibri with N = len(interfaces)
         """
         topo = self.args.topo_dicts[ia]
-        if_ids = {iface for br in topo['border_routers'].values() for iface in br['interfaces']}
+        if_ids = {intf.ifid for br in topo.border_routers.values() for intf in br.interfaces}
         if_ids.add(0)
         bw = int(DEFAULT_LINK_BW / (len(if_ids) - 1))
         traffic_matrix = {}
@@ -184,23 +242,25 @@ class GoGenerator(object):
                 traffic_matrix[inIfid][egIfid] = bw
         return traffic_matrix
 
-    def _build_co_reservations(self, ia):
+    def _build_co_reservations(self, ia, ases, core):
         """
         Generates a dictionary of reservations with one entry per core AS (if "ia" is core)
         excluding itself, or a pair (up and down) per core AS in the ISD if "ia" is not core.
+
+        :param ISDASArray ases: all ASes of the topology.
+        :param core: the mask of the core ASes in ases.
         """
         rsvps = {}
         this_as = self.args.topo_dicts[ia]
-        if this_as['Core']:
-            for dst_ia, topo in self.args.topo_dicts.items():
-                if dst_ia != ia and topo['Core']:
-                    rsvps['Core-%s' % dst_ia] = self._build_co_reservation(dst_ia, 'Core')
+        if this_as.core:
+            for dst_ia in ases.select(ases.mask_and(core, ases.ne_mask(ia))):
+                rsvps['Core-%s' % dst_ia] = self._build_co_reservation(dst_ia, 'Core')
         else:
-            for dst_ia, topo in self.args.topo_dicts.items():
-                if dst_ia != ia and dst_ia._isd == ia._isd and topo['Core']:
-                    # reach this core AS in the same ISD
-                    rsvps['Up-%s' % dst_ia] = self._build_co_reservation(dst_ia, 'Up')
-                    rsvps['Down-%s' % dst_ia] = self._build_co_reservation(dst_ia, 'Down')
+            mask = ases.mask_and(core, ases.ne_mask(ia), ases.isd_mask(ia._isd))
+            for dst_ia in ases.select(mask):
+                # reach this core AS in the same ISD
+                rsvps['Up-%s' % dst_ia] = self._build_co_reservation(dst_ia, 'Up')
+                rsvps['Down-%s' % dst_ia] = self._build_co_reservation(dst_ia, 'Down')
         return rsvps
 
     def _build_co_reservation(self, dst_ia, path_type):
@@ -219,25 +279,35 @@ class GoGenerator(object):
             'path_type': path_type,
             'split_cls': 8,
             'end_props': {
-                'start': list(start_props),
-                'end': list(end_props)
+                'start': sorted(start_props),
+                'end': sorted(end_props)
             }
         }
 
     def generate_sciond(self):
-        for topo_id, topo in self.args.topo_dicts.items():
-            base = topo_id.base_dir(self.args.output_dir)
-            sciond_conf = self._build_sciond_conf(topo_id, topo["isd_as"], base)
-            write_file(os.path.join(base, COMMON_DIR, SD_CONFIG_NAME), toml.dumps(sciond_conf))
+        for_each_as(self.args.jobs, self._gen_as_sciond, self.args.topo_dicts)
+
+    def _gen_as_sciond(self, topo_id):
+        base = topo_id.base_dir(self.args.output_dir)
+        fields = self._sciond_fields(topo_id, base)
+        write_file(os.path.join(base, COMMON_DIR, SD_CONFIG_NAME),
+                   self.templates.render("sd", self._build_sciond_conf, fields))
 
-    def _build_sciond_conf(self, topo_id, ia, base):
-        name = sciond_name(topo_id)
-        config_dir = '/share/conf' if self.args.docker else os.path.join(base, COMMON_DIR)
-        ip = sciond_ip(self.args.docker, topo_id, self.args.networks)
+    def _sciond_fields(self, topo_id, base):
+        ip = sciond_ip(self.args.docker, topo_id, self.args.net_index)
+        return {
+            'name': sciond_name(topo_id),
+            'config_dir': '/share/conf' if self.args.docker else os.path.join(base, COMMON_DIR),
+            'address': socket_address_str(ip, SD_API_PORT),
+            'prometheus': socket_address_str(ip, SCIOND_PROM_PORT),
+        }
+
+    def _build_sciond_conf(self, fields):
+        name = fields['name']
         raw_entry = {
             'general': {
                 'id': name,
-                'config_dir': config_dir,
+                'config_dir': fields['config_dir'],
                 'reconnect_to_dispatcher': True,
             },
             'log': self._log_entry(name),
@@ -249,54 +319,64 @@ class GoGenerator(object):
                 'connection': os.path.join(self.db_dir, '%s.path.db' % name),
             },
             'sd': {
-                'address': socket_address_str(ip, SD_API_PORT),
+                'address': fields['address'],
             },
             'tracing': self._tracing_entry(),
             'metrics': {
-                'prometheus': socket_address_str(ip, SCIOND_PROM_PORT)
+                'prometheus': fields['prometheus']
             }
         }
         return raw_entry
 
     def generate_disp(self):
         if self.args.docker:
-            self._gen_disp_docker()
+            for topo_id in self.args.topo_dicts:
+                self._gen_as_disp_docker(topo_id)
         else:
-            elem_dir = os.path.join(self.args.output_dir, "dispatcher")
-            config_file_path = os.path.join(elem_dir, DISP_CONFIG_NAME)
-            write_file(config_file_path, toml.dumps(self._build_disp_conf("dispatcher")))
-
-    def _gen_disp_docker(self):
-        for topo_id, topo in self.args.topo_dicts.items():
-            elem = "disp_sig_%s" % topo_id.file_fmt()
-            elem_dir = os.path.join(topo_id.base_dir(self.args.output_dir), elem)
-            disp_conf = self._build_disp_conf(elem, topo_id)
-            write_file(os.path.join(elem_dir, DISP_CONFIG_NAME), toml.dumps(disp_conf))
-            for k in list(topo.get("border_routers", {})) + list(topo.get("control_service", {})):
-                disp_id = 'disp_%s' % k
-                elem_dir = os.path.join(topo_id.base_dir(self.args.output_dir), disp_id)
-                disp_conf = self._build_disp_conf(disp_id, topo_id)
-                write_file(os.path.join(elem_dir, DISP_CONFIG_NAME), toml.dumps(disp_conf))
-
-    def _build_disp_conf(self, name, topo_id=None):
-        prometheus_addr = prom_addr_dispatcher(self.args.docker, topo_id,
-                                               self.args.networks, DISP_PROM_PORT, name)
+            self._gen_disp_host()
+
+    def _gen_disp_host(self):
+        elem_dir = os.path.join(self.args.output_dir, "dispatcher")
+        config_file_path = os.path.join(elem_dir, DISP_CONFIG_NAME)
+        write_file(config_file_path, self._render_disp_conf("dispatcher"))
+
+    def _gen_as_disp_docker(self, topo_id):
+        topo = self.args.topo_dicts[topo_id]
+        elem = "disp_sig_%s" % topo_id.file_fmt()
+        elem_dir = os.path.join(topo_id.base_dir(self.args.output_dir), elem)
+        write_file(os.path.join(elem_dir, DISP_CONFIG_NAME),
+                   self._render_disp_conf(elem, topo_id))
+        for k in list(topo.border_routers) + list(topo.control_service):
+            disp_id = 'disp_%s' % k
+            elem_dir = os.path.join(topo_id.base_dir(self.args.output_dir), disp_id)
+            write_file(os.path.join(elem_dir, DISP_CONFIG_NAME),
+                       self._render_disp_conf(disp_id, topo_id))
+
+    def _render_disp_conf(self, name, topo_id=None):
+        fields = {
+            'name': name,
+            'prometheus': prom_addr_dispatcher(self.args.docker, topo_id,
+                                               self.args.net_index, DISP_PROM_PORT, name),
+        }
+        return self.templates.render("disp", self._build_disp_conf, fields)
+
+    def _build_disp_conf(self, fields):
+        name = fields['name']
         return {
             'dispatcher': {
                 'id': name,
             },
             'log': self._log_entry(name),
             'metrics': {
-                'prometheus': prometheus_addr,
+                'prometheus': fields['prometheus'],
             },
         }
 
     def _tracing_entry(self):
-        docker_ip = docker_host(self.args.in_docker, self.args.docker)
         entry = {
             'enabled': True,
             'debug': True,
-            'agent': '%s:6831' % docker_ip
+            'agent': '%s:6831' % self.args.host.docker_ip
         }
         return entry
 
@@ -311,19 +391,20 @@ class GoGenerator(object):
             entry['console'] = {'level': self.log_level}
         return entry
 
-    def _metrics_entry(self, infra_elem, base_port):
-        a = prom_addr(infra_elem['addr'], base_port)
+    def _metrics_entry(self, prom_addr):
         return {
-            'prometheus': a,
+            'prometheus': prom_addr,
         }
 
-    def _quic_conf_entry(self, port, svcfrac, elem=None):
-        addr = '127.0.0.1' if elem is None else split_host_port(elem['addr'])[0]
+    def _quic_address(self, port, elem=None):
+        addr = '127.0.0.1' if elem is None else elem.addr.ip
         if self.args.docker and elem is not None:
-            _, port = split_host_port(elem['addr'])
-            port += 1
+            port = elem.port + 1
+        return join_host_port(addr, port)
+
+    def _quic_conf_entry(self, address, svcfrac):
         return {
-            'address':  join_host_port(addr, port),
+            'address': address,
             'cert_file': os.path.join(self.certs_dir, 'tls.pem'),
             'key_file': os.path.join(self.certs_dir, 'tls.key'),
             'resolution_fraction': svcfrac,
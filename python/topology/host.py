@@ -0,0 +1,92 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`host` --- SCION topology generator host facts
+===================================================
+"""
+# Stdlib
+import logging
+import os
+import sys
+
+# SCION
+from topology.common import docker_ip
+from topology.net import ephemeral_port_range, parse_port_ranges
+
+
+class HostFacts(object):
+    """
+    Facts about the host that the generated files depend on. They are resolved
+    once per generator run and passed to all generators as args.host.
+    """
+
+    def __init__(self, docker_ip, uid, gid, output_base, user_spec, in_docker,
+                 ephemeral_ports):
+        """
+        :param str docker_ip: the IP of the docker0 bridge.
+        :param int uid: the user that runs the jaeger container.
+        :param int gid: the group that runs the jaeger container.
+        :param str output_base: the directory that relative volumes are mounted from.
+        :param str user_spec: the user the docker services run as.
+        :param bool in_docker: whether the generator runs in a docker container.
+        :param tuple ephemeral_ports: the (first, last) ephemeral port range, or None.
+        """
+        self.docker_ip = docker_ip
+        self.uid = uid
+        self.gid = gid
+        self.output_base = output_base
+        self.user_spec = user_spec
+        self.in_docker = in_docker
+        self.ephemeral_ports = ephemeral_ports
+
+
+def resolve_host_facts(args):
+    """
+    Resolve the host facts, preferring the values given on the command line.
+
+    :param args: the command line arguments.
+    :rtype: HostFacts
+    """
+    return HostFacts(
+        docker_ip=args.docker0_ip or _docker0_ip(args.in_docker),
+        uid=os.getuid() if args.uid is None else args.uid,
+        gid=os.getgid() if args.gid is None else args.gid,
+        output_base=args.output_base or os.environ.get('SCION_OUTPUT_BASE', os.getcwd()),
+        user_spec=args.user_spec or os.environ.get('SCION_USERSPEC', '$LOGNAME'),
+        in_docker=args.in_docker,
+        ephemeral_ports=_ephemeral_ports(args.ephemeral_ports),
+    )
+
+
+def _docker0_ip(in_docker):
+    if in_docker:
+        # If in-docker we need to know the DOCKER0 IP
+        addr = os.getenv('DOCKER0', None)
+        if not addr:
+            print('DOCKER0 env variable required! Exiting!')
+            sys.exit(1)
+        return addr
+    return docker_ip()
+
+
+def _ephemeral_ports(raw):
+    if raw is None:
+        return ephemeral_port_range()
+    if raw == "none":
+        return None
+    ranges = parse_port_ranges(raw)
+    if len(ranges) != 1:
+        logging.critical("Invalid ephemeral port range '%s'", raw)
+        sys.exit(1)
+    return ranges[0]
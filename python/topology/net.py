@@ -18,24 +18,36 @@
 """
 # Stdlib
 import logging
-import math
 import sys
 from collections import defaultdict
-from ipaddress import ip_interface, ip_network
-
-# External packages
-import yaml
+from ipaddress import IPv4Address, IPv6Address, ip_network
 
 # SCION
 from lib.defines import DEFAULT6_NETWORK_ADDR
+from lib.scion_addr import ISD_AS
+from lib.util import add_yaml_representer
 
 DEFAULT_NETWORK = "127.0.0.0/8"
 DEFAULT_PRIV_NETWORK = "192.168.0.0/16"
 DEFAULT_SCN_DC_NETWORK = "172.20.0.0/20"
 DEFAULT_SCN_IN_D_NETWORK = "172.20.16.0/20"
+DEFAULT_PORT_RANGES = [(31000, 34999)]
+EPHEMERAL_PORT_RANGE_FILE = "/proc/sys/net/ipv4/ip_local_port_range"
 
 
 class SubnetGenerator(object):
+    """
+    Allocates a subnet for every registered location (AS or link) out of a
+    network, using a buddy allocator over integer addresses.
+
+    Locations are placed in the order of their keys, which is the historical
+    allocation order, each in the smallest free block that fits. As nothing is
+    freed, the free blocks always have distinct sizes, like the bits of the
+    free space. Placing in any order, e.g. largest first, therefore fits
+    exactly when the subnets add up to at most the free space, and the key
+    order is kept.
+    """
+
     def __init__(self, network, docker, in_docker):
         self.docker = docker
         if self.docker and network == DEFAULT_NETWORK:
@@ -52,7 +64,10 @@ class SubnetGenerator(object):
             logging.critical("Invalid network '%s'", network)
             sys.exit(1)
         self._subnets = defaultdict(lambda: AddressGenerator(self.docker))
-        self._allocations = defaultdict(list)
+        # The location each allocated network was registered for.
+        self.locations = {}
+        # The free blocks the allocator starts with, as (address, prefixlen).
+        self._initial = []
         # Initialise the allocations with the supplied network, making sure to
         # exclude 127.0.0.0/30 (for v4) and DEFAULT6_NETWORK_ADDR/126 (for v6)
         # if it's contained in the network.
@@ -65,109 +80,326 @@ class SubnetGenerator(object):
             exclude = ip_network(DEFAULT6_NETWORK_ADDR + "/126")
 
         if self._net.overlaps(exclude):
-            self._exclude_net(self._net, exclude)
+            for net in self._net.address_exclude(exclude):
+                self._initial.append((int(net.network_address), net.prefixlen))
             return
 
-        self._allocations[self._net.prefixlen].append(self._net)
+        self._initial.append((int(self._net.network_address), self._net.prefixlen))
 
     def register(self, location):
         return self._subnets[location]
 
     def alloc_subnets(self):
-        max_prefix = self._net.max_prefixlen
+        # The historical order, sorting by the string of the (location, subnet)
+        # tuples, is determined by the repr of the (unique) locations alone.
+        locations = sorted(self._subnets.items(), key=lambda x: repr(x[0]))
+        reqs = [(self._req_prefix(len(subnet)), subnet) for _, subnet in locations]
+        location_of = {id(subnet): location for location, subnet in locations}
+        placed = self._place(reqs)
+        if placed is None:
+            logging.critical("Unable to allocate %d subnets in %s" % (len(reqs), self._net))
+            sys.exit(1)
+        net_cls = type(self._net)
         networks = {}
-        for topo, subnet in sorted(self._subnets.items(), key=lambda x: str(x)):
-            if not self.docker:
-                # Figure out what size subnet we need. If it's a link, then we just
-                # need a /31 (or /127), otherwise add 2 to the subnet size to cover
-                # the network and broadcast addresses.
-                if len(subnet) == 2:
-                    req_prefix = max_prefix - 1
-                else:
-                    req_prefix = max_prefix - math.ceil(math.log2(len(subnet) + 2))
-            else:
-                # Docker needs space for a network and broadcast address as well as an IP linking
-                # to the host
-                req_prefix = max_prefix - math.ceil(math.log2(len(subnet) + 3))
+        for addr, prefix, subnet in placed:
+            new_net = _workaround_ip_network_hosts_py35(net_cls((addr, prefix)))
+            networks[new_net] = subnet.alloc_addrs(new_net)
+            self.locations[new_net] = location_of[id(subnet)]
+        return networks
+
+    def _req_prefix(self, size):
+        max_prefix = self._net.max_prefixlen
+        if not self.docker:
+            # Figure out what size subnet we need. If it's a link, then we just
+            # need a /31 (or /127), otherwise add 2 to the subnet size to cover
+            # the network and broadcast addresses.
+            if size == 2:
+                return max_prefix - 1
+            return max_prefix - _ceil_log2(size + 2)
+        # Docker needs space for a network and broadcast address as well as an IP linking
+        # to the host
+        return max_prefix - _ceil_log2(size + 3)
+
+    def _place(self, reqs):
+        """
+        Place the requested subnets, in order, with a buddy allocator.
 
+        :param list reqs: (prefixlen, AddressGenerator) tuples.
+        :returns: (address, prefixlen, AddressGenerator) tuples, or None if the
+            subnets do not fit.
+        """
+        max_prefix = self._net.max_prefixlen
+        free = [[] for _ in range(max_prefix + 1)]
+        for addr, prefix in self._initial:
+            free[prefix].append(addr)
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        placed = []
+        for req_prefix, subnet in reqs:
             # Search all subnets from that size upwards
             for prefix in range(req_prefix, -1, -1):
-                if not self._allocations[prefix]:
-                    # No subnets available at this size
-                    continue
-                alloc = self._allocations[prefix].pop()
-                # Carve out subnet of the required size
-                new_net = next(alloc.subnets(new_prefix=req_prefix))
-                new_net = _workaround_ip_network_hosts_py35(new_net)
-                logging.debug("Allocating %s from %s for subnet size %d" %
-                              (new_net, alloc, len(subnet)))
-                networks[new_net] = subnet.alloc_addrs(new_net)
-                # Repopulate the allocations list with the left-over space
-                self._exclude_net(alloc, new_net)
-                break
+                if free[prefix]:
+                    break
             else:
-                logging.critical("Unable to allocate /%d subnet" % req_prefix)
-                sys.exit(1)
-        return networks
+                return None
+            addr = free[prefix].pop()
+            if debug:
+                logging.debug("Allocating %s/%d from %s/%d for subnet size %d",
+                              self._fmt(addr), req_prefix, self._fmt(addr), prefix, len(subnet))
+            # Carve out the first subnet of the required size, and put the upper
+            # buddies of the halves containing it back, largest first.
+            for p in range(prefix + 1, req_prefix + 1):
+                free[p].append(addr | (1 << (max_prefix - p)))
+            placed.append((addr, req_prefix, subnet))
+        return placed
 
-    def _exclude_net(self, alloc, net):
-        for net in alloc.address_exclude(net):
-            self._allocations[net.prefixlen].append(net)
+    def _fmt(self, addr):
+        return type(self._net.network_address)(addr)
+
+
+def _ceil_log2(n):
+    return (n - 1).bit_length()
+
+
+class NetworkIndex(object):
+    """
+    Index of the allocated networks by element id and by AS, built once after
+    the subnets are allocated, so that looking up an element does not scan all
+    networks.
+    """
+
+    def __init__(self, networks, locations):
+        """
+        :param dict networks: network -> {element id: AddressProxy}, as
+            returned by SubnetGenerator.alloc_subnets.
+        :param dict locations: network -> the location (AS or link) it was
+            allocated for, see SubnetGenerator.locations.
+        """
+        self._elems = {}
+        self._as_elems = defaultdict(list)
+        for net, elems in networks.items():
+            location = locations.get(net)
+            for elem_id, addr in elems.items():
+                # Border routers are in several link networks, the first one
+                # wins, like with a scan over all networks.
+                if elem_id in self._elems:
+                    continue
+                self._elems[elem_id] = (net, addr)
+                if isinstance(location, ISD_AS):
+                    self._as_elems[location].append(elem_id)
+
+    def lookup(self, elem_id):
+        """
+        :param str elem_id: the element id, e.g. sd1-ff00_0_110.
+        :returns: (subnet, ip, version), or None if the element has no address.
+        """
+        entry = self._elems.get(elem_id)
+        if entry is None:
+            return None
+        net, addr = entry
+        return net, addr.ip, addr.version
+
+    def ip(self, elem_id):
+        entry = self._elems.get(elem_id)
+        if entry is None:
+            return None
+        return entry[1].ip
+
+    def ases(self):
+        """
+        :returns: the ASes, in the order of their networks.
+        """
+        return list(self._as_elems)
+
+    def as_elems(self, topo_id):
+        """
+        :returns: the ids of the elements in the network(s) of the AS.
+        """
+        return self._as_elems.get(topo_id, [])
 
 
 class AddressGenerator(object):
     def __init__(self, docker):
-        self._addrs = defaultdict(lambda: AddressProxy())
+        self._addrs = defaultdict(AddressProxy)
         self.docker = docker
 
     def register(self, id_):
         return self._addrs[id_]
 
     def alloc_addrs(self, subnet):
-        hosts = subnet.hosts()
-        interfaces = {}
+        """
+        Assign consecutive host addresses of subnet to the registered elements,
+        in the order of their ids.
+
+        :param subnet: the ip_network allocated for this generator.
+        :returns: element id -> AddressProxy.
+        :rtype: dict
+        """
+        # The hosts of a subnet are contiguous, only the first one depends on
+        # the size and version of the subnet.
+        first = int(next(subnet.hosts()))
         # With the docker backend, docker itself claims the first ip of every network
         if self.docker:
-            next(hosts)
-        for elem, proxy in sorted(self._addrs.items()):
-            intf = ip_interface("%s/%s" % (next(hosts), subnet.prefixlen))
-            interfaces[elem] = intf
-            proxy.set_intf(intf)
+            first += 1
+        version = subnet.version
+        prefixlen = subnet.prefixlen
+        interfaces = {}
+        for i, (elem, proxy) in enumerate(sorted(self._addrs.items())):
+            proxy.set_addr(first + i, prefixlen, version)
+            interfaces[elem] = proxy
         return interfaces
 
     def __len__(self):
         return len(self._addrs)
 
 
-class AddressProxy(yaml.YAMLObject):
-    yaml_tag = ""
+class AddressProxy(object):
+    """
+    An address registered for an element. Until it is allocated, ip is None.
+
+    The address is stored as an integer, ipaddress objects and strings are
+    only created when it is accessed or serialized.
+    """
+    __slots__ = ("_addr", "_prefixlen", "_version")
 
     def __init__(self):
-        self._intf = None
-        self.ip = None
+        self._addr = None
+        self._prefixlen = None
+        self._version = None
+
+    def set_addr(self, addr, prefixlen, version):
+        """
+        :param int addr: the address as integer.
+        :param int prefixlen: the prefix length of the subnet.
+        :param int version: the IP version.
+        """
+        self._addr = addr
+        self._prefixlen = prefixlen
+        self._version = version
 
-    def set_intf(self, intf):
-        self._intf = intf
-        self.ip = self._intf.ip
+    @property
+    def ip(self):
+        if self._addr is None:
+            return None
+        if self._version == 4:
+            return IPv4Address(self._addr)
+        return IPv6Address(self._addr)
+
+    @property
+    def version(self):
+        return self._version
 
     def __str__(self):
-        return str(self._intf)
+        return "%s/%d" % (self.ip, self._prefixlen)
+
+
+def _represent_address_proxy(dumper, inst):
+    return dumper.represent_scalar('tag:yaml.org,2002:str', str(inst.ip))
+
 
-    @classmethod
-    def to_yaml(cls, dumper, inst):
-        return dumper.represent_scalar('tag:yaml.org,2002:str', str(inst.ip))
+add_yaml_representer(AddressProxy, _represent_address_proxy)
 
 
 class PortGenerator(object):
-    def __init__(self):
-        self.iter = iter(range(31000, 35000))
-        self._ports = defaultdict(lambda: next(self.iter))
+    """
+    Allocates ports for elements out of a list of port ranges. Every element
+    gets a pair of ports, the second one is reserved for QUIC.
 
-    def register(self, id_):
-        p = self._ports[id_]
+    With per_ip, ports are allocated independently for every IP, so elements
+    on distinct (loopback) IPs can use the same ports.
+    """
+
+    def __init__(self, ranges=DEFAULT_PORT_RANGES, per_ip=False, ephemeral=None,
+                 skip_ephemeral=False):
+        """
+        :param list ranges: (first, last) port ranges, both inclusive.
+        :param bool per_ip: whether ports can be reused on distinct IPs.
+        :param tuple ephemeral: the (first, last) ephemeral port range of the
+            host, or None.
+        :param bool skip_ephemeral: whether to skip the ephemeral ports. By
+            default they are allocated, with a warning.
+        """
+        self._ranges = ranges
+        self._per_ip = per_ip
+        self._candidates = []
+        for first, last in ranges:
+            for p in range(first, last + 1):
+                if skip_ephemeral and ephemeral and ephemeral[0] <= p <= ephemeral[1]:
+                    continue
+                self._candidates.append(p)
+        # Cleared once the warning is logged.
+        self._ephemeral = None if skip_ephemeral else ephemeral
+        self._ports = {}
+        # Index of the next free candidate per IP (or None, without per_ip).
+        self._next = defaultdict(int)
+
+    def register(self, id_, ip=None):
+        """
+        :param str id_: the element id.
+        :param ip: the IP of the element, used with per_ip.
+        :returns: the port of the element.
+        :rtype: int
+        """
+        port = self._ports.get(id_)
+        if port is not None:
+            return port
+        scope = str(ip) if self._per_ip else None
+        idx = self._next[scope]
         # reserve a quic port
-        self._ports[id_+"quic"]
-        return p
+        if idx + 2 > len(self._candidates):
+            logging.critical(
+                "Unable to allocate a port for %s: port ranges %s exhausted after %d elements%s. "
+                "Use --port-ranges to add ranges%s.",
+                id_, format_port_ranges(self._ranges), idx // 2,
+                " on %s" % ip if self._per_ip else "",
+                "" if self._per_ip else " or --port-reuse")
+            sys.exit(1)
+        self._next[scope] = idx + 2
+        port = self._ports[id_] = self._candidates[idx]
+        if self._ephemeral and (self._ephemeral[0] <= port <= self._ephemeral[1] or
+                                self._ephemeral[0] <= port + 1 <= self._ephemeral[1]):
+            logging.warning(
+                "Port %d of %s is in the ephemeral port range %d-%d of the host, the service "
+                "may fail to bind it. Use --skip-ephemeral-ports or --port-ranges to avoid it.",
+                port, id_, *self._ephemeral)
+            self._ephemeral = None
+        return port
+
+
+def parse_port_ranges(raw):
+    """
+    :param str raw: comma separated port ranges, e.g. "31000-35000,40000-45000".
+    :returns: (first, last) tuples.
+    :rtype: list
+    """
+    ranges = []
+    for part in raw.split(","):
+        try:
+            first, last = (int(p) for p in part.split("-"))
+        except ValueError:
+            logging.critical("Invalid port range '%s'", part)
+            sys.exit(1)
+        if not 0 < first <= last <= 65535:
+            logging.critical("Invalid port range '%s'", part)
+            sys.exit(1)
+        ranges.append((first, last))
+    return ranges
+
+
+def format_port_ranges(ranges):
+    return ",".join("%d-%d" % r for r in ranges)
+
+
+def ephemeral_port_range():
+    """
+    Returns the (first, last) ephemeral port range of the host, or None if it
+    is not known.
+    """
+    try:
+        with open(EPHEMERAL_PORT_RANGE_FILE) as f:
+            first, last = f.read().split()
+        return int(first), int(last)
+    except (OSError, ValueError):
+        return None
 
 
 def socket_address_str(ip, port):
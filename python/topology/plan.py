@@ -0,0 +1,134 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`plan` --- SCION topology plan
+===================================
+
+The plan is the in-memory representation of a topology that all generators
+consume. It records every element, link, address and port slot, and is built
+in a single walk over the .topo config, before any addresses are allocated.
+Addresses are AddressProxy objects that are filled in by the subnet
+allocation, ports are assigned by TopoPlan.assign_ports afterwards.
+
+The objects only hold integers and references to shared objects. The
+topology.json form of an AS is built by TopoGenerator when it is written.
+"""
+
+
+class Service(object):
+    __slots__ = ("elem_id", "addr", "port")
+
+    def __init__(self, elem_id, addr, port):
+        """
+        :param str elem_id: the element id, e.g. cs1-ff00_0_110-1.
+        :param AddressProxy addr: the address of the service.
+        :param int port: the default port of the service.
+        """
+        self.elem_id = elem_id
+        self.addr = addr
+        self.port = port
+
+
+class Interface(object):
+    __slots__ = ("ifid", "remote", "link_to", "attrs", "public", "remote_addr")
+
+    def __init__(self, ifid, remote, link_to, attrs, public, remote_addr):
+        """
+        :param int ifid: the interface id.
+        :param TopoID remote: the remote AS.
+        :param str link_to: the link type, seen from this interface.
+        :param dict attrs: the link attributes from the .topo config.
+        :param AddressProxy public: the local underlay address.
+        :param AddressProxy remote_addr: the remote underlay address.
+        """
+        self.ifid = ifid
+        self.remote = remote
+        self.link_to = link_to
+        self.attrs = attrs
+        self.public = public
+        self.remote_addr = remote_addr
+
+
+class BorderRouter(object):
+    __slots__ = ("name", "ctrl", "internal", "ctrl_port", "internal_port", "interfaces")
+
+    def __init__(self, name, ctrl, internal, ctrl_port, internal_port):
+        """
+        :param str name: the element id, e.g. br1-ff00_0_110-1.
+        :param AddressProxy ctrl: the control address.
+        :param AddressProxy internal: the internal address.
+        :param int ctrl_port: the default control port.
+        :param int internal_port: the default internal port.
+        """
+        self.name = name
+        self.ctrl = ctrl
+        self.internal = internal
+        self.ctrl_port = ctrl_port
+        self.internal_port = internal_port
+        self.interfaces = []
+
+
+class AS(object):
+    __slots__ = ("topo_id", "mtu", "attributes", "control_service", "colibri_service",
+                 "border_routers", "sigs", "sciond", "tester")
+
+    def __init__(self, topo_id, mtu, attributes):
+        """
+        :param TopoID topo_id: the AS.
+        :param int mtu: the MTU of the AS.
+        :param list attributes: the AS attributes, e.g. ["core"].
+        """
+        self.topo_id = topo_id
+        self.mtu = mtu
+        self.attributes = attributes
+        # The services are keyed by element id, the attribute names match the
+        # keys of SCION_SERVICE_NAMES.
+        self.control_service = {}
+        self.colibri_service = {}
+        self.border_routers = {}
+        self.sigs = {}
+        self.sciond = None
+        self.tester = None
+
+    @property
+    def core(self):
+        return "core" in self.attributes
+
+
+class TopoPlan(object):
+    __slots__ = ("ases", "_port_slots")
+
+    def __init__(self):
+        self.ases = {}
+        self._port_slots = []
+
+    def add_port_slot(self, obj, attr, id_, addr):
+        """
+        Register a port that is assigned by assign_ports, once addresses are
+        allocated. Slots are assigned in the order they are added.
+
+        :param obj: the plan object holding the port.
+        :param str attr: the attribute of obj to set.
+        :param str id_: the id to allocate the port for.
+        :param AddressProxy addr: the address the port is used on.
+        """
+        self._port_slots.append((obj, attr, id_, addr))
+
+    def assign_ports(self, port_gen):
+        """
+        :param PortGenerator port_gen: the allocator of the ports.
+        """
+        for obj, attr, id_, addr in self._port_slots:
+            setattr(obj, attr, port_gen.register(id_, addr.ip))
+        self._port_slots = []
@@ -0,0 +1,189 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`profiling` --- SCION topology generator stage profiling
+=============================================================
+"""
+# Stdlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+DEFAULT_PROFILE_DIR = "logs/topogen-profile"
+PROFILE_REPORT = "profile.json"
+# Per-stage peaks need tracemalloc.reset_peak, added in Python 3.9.
+_RESET_PEAK = hasattr(tracemalloc, "reset_peak")
+
+
+class StageProfiler(object):
+    """
+    Collects wall time, CPU time and tracemalloc peaks for the named stages of a
+    generator run, and optionally a cProfile dump per stage.
+
+    When disabled, stage() is a no-op, so generators can always be wrapped.
+    Stages may run concurrently in different threads; the stages of a thread
+    nest. CPU times and tracemalloc peaks are process wide, so those of
+    overlapping stages include each other: the peak is only reset while the
+    stages of a single thread run. Without tracemalloc.reset_peak (before
+    Python 3.9), the peaks of the stages are not reported at all. A cProfile
+    profiler only records
+    the thread that enables it, so the outermost stage of each thread gets its
+    own, which covers its nested stages. Threads and processes started by a
+    stage are not covered; ConfigGenerator therefore runs the stages one after
+    another, and in a single process, with cprofile.
+    """
+
+    def __init__(self, enabled=False, out_dir=DEFAULT_PROFILE_DIR, cprofile=False):
+        """
+        :param bool enabled: whether to collect anything at all.
+        :param str out_dir: where to write the report and the cProfile dumps.
+        :param bool cprofile: whether to dump a cProfile profile per stage.
+        """
+        self.enabled = enabled
+        self.out_dir = out_dir
+        self.cprofile = cprofile
+        self.stages = []
+        self.critical_path = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        # The start of the first and the end of the last top level stage.
+        self._span = None
+        # The number of threads with a running stage.
+        self._threads = 0
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._note_peak()
+        path = name
+        if self._stack:
+            path = "%s/%s" % (self._stack[-1]["stage"], name)
+        entry = {"stage": path, "peak_mem_bytes": 0 if _RESET_PEAK else None}
+        with self._lock:
+            if not self._stack:
+                self._threads += 1
+            self.stages.append(entry)
+        self._stack.append(entry)
+        prof = None
+        if self.cprofile and len(self._stack) == 1:
+            prof = cProfile.Profile()
+            prof.enable()
+        wall = time.perf_counter()
+        entry["start_s"] = round(wall - self._t0, 6)
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            entry["wall_s"] = round(end - wall, 6)
+            if len(self._stack) == 1:
+                with self._lock:
+                    if self._span is None:
+                        self._span = (wall, end)
+                    else:
+                        self._span = (min(self._span[0], wall), max(self._span[1], end))
+            entry["cpu_s"] = round(time.process_time() - cpu, 6)
+            if prof is not None:
+                prof.disable()
+                dump = os.path.join(self.out_dir, "%s.prof" % path.replace("/", "."))
+                os.makedirs(self.out_dir, exist_ok=True)
+                prof.dump_stats(dump)
+                entry["cprofile"] = dump
+            self._note_peak()
+            self._stack.pop()
+            if self._stack and _RESET_PEAK:
+                parent = self._stack[-1]
+                parent["peak_mem_bytes"] = max(parent["peak_mem_bytes"],
+                                               entry["peak_mem_bytes"])
+            if not self._stack:
+                with self._lock:
+                    self._threads -= 1
+
+    def _note_peak(self):
+        """
+        Attribute the tracemalloc peak since the last reset to the innermost
+        running stage, and start a new measurement interval if no other thread
+        runs a stage, whose peak would be lost otherwise.
+        """
+        if not _RESET_PEAK:
+            return
+        with self._lock:
+            _, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                top = self._stack[-1]
+                top["peak_mem_bytes"] = max(top["peak_mem_bytes"], peak)
+            if self._threads == (1 if self._stack else 0):
+                tracemalloc.reset_peak()
+
+    def timing(self):
+        """
+        :returns: the (start_s, wall_s) of the finished top level stages, by
+            name, as in the report.
+        :rtype: dict
+        """
+        return {s["stage"]: (s["start_s"], s["wall_s"]) for s in self.stages
+                if "/" not in s["stage"] and "wall_s" in s}
+
+    def report(self):
+        # Top level stages may overlap, so the total is their span.
+        span = self._span or (0, 0)
+        report = {
+            "stages": self.stages,
+            "total_wall_s": round(span[1] - span[0], 6),
+        }
+        if self.critical_path:
+            report["critical_path"] = self.critical_path
+        return report
+
+    def finish(self, out=sys.stderr):
+        """
+        Print the stage breakdown and write the machine-readable report.
+        """
+        if not self.enabled:
+            return
+        report = self.report()
+        total = report["total_wall_s"] or 1
+        out.write("%-32s %10s %10s %7s %12s\n" % (
+            "stage", "wall[s]", "cpu[s]", "wall%", "peak[KiB]"))
+        for s in self.stages:
+            peak = s["peak_mem_bytes"]
+            out.write("%-32s %10.4f %10.4f %6.1f%% %12s\n" % (
+                s["stage"], s["wall_s"], s["cpu_s"], 100 * s["wall_s"] / total,
+                "-" if peak is None else peak // 1024))
+        out.write("%-32s %10.4f\n" % ("total", report["total_wall_s"]))
+        if self.critical_path:
+            out.write("critical path: %s\n" % " -> ".join(
+                "%s (%.4fs)" % (s["stage"], s["wall_s"]) for s in self.critical_path))
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, PROFILE_REPORT)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        out.write("Profile report written to %s\n" % path)
+        tracemalloc.stop()
@@ -20,15 +20,13 @@
 import os
 from collections import defaultdict
 
-# External packages
-import yaml
-
 # SCION
 from lib.defines import DOCKER_COMPOSE_CONFIG_VERSION, PROM_FILE
-from lib.util import write_file
+from lib.util import dump_yaml, write_file
 from topology.common import (
     ArgsTopoDicts,
-    prom_addr,
+    for_each_as,
+    join_host_port,
     prom_addr_dispatcher,
     sciond_ip,
 )
@@ -44,9 +42,9 @@ PROM_DC_FILE = "prom-dc.yml"
 
 
 class PrometheusGenArgs(ArgsTopoDicts):
-    def __init__(self, args, topo_dicts, networks):
+    def __init__(self, args, topo_dicts, net_index):
         super().__init__(args, topo_dicts)
-        self.networks = networks
+        self.net_index = net_index
 
 
 class PrometheusGenerator(object):
@@ -69,48 +67,81 @@ class PrometheusGenerator(object):
         :param PrometheusGenArgs args: Contains the passed command line arguments and topo dicts.
         """
         self.args = args
-        self.output_base = os.environ.get('SCION_OUTPUT_BASE', os.getcwd())
+        self.output_base = args.host.output_base
+        self._targets_paths = defaultdict(list)
 
     def generate(self):
         config_dict = {}
         for topo_id, as_topo in self.args.topo_dicts.items():
-            ele_dict = defaultdict(list)
-            for br_id, br_ele in as_topo["border_routers"].items():
-                a = prom_addr(br_ele["internal_addr"], DEFAULT_BR_PROM_PORT)
-                ele_dict["BorderRouters"].append(a)
-            for elem_id, elem in as_topo["control_service"].items():
-                a = prom_addr(elem["addr"], CS_PROM_PORT)
-                ele_dict["ControlService"].append(a)
-            if self.args.docker:
-                host_dispatcher = prom_addr_dispatcher(self.args.docker, topo_id,
-                                                       self.args.networks, DISP_PROM_PORT, "")
-                br_dispatcher = prom_addr_dispatcher(self.args.docker, topo_id,
-                                                     self.args.networks, DISP_PROM_PORT, "br")
-                ele_dict["Dispatcher"] = [host_dispatcher, br_dispatcher]
-            sd_prom_addr = '[%s]:%d' % (sciond_ip(self.args.docker, topo_id, self.args.networks),
-                                        SCIOND_PROM_PORT)
-            ele_dict["Sciond"].append(sd_prom_addr)
-            config_dict[topo_id] = ele_dict
+            config_dict[topo_id] = self._as_targets(topo_id, as_topo)
         self._write_config_files(config_dict)
         self._write_dc_file()
         self._write_disp_file()
 
+    def generate_as(self, topo_id):
+        """
+        Generate the config of one AS, and add its target files to the root
+        config, for the streaming mode.
+        """
+        ele_dict = self._as_targets(topo_id, self.args.topo_dicts[topo_id])
+        self._write_as_config_files(topo_id, ele_dict)
+        self._add_targets_paths(self._targets_paths, topo_id, ele_dict)
+
+    def finish(self):
+        """
+        Write the root config, once all ASes are generated.
+        """
+        self._write_root_config_file(self._targets_paths)
+        self._write_dc_file()
+        self._write_disp_file()
+
+    def _as_targets(self, topo_id, as_topo):
+        ele_dict = defaultdict(list)
+        for br_id, br_ele in as_topo.border_routers.items():
+            a = join_host_port(br_ele.internal.ip, DEFAULT_BR_PROM_PORT)
+            ele_dict["BorderRouters"].append(a)
+        for elem_id, elem in as_topo.control_service.items():
+            a = join_host_port(elem.addr.ip, CS_PROM_PORT)
+            ele_dict["ControlService"].append(a)
+        if self.args.docker:
+            host_dispatcher = prom_addr_dispatcher(self.args.docker, topo_id,
+                                                   self.args.net_index, DISP_PROM_PORT, "")
+            br_dispatcher = prom_addr_dispatcher(self.args.docker, topo_id,
+                                                 self.args.net_index, DISP_PROM_PORT, "br")
+            ele_dict["Dispatcher"] = [host_dispatcher, br_dispatcher]
+        sd_prom_addr = '[%s]:%d' % (sciond_ip(self.args.docker, topo_id, self.args.net_index),
+                                    SCIOND_PROM_PORT)
+        ele_dict["Sciond"].append(sd_prom_addr)
+        return ele_dict
+
     def _write_config_files(self, config_dict):
         targets_paths = defaultdict(list)
         for topo_id, ele_dict in config_dict.items():
-            base = topo_id.base_dir(self.args.output_dir)
-            as_local_targets_path = {}
-            for ele_type, target_list in ele_dict.items():
-                local_path = os.path.join(self.PROM_DIR, self.TARGET_FILES[ele_type])
-                targets_path = os.path.join(topo_id.base_dir(''), local_path)
-                targets_paths[self.JOB_NAMES[ele_type]].append(targets_path)
-                as_local_targets_path[self.JOB_NAMES[ele_type]] = [local_path]
-                self._write_target_file(base, target_list, ele_type)
-            self._write_config_file(os.path.join(base, PROM_FILE), as_local_targets_path)
+            self._add_targets_paths(targets_paths, topo_id, ele_dict)
+        for_each_as(self.args.jobs, lambda topo_id: self._write_as_config_files(
+            topo_id, config_dict[topo_id]), config_dict)
+        self._write_root_config_file(targets_paths)
+
+    def _add_targets_paths(self, targets_paths, topo_id, ele_dict):
+        for ele_type in ele_dict:
+            local_path = os.path.join(self.PROM_DIR, self.TARGET_FILES[ele_type])
+            targets_path = os.path.join(topo_id.base_dir(''), local_path)
+            targets_paths[self.JOB_NAMES[ele_type]].append(targets_path)
+
+    def _write_root_config_file(self, targets_paths):
         if not self.args.docker:
             targets_paths["dispatcher"] = [os.path.join("dispatcher", "prometheus", "disp.yml")]
         self._write_config_file(os.path.join(self.args.output_dir, PROM_FILE), targets_paths)
 
+    def _write_as_config_files(self, topo_id, ele_dict):
+        base = topo_id.base_dir(self.args.output_dir)
+        as_local_targets_path = {}
+        for ele_type, target_list in ele_dict.items():
+            local_path = os.path.join(self.PROM_DIR, self.TARGET_FILES[ele_type])
+            as_local_targets_path[self.JOB_NAMES[ele_type]] = [local_path]
+            self._write_target_file(base, target_list, ele_type)
+        self._write_config_file(os.path.join(base, PROM_FILE), as_local_targets_path)
+
     def _write_config_file(self, config_path, job_dict):
         scrape_configs = []
         for job_name, file_paths in job_dict.items():
@@ -128,12 +159,12 @@ class PrometheusGenerator(object):
             },
             'scrape_configs': scrape_configs,
         }
-        write_file(config_path, yaml.dump(config, default_flow_style=False))
+        write_file(config_path, dump_yaml(config, default_flow_style=False))
 
     def _write_target_file(self, base_path, target_addrs, ele_type):
         targets_path = os.path.join(base_path, self.PROM_DIR, self.TARGET_FILES[ele_type])
         target_config = [{'targets': target_addrs}]
-        write_file(targets_path, yaml.dump(target_config, default_flow_style=False))
+        write_file(targets_path, dump_yaml(target_config, default_flow_style=False))
 
     def _write_disp_file(self):
         if self.args.docker:
@@ -142,7 +173,7 @@ class PrometheusGenerator(object):
                                     PrometheusGenerator.PROM_DIR, "disp.yml")
         target_config = [{'targets': [prom_addr_dispatcher(False, None, None,
                                                            DISP_PROM_PORT, None)]}]
-        write_file(targets_path, yaml.dump(target_config, default_flow_style=False))
+        write_file(targets_path, dump_yaml(target_config, default_flow_style=False))
 
     def _write_dc_file(self):
         name_prefix = 'prometheus'
@@ -162,4 +193,4 @@ class PrometheusGenerator(object):
             }
         }
         write_file(os.path.join(self.args.output_dir, PROM_DC_FILE),
-                   yaml.dump(prom_dc, default_flow_style=False))
+                   dump_yaml(prom_dc, default_flow_style=False))
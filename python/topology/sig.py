@@ -14,12 +14,12 @@
 # limitations under the License.
 
 # Stdlib
-import json
 import os
 # External packages
 import toml
 # SCION
-from lib.util import write_file
+from lib.scion_addr import ISDASArray
+from lib.util import dump_json, write_file
 from topology.common import (
     ArgsBase,
     DOCKER_USR_VOL,
@@ -54,20 +54,28 @@ class SIGGenerator(object):
         """
         self.args = args
         self.dc_conf = args.dc_conf
-        self.user_spec = os.environ.get('SCION_USERSPEC', '$LOGNAME')
-        self.output_base = os.environ.get('SCION_OUTPUT_BASE', os.getcwd())
+        self.user_spec = args.host.user_spec
+        self.output_base = args.host.output_base
         self.prefix = 'docker_' if self.args.in_docker else ''
+        # The SIG configs of all ASes list the networks of all other SIGs.
+        self.ases = ISDASArray(self.args.topo_dicts)
+        self.sig_nets = [self.args.networks['sig%s' % f][0]['net']
+                         for f in self.ases.file_fmts()]
 
     def generate(self):
-        for topo_id, topo in self.args.topo_dicts.items():
-            base = os.path.join(
-                self.output_base, topo_id.base_dir(self.args.output_dir))
-            self._dispatcher_conf(topo_id, base)
-            self._sig_dc_conf(topo_id, base)
-            self._sig_toml(topo_id, topo)
-            self._sig_json(topo_id)
+        for topo_id in self.args.topo_dicts:
+            self.generate_as(topo_id)
         return self.dc_conf
 
+    def generate_as(self, topo_id):
+        topo = self.args.topo_dicts[topo_id]
+        base = os.path.join(
+            self.output_base, topo_id.base_dir(self.args.output_dir))
+        self._dispatcher_conf(topo_id, base)
+        self._sig_dc_conf(topo_id, base)
+        self._sig_toml(topo_id, topo)
+        self._sig_json(topo_id, self.ases, self.sig_nets)
+
     def _dispatcher_conf(self, topo_id, base):
         # Create dispatcher config
         entry = {
@@ -115,21 +123,21 @@ class SIGGenerator(object):
                 self._logs_vol()
             ],
             'network_mode': 'service:scion_disp_sig_%s' % topo_id.file_fmt(),
-            'command': [remote_nets(self.args.networks, topo_id)]
+            'command': [remote_nets(self.args.net_index, topo_id)]
         }
 
-    def _sig_json(self, topo_id):
+    def _sig_json(self, topo_id, ases, sig_nets):
+        """
+        :param ISDASArray ases: all ASes of the topology.
+        :param list sig_nets: the SIG network of each AS in ases.
+        """
         sig_cfg = {"ConfigVersion": 1, "ASes": {}}
-        for t_id, topo in self.args.topo_dicts.items():
-            if topo_id == t_id:
-                continue
-            sig_cfg['ASes'][str(t_id)] = {"Nets": []}
-            net = self.args.networks['sig%s' % t_id.file_fmt()][0]
-            sig_cfg['ASes'][str(t_id)]['Nets'].append(net['net'])
+        for i in ases.nonzero(ases.ne_mask(topo_id)):
+            sig_cfg['ASes'][str(ases[i])] = {"Nets": [sig_nets[i]]}
 
         cfg = os.path.join(topo_id.base_dir(self.args.output_dir), 'sig%s' % topo_id.file_fmt(),
                            "cfg.json")
-        contents_json = json.dumps(sig_cfg, default=json_default, indent=2)
+        contents_json = dump_json(sig_cfg, default=json_default, indent=2)
         write_file(cfg, contents_json + '\n')
 
     def _sig_toml(self, topo_id, topo):
@@ -0,0 +1,158 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`stages` --- SCION topology generator stage scheduling
+===========================================================
+
+The generator stages form a dependency graph. StageGraph runs every stage as
+soon as its dependencies are done, in a thread per stage. Stages that render
+in Python are exclusive: they hold the GIL anyway, and for_each_as only
+supports one call at a time. Stages that mostly wait on subprocesses or the
+file system are not exclusive, and overlap with the renderers.
+"""
+# Stdlib
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage(object):
+    __slots__ = ("name", "func", "deps", "exclusive", "start", "end")
+
+    def __init__(self, name, func, deps, exclusive):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.exclusive = exclusive
+        self.start = None
+        self.end = None
+
+
+class StageGraph(object):
+    def __init__(self):
+        self._stages = OrderedDict()
+        self._t0 = None
+        self._concurrent = True
+
+    def add(self, name, func, deps=(), exclusive=True):
+        """
+        :param str name: the name of the stage.
+        :param func: the function that runs the stage.
+        :param deps: the names of the stages that must be done first. They
+            must have been added already.
+        :param bool exclusive: whether the stage must not overlap with other
+            exclusive stages.
+        """
+        for dep in deps:
+            assert dep in self._stages, "%s: unknown dependency %s" % (name, dep)
+        self._stages[name] = Stage(name, func, tuple(deps), exclusive)
+
+    def run(self, run_stage, concurrent=True):
+        """
+        Run all stages. Without concurrent, the stages run one after another,
+        in the order they were added. After a failure no further stages are
+        started, and the first error is raised once the running stages are done.
+
+        :param run_stage: function called with the name and function of a
+            stage, in the thread of the stage, to run it.
+        :param bool concurrent: whether independent stages may overlap.
+        """
+        self._t0 = time.perf_counter()
+        self._concurrent = concurrent
+        pending = list(self._stages.values())
+        running = {}
+        finished = set()
+        error = None
+        with ThreadPoolExecutor(max(1, len(pending))) as pool:
+            while pending or running:
+                if error is None:
+                    for stage in self._ready(pending, running, finished, concurrent):
+                        pending.remove(stage)
+                        running[pool.submit(self._run_one, run_stage, stage)] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    exc = future.exception()
+                    if exc is None:
+                        finished.add(stage.name)
+                    elif error is None:
+                        error = exc
+        if error is not None:
+            raise error
+
+    def _ready(self, pending, running, finished, concurrent):
+        if running and not concurrent:
+            return []
+        busy = any(s.exclusive for s in running.values())
+        ready = []
+        for stage in pending:
+            if not finished.issuperset(stage.deps):
+                continue
+            if stage.exclusive and busy:
+                continue
+            ready.append(stage)
+            busy = busy or stage.exclusive
+            if not concurrent:
+                break
+        if not ready and not running and pending:
+            raise ValueError("Stages cannot run: %s" % ", ".join(s.name for s in pending))
+        return ready
+
+    def _run_one(self, run_stage, stage):
+        stage.start = time.perf_counter() - self._t0
+        try:
+            run_stage(stage.name, stage.func)
+        finally:
+            stage.end = time.perf_counter() - self._t0
+
+    def critical_path(self, timing=None):
+        """
+        The chain of stages that determined the total run time. Walking back
+        from the stage that finished last, the predecessor of a stage is what
+        it waited for last: one of its dependencies, or, for an exclusive
+        stage, the exclusive stage that ran before it. Without concurrent,
+        every stage waited for the one before it.
+
+        :param dict timing: the (start, wall) time of the stages, by name, as
+            measured by the caller, e.g. the profiler. By default, the times
+            measured around run_stage are used.
+        :returns: the stages on the path, first to last, as dicts with the
+            name, the start and the wall time, in seconds.
+        :rtype: list
+        """
+        if timing is None:
+            timing = {s.name: (round(s.start, 6), round(s.end - s.start, 6))
+                      for s in self._stages.values() if s.end is not None}
+        done = [s for s in self._stages.values() if s.name in timing]
+        if not done:
+            return []
+
+        def end(s):
+            return sum(timing[s.name])
+        stage = max(done, key=end)
+        path = []
+        while stage is not None:
+            start, wall = timing[stage.name]
+            path.append({"stage": stage.name, "start_s": start, "wall_s": wall})
+            waited = [self._stages[dep] for dep in stage.deps]
+            if not self._concurrent:
+                waited += [s for s in done if s is not stage]
+            elif stage.exclusive:
+                waited += [s for s in done if s.exclusive and s is not stage]
+            waited = [s for s in waited if s in done and end(s) <= start]
+            stage = max(waited, key=end) if waited else None
+        path.reverse()
+        return path
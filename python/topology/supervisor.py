@@ -29,6 +29,7 @@ from topology.common import (
     COMMON_DIR,
     CS_CONFIG_NAME,
     DISP_CONFIG_NAME,
+    for_each_as,
     SD_CONFIG_NAME,
 )
 
@@ -49,10 +50,19 @@ class SupervisorGenerator(object):
 
     def generate(self):
         self._write_dispatcher_conf()
-        for topo_id, topo in self.args.topo_dicts.items():
-            base = topo_id.base_dir(self.args.output_dir)
-            entries = self._as_conf(topo, base)
-            self._write_as_conf(topo_id, entries)
+        for_each_as(self.args.jobs, self.generate_as, self.args.topo_dicts)
+
+    def finish(self):
+        """
+        Generate the configs that are not per AS, for the streaming mode.
+        """
+        self._write_dispatcher_conf()
+
+    def generate_as(self, topo_id):
+        topo = self.args.topo_dicts[topo_id]
+        base = topo_id.base_dir(self.args.output_dir)
+        entries = self._as_conf(topo, base)
+        self._write_as_conf(topo_id, entries)
 
     def _as_conf(self, topo, base):
         entries = []
@@ -62,14 +72,14 @@ class SupervisorGenerator(object):
 
     def _br_entries(self, topo, cmd, base):
         entries = []
-        for k, v in topo.get("border_routers", {}).items():
+        for k in topo.border_routers:
             conf = os.path.join(base, k, BR_CONFIG_NAME)
             entries.append((k, [cmd, "-config", conf]))
         return entries
 
     def _control_service_entries(self, topo, base):
         entries = []
-        for k, v in topo.get("control_service", {}).items():
+        for k in topo.control_service:
             # only a single control service instance per AS is currently supported
             if k.endswith("-1"):
                 conf = os.path.join(base, k, CS_CONFIG_NAME)
@@ -0,0 +1,86 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`templates` --- Compiled TOML config templates
+===================================================
+"""
+# Stdlib
+import re
+
+# External packages
+import toml
+
+_MARKER = "@@%s@@"
+_MARKER_RE = re.compile(r"@@(\w+)@@")
+# Strings that toml.dumps writes verbatim between the quotes.
+_VERBATIM_RE = re.compile(r"[-\w ./:\[\]]*", re.ASCII)
+
+
+class TomlTemplate(object):
+    """
+    A TOML document in which only some string fields differ between instances.
+
+    The document is rendered once by toml.dumps, with markers in place of the
+    fields, and split into literal text and fields. Rendering an instance then
+    only joins strings. Instances whose fields toml.dumps would escape, or
+    that are not strings, are rendered by toml.dumps instead, so the output is
+    always the same as toml.dumps(build(fields)).
+    """
+
+    def __init__(self, build, names):
+        """
+        :param build: function from a dict of fields to the document, as dict.
+        :param names: the names of the fields.
+        """
+        self._build = build
+        text = toml.dumps(build({name: _MARKER % name for name in names}))
+        parts = _MARKER_RE.split(text)
+        self._literals = parts[0::2]
+        self._names = parts[1::2]
+
+    def render(self, fields):
+        """
+        :param dict fields: the fields of the instance.
+        :rtype: str
+        """
+        out = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            value = fields[name]
+            if not isinstance(value, str) or not _VERBATIM_RE.fullmatch(value):
+                return toml.dumps(self._build(fields))
+            out.append(value)
+            out.append(literal)
+        return "".join(out)
+
+
+class TemplateCache(object):
+    """
+    Compiles a TomlTemplate per kind of document on first use.
+    """
+
+    def __init__(self):
+        self._templates = {}
+
+    def render(self, kind, build, fields):
+        """
+        :param str kind: the kind of document, e.g. "br".
+        :param build: function from a dict of fields to the document, as dict.
+            It must return the same structure for all fields of a kind.
+        :param dict fields: the fields of the instance.
+        :rtype: str
+        """
+        tmpl = self._templates.get(kind)
+        if tmpl is None:
+            tmpl = self._templates[kind] = TomlTemplate(build, list(fields))
+        return tmpl.render(fields)
@@ -17,16 +17,12 @@
 =============================================
 """
 # Stdlib
-import json
 import logging
 import os
 import random
 import sys
 from collections import defaultdict
 
-# External packages
-import yaml
-
 # SCION
 from lib.defines import (
     AS_LIST_FILE,
@@ -37,16 +33,28 @@ from lib.defines import (
     TOPO_FILE,
 )
 from lib.types import LinkType
-from lib.util import write_file
+from lib.util import dump_json, dump_yaml, write_file
 from topology.common import (
     ArgsBase,
+    for_each_as,
     join_host_port,
     json_default,
     SCION_SERVICE_NAMES,
+    seeded_random,
     srv_iter,
     TopoID
 )
-from topology.net import PortGenerator
+from topology.net import (
+    parse_port_ranges,
+    PortGenerator,
+)
+from topology.plan import (
+    AS,
+    BorderRouter,
+    Interface,
+    Service,
+    TopoPlan,
+)
 
 DEFAULT_LINK_BW = 1000
 
@@ -78,7 +86,8 @@ class TopoGenArgs(ArgsBase):
             ADDR_TYPE_6: subnet_gen6,
         }
         self.default_mtu = default_mtu
-        self.port_gen = PortGenerator()
+        self.port_gen = PortGenerator(parse_port_ranges(args.port_ranges), args.port_reuse,
+                                      args.host.ephemeral_ports, args.skip_ephemeral_ports)
 
 
 class TopoGenerator(object):
@@ -87,95 +96,128 @@ class TopoGenerator(object):
         :param TopoGenArgs args: Contains the passed command line arguments.
         """
         self.args = args
-        self.topo_dicts = {}
         self.hosts = []
         self.virt_addrs = set()
         self.as_list = defaultdict(list)
         self.links = defaultdict(list)
         self.ifid_map = {}
+        self.plan = TopoPlan()
 
     def _reg_addr(self, topo_id, elem_id, addr_type):
         subnet = self.args.subnet_gen[addr_type].register(topo_id)
         return subnet.register(elem_id)
 
-    def _reg_link_addrs(self, local_br, remote_br, local_ifid, remote_ifid, addr_type):
-        link_name = str(sorted((local_br, remote_br)))
-        link_name += str(sorted((local_ifid, remote_ifid)))
+    def _reg_link_addrs(self, a_br, b_br, a_ifid, b_ifid, addr_type):
+        link_name = str(sorted((a_br, b_br)))
+        link_name += str(sorted((a_ifid, b_ifid)))
         subnet = self.args.subnet_gen[addr_type].register(link_name)
-        return subnet.register(local_br), subnet.register(remote_br)
+        return subnet.register(a_br), subnet.register(b_br)
 
     def _iterate(self, f):
         for isd_as, as_conf in self.args.topo_config_dict["ASes"].items():
-            f(TopoID(isd_as), as_conf)
+            f(TopoID.intern(isd_as), as_conf)
 
     def generate(self):
+        networks = self.plan_topology()
+        self._write_as_topos()
+        self._write_as_list()
+        self._write_ifids()
+        return self.plan.ases, networks
+
+    def plan_topology(self):
+        """
+        Plan all ASes and allocate their addresses and ports, without writing
+        any files.
+
+        :returns: the allocated networks.
+        :rtype: dict
+        """
         self._read_links()
-        # in a first step we allocate all networks, so that we can later use
-        # the IPs in the generate functions.
-        self._iterate(self._register_addrs)
+        # in a first step we plan all elements and register their addresses,
+        # so that all networks can be allocated before the topologies are generated.
+        self._iterate(self._plan_as)
         networks = {}
         for k, v in self.args.subnet_gen[ADDR_TYPE_4].alloc_subnets().items():
             networks[k] = v
         for k, v in self.args.subnet_gen[ADDR_TYPE_6].alloc_subnets().items():
             networks[k] = v
-        self._iterate(self._generate_as_topo)
+        self.plan.assign_ports(self.args.port_gen)
         self._iterate(self._generate_as_list)
-        self._write_as_topos()
+        return networks
+
+    def write_global_files(self):
+        """
+        Write the files that cover all ASes, and release the link state, which
+        the AS plans no longer need.
+        """
         self._write_as_list()
         self._write_ifids()
-        return self.topo_dicts, networks
+        self.links = defaultdict(list)
+        self.ifid_map = {}
+        self.as_list = defaultdict(list)
 
-    def _register_addrs(self, topo_id, as_conf):
-        self._register_srv_entries(topo_id, as_conf)
-        self._register_br_entries(topo_id, as_conf)
+    def _plan_as(self, topo_id, as_conf):
+        mtu = as_conf.get('mtu', self.args.default_mtu)
+        assert mtu >= SCION_MIN_MTU, mtu
+        attributes = []
+        for attr in ['authoritative', 'core', 'issuing', 'voting']:
+            if as_conf.get(attr, False):
+                attributes.append(attr)
+        as_plan = AS(topo_id, mtu, attributes)
+        self.plan.ases[topo_id] = as_plan
+        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
+        file_fmt = topo_id.file_fmt()
+        self._plan_srv_entries(as_plan, as_conf, addr_type, file_fmt)
+        self._plan_br_entries(as_plan, addr_type)
         if self.args.sig:
-            self._register_sig(topo_id, as_conf)
-        self._register_sciond(topo_id, as_conf)
+            self._plan_sig(as_plan, addr_type, file_fmt)
+        self._plan_sciond(as_plan, addr_type, file_fmt)
 
-    def _register_srv_entries(self, topo_id, as_conf):
-        srvs = [("control_servers", DEFAULT_CONTROL_SERVERS, "cs")]
+    def _plan_srv_entries(self, as_plan, as_conf, addr_type, file_fmt):
+        srvs = [("control_servers", DEFAULT_CONTROL_SERVERS, "cs", "control_service")]
         if self.args.colibri:
-            srvs.append(("colibri_servers", DEFAULT_COLIBRI_SERVERS, "co"))
-        for conf_key, def_num, nick in srvs:
-            self._register_srv_entry(topo_id, as_conf, conf_key, def_num, nick)
-
-    def _register_srv_entry(self, topo_id, as_conf, conf_key, def_num, nick):
-        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
-        count = self._srv_count(as_conf, conf_key, def_num)
-        for i in range(1, count + 1):
-            elem_id = "%s%s-%s" % (nick, topo_id.file_fmt(), i)
-            if not self.args.docker:
-                self.args.port_gen.register(elem_id)
-            self._reg_addr(topo_id, elem_id, addr_type)
-
-    def _register_br_entries(self, topo_id, as_conf):
-        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
-        for (linkto, remote, attrs, l_br, r_br, l_ifid, r_ifid) in self.links[topo_id]:
-            self._register_br_entry(topo_id, l_ifid, remote, r_ifid,
-                                    linkto, attrs, l_br, r_br, addr_type)
-
-    def _register_br_entry(self, local, l_ifid, remote, r_ifid, remote_type, attrs,
-                           local_br, remote_br, addr_type):
-        link_addr_type = addr_type_from_underlay(attrs.get('underlay', DEFAULT_UNDERLAY))
-        self._reg_link_addrs(local_br, remote_br, l_ifid, r_ifid, link_addr_type)
-        self._reg_addr(local, local_br + "_ctrl", addr_type)
-        if self.args.docker:
-            self._reg_addr(local, local_br + "_internal", addr_type)
+            srvs.append(("colibri_servers", DEFAULT_COLIBRI_SERVERS, "co", "colibri_service"))
+        for conf_key, def_num, nick, topo_key in srvs:
+            srv_dict = getattr(as_plan, topo_key)
+            count = self._srv_count(as_conf, conf_key, def_num)
+            for i in range(1, count + 1):
+                elem_id = "%s%s-%s" % (nick, file_fmt, i)
+                addr = self._reg_addr(as_plan.topo_id, elem_id, addr_type)
+                srv = Service(elem_id, addr, self._default_ctrl_port(nick))
+                if not self.args.docker:
+                    self.plan.add_port_slot(srv, "port", elem_id, addr)
+                srv_dict[elem_id] = srv
+
+    def _plan_br_entries(self, as_plan, addr_type):
+        topo_id = as_plan.topo_id
+        for (linkto, remote, attrs, l_br, l_ifid, public, remote_addr) in self.links[topo_id]:
+            br = as_plan.border_routers.get(l_br)
+            if br is None:
+                ctrl = internal = self._reg_addr(topo_id, l_br + "_ctrl", addr_type)
+                if self.args.docker:
+                    internal = self._reg_addr(topo_id, l_br + "_internal", addr_type)
+                br = BorderRouter(l_br, ctrl, internal, 30242, 30042)
+                if not self.args.docker:
+                    self.plan.add_port_slot(br, "ctrl_port", l_br + "_ctrl", ctrl)
+                    self.plan.add_port_slot(br, "internal_port", l_br + "_internal", internal)
+                as_plan.border_routers[l_br] = br
+            br.interfaces.append(
+                Interface(l_ifid, remote, linkto, attrs, public, remote_addr))
+
+    def _plan_sig(self, as_plan, addr_type, file_fmt):
+        elem_id = "sig" + file_fmt
+        addr = self._reg_addr(as_plan.topo_id, elem_id, addr_type)
+        sig = Service(elem_id, addr, 30256)
         if not self.args.docker:
-            self.args.port_gen.register(local_br + "_ctrl")
-            self.args.port_gen.register(local_br + "_internal")
-
-    def _register_sig(self, topo_id, as_conf):
-        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
-        self._reg_addr(topo_id, "sig" + topo_id.file_fmt(), addr_type)
+            self.plan.add_port_slot(sig, "port", elem_id, addr)
+        as_plan.sigs[elem_id] = sig
 
-    def _register_sciond(self, topo_id, as_conf):
-        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
-        self._reg_addr(topo_id, "sd" + topo_id.file_fmt(), addr_type)
+    def _plan_sciond(self, as_plan, addr_type, file_fmt):
+        as_plan.sciond = self._reg_addr(as_plan.topo_id, "sd" + file_fmt, addr_type)
         # Always register the tester element. This causes the generator to create a
         # bridge in the docker topology, which SCIOND, SIG (if enabled) and
         # client applications can use to communicate.
-        self._reg_addr(topo_id, "tester_" + topo_id.file_fmt(), addr_type)
+        as_plan.tester = self._reg_addr(as_plan.topo_id, "tester_" + file_fmt, addr_type)
 
     def _br_name(self, ep, assigned_br_id, br_ids, if_ids):
         br_name = ep.br_name()
@@ -201,7 +243,8 @@ class TopoGenerator(object):
     def _read_links(self):
         assigned_br_id = {}
         br_ids = defaultdict(int)
-        if_ids = defaultdict(lambda: IFIDGenerator())
+        rand = seeded_random(self.args.seed, "ifids")
+        if_ids = defaultdict(lambda: IFIDGenerator(rand))
         if not self.args.topo_config_dict.get("links", None):
             return
         for attrs in self.args.topo_config_dict["links"]:
@@ -213,8 +256,10 @@ class TopoGenerator(object):
                 linkto_b = LinkType.CHILD
             a_br, a_ifid = self._br_name(a, assigned_br_id, br_ids, if_ids)
             b_br, b_ifid = self._br_name(b, assigned_br_id, br_ids, if_ids)
-            self.links[a].append((linkto_b, b, attrs, a_br, b_br, a_ifid, b_ifid))
-            self.links[b].append((linkto_a, a, attrs, b_br, a_br, b_ifid, a_ifid))
+            addr_type = addr_type_from_underlay(attrs.get('underlay', DEFAULT_UNDERLAY))
+            a_addr, b_addr = self._reg_link_addrs(a_br, b_br, a_ifid, b_ifid, addr_type)
+            self.links[a].append((linkto_b, b, attrs, a_br, a_ifid, a_addr, b_addr))
+            self.links[b].append((linkto_a, a, attrs, b_br, b_ifid, b_addr, a_addr))
             a_desc = "%s %s" % (a_br, a_ifid)
             b_desc = "%s %s" % (b_br, b_ifid)
             self.ifid_map.setdefault(str(a), {})
@@ -222,48 +267,38 @@ class TopoGenerator(object):
             self.ifid_map.setdefault(str(b), {})
             self.ifid_map[str(b)][b_desc] = a_desc
 
-    def _generate_as_topo(self, topo_id, as_conf):
-        mtu = as_conf.get('mtu', self.args.default_mtu)
-        assert mtu >= SCION_MIN_MTU, mtu
-        attributes = []
-        for attr in ['authoritative', 'core', 'issuing', 'voting']:
-            if as_conf.get(attr, False):
-                attributes.append(attr)
-        self.topo_dicts[topo_id] = {
-            'attributes': attributes,
-            'isd_as': str(topo_id),
-            'mtu': mtu,
+    def _topo_dict(self, as_):
+        """
+        Build the topology.json form of an AS.
+
+        :param AS as_: the AS.
+        :rtype: dict
+        """
+        as_topo = {
+            'attributes': as_.attributes,
+            'isd_as': str(as_.topo_id),
+            'mtu': as_.mtu,
         }
         for i in SCION_SERVICE_NAMES:
-            self.topo_dicts[topo_id][i] = {}
-        self._gen_srv_entries(topo_id, as_conf)
-        self._gen_br_entries(topo_id, as_conf)
-        if self.args.sig:
-            self.topo_dicts[topo_id]['sigs'] = {}
-            self._gen_sig_entries(topo_id, as_conf)
-
-    def _gen_srv_entries(self, topo_id, as_conf):
-        srvs = [("control_servers", DEFAULT_CONTROL_SERVERS, "cs", "control_service")]
-        if self.args.colibri:
-            srvs.append(("colibri_servers", DEFAULT_COLIBRI_SERVERS, "co", "colibri_service"))
-        for conf_key, def_num, nick, topo_key in srvs:
-            self._gen_srv_entry(topo_id, as_conf, conf_key, def_num, nick, topo_key)
-
-    def _gen_srv_entry(self, topo_id, as_conf, conf_key, def_num, nick,
-                       topo_key, uses_dispatcher=True):
-        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
-        count = self._srv_count(as_conf, conf_key, def_num)
-        for i in range(1, count + 1):
-            elem_id = "%s%s-%s" % (nick, topo_id.file_fmt(), i)
-
-            port = self._default_ctrl_port(nick)
-            if not self.args.docker:
-                port = self.args.port_gen.register(elem_id)
-
-            d = {
-                'addr': join_host_port(self._reg_addr(topo_id, elem_id, addr_type).ip, port),
+            as_topo[i] = {}
+        for srv_key in ('control_service', 'colibri_service'):
+            for elem_id, srv in getattr(as_, srv_key).items():
+                as_topo[srv_key][elem_id] = {
+                    'addr': join_host_port(srv.addr.ip, srv.port),
+                }
+        for name, br in as_.border_routers.items():
+            as_topo["border_routers"][name] = {
+                'ctrl_addr': join_host_port(br.ctrl.ip, br.ctrl_port),
+                'internal_addr': join_host_port(br.internal.ip, br.internal_port),
+                'interfaces': {intf.ifid: self._gen_br_intf(intf) for intf in br.interfaces},
             }
-            self.topo_dicts[topo_id][topo_key][elem_id] = d
+        if self.args.sig:
+            as_topo['sigs'] = {}
+            for elem_id, sig in as_.sigs.items():
+                as_topo['sigs'][elem_id] = {
+                    'Addr': join_host_port(sig.addr.ip, sig.port),
+                }
+        return as_topo
 
     def _default_ctrl_port(self, nick):
         if nick == "cs":
@@ -279,65 +314,19 @@ class TopoGenerator(object):
             count = 1
         return count
 
-    def _gen_br_entries(self, topo_id, as_conf):
-        addr_type = addr_type_from_underlay(as_conf.get('underlay', DEFAULT_UNDERLAY))
-        for (linkto, remote, attrs, l_br, r_br, l_ifid, r_ifid) in self.links[topo_id]:
-            self._gen_br_entry(topo_id, l_ifid, remote, r_ifid,
-                               linkto, attrs, l_br, r_br, addr_type)
-
-    def _gen_br_entry(self, local, l_ifid, remote, r_ifid, remote_type, attrs,
-                      local_br, remote_br, addr_type):
-        link_addr_type = addr_type_from_underlay(attrs.get('underlay', DEFAULT_UNDERLAY))
-        public_addr, remote_addr = self._reg_link_addrs(local_br, remote_br, l_ifid,
-                                                        r_ifid, link_addr_type)
-
-        ctrl_addr = int_addr = self._reg_addr(local, local_br + "_ctrl", addr_type)
-        if self.args.docker:
-            int_addr = self._reg_addr(local, local_br + "_internal", addr_type)
-
-        if self.topo_dicts[local]["border_routers"].get(local_br) is None:
-            ctrl_port = 30242
-            intl_port = 30042
-            if not self.args.docker:
-                ctrl_port = self.args.port_gen.register(local_br + "_ctrl")
-                intl_port = self.args.port_gen.register(local_br + "_internal")
-
-            self.topo_dicts[local]["border_routers"][local_br] = {
-                'ctrl_addr': join_host_port(ctrl_addr.ip, ctrl_port),
-                'internal_addr': join_host_port(int_addr.ip, intl_port),
-                'interfaces': {
-                    l_ifid: self._gen_br_intf(remote, public_addr, remote_addr, attrs, remote_type)
-                }
-            }
-        else:
-            # There is already a BR entry, add interface
-            intf = self._gen_br_intf(remote, public_addr, remote_addr, attrs, remote_type)
-            self.topo_dicts[local]["border_routers"][local_br]['interfaces'][l_ifid] = intf
-
-    def _gen_br_intf(self, remote, public_addr, remote_addr, attrs, remote_type):
+    def _gen_br_intf(self, intf):
+        attrs = intf.attrs
         return {
             'underlay': {
-                'public': join_host_port(public_addr.ip, SCION_ROUTER_PORT),
-                'remote': join_host_port(remote_addr.ip, SCION_ROUTER_PORT),
+                'public': join_host_port(intf.public.ip, SCION_ROUTER_PORT),
+                'remote': join_host_port(intf.remote_addr.ip, SCION_ROUTER_PORT),
             },
             'bandwidth': attrs.get('bw', DEFAULT_LINK_BW),
-            'isd_as': str(remote),
-            'link_to': LinkType.to_str(remote_type.lower()),
+            'isd_as': str(intf.remote),
+            'link_to': LinkType.to_str(intf.link_to.lower()),
             'mtu': attrs.get('mtu', DEFAULT_MTU)
         }
 
-    def _gen_sig_entries(self, topo_id, as_conf):
-        addr_type = addr_type_from_underlay(DEFAULT_UNDERLAY)
-        elem_id = "sig" + topo_id.file_fmt()
-        reg_id = "sig" + topo_id.file_fmt()
-        port = 30256
-        if not self.args.docker:
-            port = self.args.port_gen.register(elem_id)
-        d = {
-            'Addr': join_host_port(self._reg_addr(topo_id, reg_id, addr_type).ip, port),
-        }
-        self.topo_dicts[topo_id]['sigs'][elem_id] = d
-
     def _generate_as_list(self, topo_id, as_conf):
         if as_conf.get('core', False):
             key = "Core"
@@ -346,24 +335,27 @@ class TopoGenerator(object):
         self.as_list[key].append(str(topo_id))
 
     def _write_as_topos(self):
-        for topo_id, as_topo, base in srv_iter(
-                self.topo_dicts, self.args.output_dir, common=True):
-            path = os.path.join(base, TOPO_FILE)
-            contents_json = json.dumps(self.topo_dicts[topo_id],
-                                       default=json_default, indent=2)
-            write_file(path, contents_json + '\n')
+        for_each_as(self.args.jobs, self.write_as_topo, self.plan.ases)
+
+    def write_as_topo(self, topo_id):
+        as_ = self.plan.ases[topo_id]
+        contents_json = dump_json(self._topo_dict(as_), default=json_default, indent=2)
+        for _, _, base in srv_iter({topo_id: as_}, self.args.output_dir, common=True):
+            write_file(os.path.join(base, TOPO_FILE), contents_json + '\n')
 
     def _write_as_list(self):
         list_path = os.path.join(self.args.output_dir, AS_LIST_FILE)
-        write_file(list_path, yaml.dump(dict(self.as_list)))
+        write_file(list_path, dump_yaml(dict(self.as_list)))
 
     def _write_ifids(self):
         list_path = os.path.join(self.args.output_dir, IFIDS_FILE)
-        write_file(list_path, yaml.dump(self.ifid_map,
+        write_file(list_path, dump_yaml(self.ifid_map,
                                         default_flow_style=False))
 
 
 class LinkEP(TopoID):
+    __slots__ = ("_brid", "ifid")
+
     def __init__(self, raw):
         self._brid = None
         self.ifid = None
@@ -386,26 +378,49 @@ class LinkEP(TopoID):
 
 class IFIDGenerator(object):
     """Generates unique interface IDs"""
+    MAX_IFID = 4095
 
-    def __init__(self):
-        self._ifids = set()
+    def __init__(self, rand=random):
+        """
+        :param rand: the random.Random instance to draw new IFIDs from.
+        """
+        self._rand = rand
+        # All unused IFIDs, and the position of every IFID in that list (or -1
+        # once used), so that both drawing and claiming an IFID are O(1). Both
+        # only store the entries that differ from the initial list 1..MAX_IFID,
+        # as every AS has its own generator.
+        self._nfree = self.MAX_IFID
+        self._free = {}
+        self._pos = {}
 
     def new(self):
-        while True:
-            ifid = random.randrange(1, 4096)
-            if ifid in self._ifids:
-                continue
-            self.add(ifid)
-            return ifid
+        if not self._nfree:
+            logging.critical("No IFIDs left, at most %d interfaces are supported!" %
+                             self.MAX_IFID)
+            exit(1)
+        idx = self._rand.randrange(self._nfree)
+        ifid = self._free.get(idx, idx + 1)
+        self._take(ifid)
+        return ifid
 
     def add(self, ifid):
-        if ifid in self._ifids:
-            logging.critical("IFID %d already exists!" % ifid)
-            exit(1)
-        if ifid < 1 or ifid > 4095:
+        if ifid < 1 or ifid > self.MAX_IFID:
             logging.critical("IFID %d is invalid!" % ifid)
             exit(1)
-        self._ifids.add(ifid)
+        if self._pos.get(ifid, ifid - 1) < 0:
+            logging.critical("IFID %d already exists!" % ifid)
+            exit(1)
+        self._take(ifid)
+
+    def _take(self, ifid):
+        # Move the last free IFID into the slot of the claimed one.
+        idx = self._pos.get(ifid, ifid - 1)
+        self._nfree -= 1
+        last = self._free.pop(self._nfree, self._nfree + 1)
+        if last != ifid:
+            self._free[idx] = last
+            self._pos[last] = idx
+        self._pos[ifid] = -1
 
 
 def addr_type_from_underlay(underlay: str) -> str:
@@ -0,0 +1,354 @@
+# Copyright 2020 ETH Zurich, Anapaya Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+:mod:`topo_cache` --- Cached loading of .topo files
+===================================================
+
+Parsing a large .topo file with YAML takes longer than some generator stages.
+load_topo_file keeps the parsed and validated config in a sidecar file next
+to the .topo file (.<name>.cache), and reuses it while the .topo file is
+unchanged: while its mtime and size match, or, if they changed, while its
+content hash matches.
+
+The config is stored with marshal, compressed. It only consists of dicts,
+lists and scalars, and unlike pickle, loading it cannot run code. Its strings
+are interned, so that the many repeated keys and AS ids are stored, and
+loaded, once.
+
+Without a valid cache, the file is parsed from the YAML events, building the
+links one at a time, without the node tree of the whole document.
+"""
+# Stdlib
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import zlib
+
+# External packages
+import yaml
+
+# SCION
+from lib.errors import SCIONIOError, SCIONParseError, SCIONYAMLError
+from lib.util import load_yaml_file, yaml_safe_loader
+
+#: Bump when the layout of the cache file, or the parsed config, changes.
+CACHE_VERSION = 1
+CACHE_MAGIC = b"SCNTOPO\n"
+#: The mtime of a .topo file that is this close to the time the cache was
+#: written may have changed again within the resolution of the file system
+#: timestamps, its hash is compared then.
+RACY_NS = 2 * 10**9
+
+_STR_TAG = "tag:yaml.org,2002:str"
+_MAP_TAG = "tag:yaml.org,2002:map"
+_SEQ_TAG = "tag:yaml.org,2002:seq"
+
+
+class _Unsupported(Exception):
+    """
+    The document uses YAML features the event parser does not implement
+    (merge keys, tagged collections). It is then loaded with yaml.load.
+    """
+
+
+def cache_path(topo_file):
+    """
+    :param str topo_file: the path of the .topo file.
+    :returns: the path of its sidecar cache.
+    """
+    head, tail = os.path.split(topo_file)
+    return os.path.join(head, ".%s.cache" % tail)
+
+
+def load_topo_file(topo_file, use_cache=True):
+    """
+    Load and validate a .topo file, through its sidecar cache.
+
+    :param str topo_file: the path of the .topo file.
+    :param bool use_cache: whether to read and write the sidecar cache.
+    :returns: the topology config. It is not shared with other callers, and
+        may be modified.
+    :rtype: dict
+    :raises:
+        lib.errors.SCIONIOError: error opening/reading from file.
+        lib.errors.SCIONYAMLError: error parsing file.
+        lib.errors.SCIONParseError: the file is not a topology config.
+    """
+    try:
+        st = os.stat(topo_file)
+    except OSError as e:
+        raise SCIONIOError("Error opening '%s': %s" % (topo_file, e.strerror)) from None
+    if not use_cache:
+        return _parse(topo_file)
+    path = cache_path(topo_file)
+    digest = None
+    try:
+        entry = _read_cache(path)
+    except (OSError, ValueError, EOFError, TypeError, zlib.error):
+        entry = None
+    if entry is not None:
+        header, cache_mtime, payload = entry
+        if header[1:3] == (st.st_mtime_ns, st.st_size) and \
+                st.st_mtime_ns < cache_mtime - RACY_NS:
+            return _unpack(payload)
+        digest = _file_hash(topo_file)
+        if header[3] == digest:
+            config = _unpack(payload)
+            # Record the new mtime, so that the next run does not hash.
+            _write_cache(path, st, digest, config)
+            return config
+    # Hash before parsing, a concurrent edit then invalidates the cache.
+    digest = digest or _file_hash(topo_file)
+    config = _parse(topo_file)
+    _write_cache(path, st, digest, config)
+    return config
+
+
+def _parse(topo_file):
+    with _open(topo_file) as f:
+        parser = _EventParser(f, topo_file)
+        try:
+            config = {}
+            for key in parser.keys():
+                if key == "links":
+                    config[key] = [_check_link(link, topo_file) for link in parser.links()]
+                else:
+                    config[key] = parser.value()
+            return _validate(config, topo_file)
+        except _Unsupported:
+            pass
+        finally:
+            parser.dispose()
+    return _validate(load_yaml_file(topo_file), topo_file)
+
+
+def _open(topo_file):
+    try:
+        return open(topo_file)
+    except OSError as e:
+        raise SCIONIOError("Error opening '%s': %s" % (topo_file, e.strerror)) from None
+
+
+class _EventParser(object):
+    """
+    Builds the same objects as yaml.load with the safe loader, from the
+    events of the parser.
+    """
+
+    def __init__(self, stream, name):
+        self._loader = yaml_safe_loader()(stream)
+        self._name = name
+        self._anchors = {}
+
+    def dispose(self):
+        self._loader.dispose()
+
+    def keys(self):
+        """
+        Yield the keys of the top-level mapping. The value of each key must be
+        consumed, with value or links, before the next key.
+        """
+        self._expect(yaml.StreamStartEvent)
+        if self._peek(yaml.StreamEndEvent):
+            return
+        self._expect(yaml.DocumentStartEvent)
+        if not self._peek(yaml.MappingStartEvent):
+            raise SCIONParseError("Invalid topology config '%s': not a mapping" % self._name)
+        self._start_collection(self._next(), _MAP_TAG, None)
+        while not self._peek(yaml.MappingEndEvent):
+            yield self.value()
+        self._next()
+
+    def links(self):
+        """
+        Yield the items of the links sequence one at a time.
+        """
+        if not self._peek(yaml.SequenceStartEvent):
+            if self.value() is not None:
+                raise SCIONParseError("Invalid topology config '%s': links is not a list" %
+                                      self._name)
+            return
+        self._start_collection(self._next(), _SEQ_TAG, None)
+        while not self._peek(yaml.SequenceEndEvent):
+            yield self.value()
+        self._next()
+
+    def value(self):
+        event = self._next()
+        if isinstance(event, yaml.ScalarEvent):
+            value = self._scalar(event)
+        elif isinstance(event, yaml.AliasEvent):
+            if event.anchor not in self._anchors:
+                raise _Unsupported()
+            return self._anchors[event.anchor]
+        elif isinstance(event, yaml.MappingStartEvent):
+            value = self._start_collection(event, _MAP_TAG, {})
+            while not self._peek(yaml.MappingEndEvent):
+                key = self.value()
+                value[key] = self.value()
+            self._next()
+            return value
+        elif isinstance(event, yaml.SequenceStartEvent):
+            value = self._start_collection(event, _SEQ_TAG, [])
+            while not self._peek(yaml.SequenceEndEvent):
+                value.append(self.value())
+            self._next()
+            return value
+        else:
+            raise _Unsupported()
+        if event.anchor is not None:
+            self._anchors[event.anchor] = value
+        return value
+
+    def _start_collection(self, event, default_tag, value):
+        if event.tag not in (None, "!", default_tag):
+            raise _Unsupported()
+        if event.anchor is not None:
+            if value is None:
+                raise _Unsupported()
+            self._anchors[event.anchor] = value
+        return value
+
+    def _scalar(self, event):
+        loader = self._loader
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        if tag == _STR_TAG:
+            return sys.intern(event.value)
+        construct = loader.yaml_constructors.get(tag)
+        if construct is None or tag == "tag:yaml.org,2002:merge":
+            raise _Unsupported()
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, event.style)
+        return construct(loader, node)
+
+    def _peek(self, event_type):
+        try:
+            return self._loader.check_event(event_type)
+        except yaml.YAMLError as e:
+            raise SCIONYAMLError("Error parsing '%s': %s" % (self._name, e)) from None
+
+    def _next(self):
+        try:
+            return self._loader.get_event()
+        except yaml.YAMLError as e:
+            raise SCIONYAMLError("Error parsing '%s': %s" % (self._name, e)) from None
+
+    def _expect(self, event_type):
+        event = self._next()
+        if not isinstance(event, event_type):
+            raise _Unsupported()
+        return event
+
+
+def _validate(config, topo_file):
+    """
+    Check the structure the generator relies on.
+    """
+    if not isinstance(config, dict):
+        raise SCIONParseError("Invalid topology config '%s': not a mapping" % topo_file)
+    ases = config.get("ASes")
+    if not isinstance(ases, dict):
+        raise SCIONParseError("Invalid topology config '%s': no ASes" % topo_file)
+    for ia, as_conf in ases.items():
+        if as_conf is not None and not isinstance(as_conf, dict):
+            raise SCIONParseError("Invalid topology config '%s': AS %s is not a mapping" %
+                                  (topo_file, ia))
+    links = config.get("links")
+    if links is not None:
+        if not isinstance(links, list):
+            raise SCIONParseError("Invalid topology config '%s': links is not a list" %
+                                  topo_file)
+        for link in links:
+            _check_link(link, topo_file)
+    return config
+
+
+def _check_link(link, topo_file):
+    if not isinstance(link, dict) or not all(k in link for k in ("a", "b", "linkAtoB")):
+        raise SCIONParseError("Invalid topology config '%s': link %s needs a, b and linkAtoB" %
+                              (topo_file, link))
+    return link
+
+
+def _read_cache(path):
+    """
+    :returns: the header, the mtime of the cache file, and the compressed
+        config, or None if there is no cache of this version.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+        header = marshal.load(f)
+        if not isinstance(header, tuple) or len(header) != 4 or header[0] != CACHE_VERSION:
+            return None
+        return header, os.fstat(f.fileno()).st_mtime_ns, f.read()
+
+
+def _unpack(payload):
+    return marshal.loads(zlib.decompress(payload))
+
+
+def _write_cache(path, st, digest, config):
+    """
+    Write the cache file, if the directory of the .topo file is writable.
+    """
+    header = (CACHE_VERSION, st.st_mtime_ns, st.st_size, digest)
+    try:
+        payload = zlib.compress(marshal.dumps(_intern(config)), 1)
+    except ValueError:
+        # E.g. timestamps, which marshal does not support.
+        logging.debug("Not caching %s: unsupported values", path)
+        return
+    try:
+        fd, tmp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    except OSError as e:
+        logging.debug("Not caching %s: %s", path, e)
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(CACHE_MAGIC)
+            marshal.dump(header, f)
+            f.write(payload)
+        os.rename(tmp, path)
+    except OSError as e:
+        logging.debug("Not caching %s: %s", path, e)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def _intern(obj):
+    """
+    Intern the strings of the config, the event parser does that already.
+    """
+    if isinstance(obj, dict):
+        return {_intern(k): _intern(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_intern(v) for v in obj]
+    if isinstance(obj, str):
+        return sys.intern(obj)
+    return obj
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -18,12 +18,19 @@ cmd_topo_clean() {
     stop_jaeger
     rm -rf traces/*
     mkdir -p logs traces gen gen-cache
-    find gen gen-cache -mindepth 1 -maxdepth 1 -exec rm -r {} +
+    local dirs="gen gen-cache"
+    # With --keep-gen, gen/ is left in place for incremental regeneration.
+    [ "$1" = "--keep-gen" ] && dirs="gen-cache"
+    find $dirs -mindepth 1 -maxdepth 1 -exec rm -r {} +
 }
 
 cmd_topology() {
     set -e
-    cmd_topo_clean
+    local clean_args=()
+    for arg in "$@"; do
+        [ "$arg" = "--incremental" ] && clean_args=(--keep-gen)
+    done
+    cmd_topo_clean "${clean_args[@]}"
 
     # Build the necessary binaries.
     bazel build //:scion-topo
@@ -427,6 +434,7 @@ cmd_help() {
 	    $PROGRAM topology
 	        Create topology, configuration, and execution files.
 	        All arguments or options are passed to topology/generator.py
+	        With --incremental, gen/ is kept and only changed files are rewritten.
 	    $PROGRAM run [nobuild]
 	        Run network.
 	    $PROGRAM sciond ISD-AS [ADDR]